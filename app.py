@@ -5,26 +5,67 @@ Globibat CRM - Version Finale
 Application complète avec UI/UX moderne et toutes les fonctionnalités
 """
 
-from flask import Flask, render_template, redirect, url_for, request, jsonify, flash, session, send_file
+from flask import Flask, render_template, redirect, url_for, request, jsonify, flash, session, send_file, make_response, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user, AnonymousUserMixin, login_required, login_user, logout_user, UserMixin
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.util import ClauseAdapter
+from sqlalchemy.orm import joinedload, selectinload
 import os
+import random
+import re
 import sys
+import time
 from datetime import datetime, date, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from functools import wraps
+from functools import wraps, lru_cache
 import io
 from reportlab.lib.pagesizes import letter, A4
-from threading import Thread
+from threading import Thread, Event, Lock, Timer
+from queue import Queue, Empty, Full
+from collections import OrderedDict, deque, namedtuple
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
 import csv
+import hashlib
 import io as pyio
+import tempfile
+import zlib
+from openpyxl import Workbook
+from metriques import Registre, instrumenter_flask
+import base_sqlite
 
 # Configuration
+def url_base_de_donnees(defaut):
+    """DATABASE_URL si défini (postgres:// accepté comme alias de postgresql://), sinon `defaut`"""
+    url = os.environ.get('DATABASE_URL') or defaut
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def options_moteur(url):
+    """Options du pool SQLAlchemy (DB_POOL_*) ; rien pour une base SQLite en mémoire"""
+    if url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') in ('sqlite:', 'sqlite:/')):
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', '20')),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', '30')),
+    }
+    if not url.startswith('sqlite'):
+        # Serveur distant : vérifier les connexions avant usage et les renouveler
+        # avant les coupures côté serveur / pare-feu
+        options['pool_pre_ping'] = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+        options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    return options
+
 class Config:
     base_dir = os.path.dirname(os.path.abspath(__file__))
     instance_dir = os.path.join(base_dir, 'instance')
@@ -33,10 +74,63 @@ class Config:
     os.makedirs(uploads_dir, exist_ok=True)
     
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'globibat-crm-2025-secure-key'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(instance_dir, 'globibat_final.db').replace('\\', '/')
+    SQLALCHEMY_DATABASE_URI = url_base_de_donnees(
+        'sqlite:///' + os.path.join(instance_dir, 'globibat_final.db').replace('\\', '/'))
+    SQLALCHEMY_ENGINE_OPTIONS = options_moteur(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = uploads_dir
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
+    
+    # Réglages SQLite (voir base_sqlite.py) : WAL + PRAGMA et voie d'écriture unique
+    SQLITE_TUNING = os.environ.get('SQLITE_TUNING', '1').lower() in ('1', 'true', 'yes')
+    SQLITE_ECRIVAIN_UNIQUE = os.environ.get('SQLITE_ECRIVAIN_UNIQUE', '1').lower() in ('1', 'true', 'yes')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '20000'))
+    SQLITE_MMAP_SIZE_MB = int(os.environ.get('SQLITE_MMAP_SIZE_MB', '256'))
+    
+    # Badges : écriture groupée (group commit) pour absorber le rush du matin
+    BADGE_GROUP_COMMIT = os.environ.get('BADGE_GROUP_COMMIT', '0').lower() in ('1', 'true', 'yes')
+    BADGE_GROUP_COMMIT_MS = int(os.environ.get('BADGE_GROUP_COMMIT_MS', '5'))
+    BADGE_GROUP_COMMIT_MAX = int(os.environ.get('BADGE_GROUP_COMMIT_MAX', '200'))
+    # Nombre max d'employés gardés en cache pour les badges
+    EMPLOYE_CACHE_SIZE = int(os.environ.get('EMPLOYE_CACHE_SIZE', '5000'))
+    # Badges hors ligne : taille max d'un envoi et ancienneté max acceptée
+    BADGE_BATCH_MAX = int(os.environ.get('BADGE_BATCH_MAX', '500'))
+    BADGE_OFFLINE_MAX_DAYS = int(os.environ.get('BADGE_OFFLINE_MAX_DAYS', '7'))
+    # Historique des positions : tout garder N jours, puis un point par pas (minutes)
+    POSITIONS_RETENTION_JOURS = int(os.environ.get('POSITIONS_RETENTION_JOURS', '7'))
+    POSITIONS_PAS_ANCIEN_MINUTES = int(os.environ.get('POSITIONS_PAS_ANCIEN_MINUTES', '60'))
+    # Positions en attente d'écriture : au-delà, les plus anciennes sont abandonnées
+    POSITIONS_FILE_MAX = int(os.environ.get('POSITIONS_FILE_MAX', '20000'))
+    # Diffusion WebSocket : taille de la file et fenêtre de regroupement (ms)
+    WS_QUEUE_MAX = int(os.environ.get('WS_QUEUE_MAX', '1000'))
+    WS_COALESCE_MS = int(os.environ.get('WS_COALESCE_MS', '100'))
+    # Listes /api/* : taille de page par défaut et maximale (?limit=)
+    API_PAGE_DEFAULT = int(os.environ.get('API_PAGE_DEFAULT', '100'))
+    API_PAGE_MAX = int(os.environ.get('API_PAGE_MAX', '1000'))
+    # GET conditionnels (ETag) : versions de tables en mémoire, donc réservés à un
+    # processus unique ; désactivés si plusieurs workers (WEB_CONCURRENCY > 1)
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+    ETAG_ACTIF = os.environ.get('ETAG_ACTIF', '1').lower() in ('1', 'true', 'yes') and WEB_CONCURRENCY <= 1
+    # Durée de cache des KPIs du tableau de bord (secondes)
+    KPI_CACHE_TTL = int(os.environ.get('KPI_CACHE_TTL', '15'))
+    # Intervalle de réconciliation de la table des indicateurs (secondes)
+    KPI_RECONCILIATION_SECONDES = int(os.environ.get('KPI_RECONCILIATION_SECONDES', '3600'))
+    # Anti-rebond de l'envoi des KPIs aux tableaux de bord ouverts (ms)
+    KPI_PUSH_DEBOUNCE_MS = int(os.environ.get('KPI_PUSH_DEBOUNCE_MS', '1000'))
+    # Archives annuelles des pointages/avancements (SQLite) : dossier et années gardées en base
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(instance_dir, 'archives')
+    ARCHIVE_ANNEES_CHAUDES = int(os.environ.get('ARCHIVE_ANNEES_CHAUDES', '2'))
+    # Budget de requêtes SQL par requête HTTP (actif en TESTING ou si SQL_BUDGET_ACTIF=1)
+    SQL_BUDGET_ACTIF = os.environ.get('SQL_BUDGET_ACTIF', '0').lower() in ('1', 'true', 'yes')
+    SQL_BUDGET_DEFAUT = int(os.environ.get('SQL_BUDGET_DEFAUT', '25'))
+    # Profilage SQL par route (/api/_metrics/sql) : désactivé par défaut
+    SQL_PROFILING = os.environ.get('SQL_PROFILING', '0').lower() in ('1', 'true', 'yes')
+    SQL_PROFILING_ECHANTILLONS = int(os.environ.get('SQL_PROFILING_ECHANTILLONS', '500'))
+    SQL_PROFILING_TOP = int(os.environ.get('SQL_PROFILING_TOP', '10'))
+    # Jeton exigé par /metrics (Authorization: Bearer ...) ; vide = accès libre
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
 
 # Créer l'application
 app = Flask(__name__,
@@ -46,7 +140,15 @@ app = Flask(__name__,
 app.config.from_object(Config)
 
 # Initialiser les extensions
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options=base_sqlite.configurer(app))
+
+# Connexions SQLite ouvertes en mode URI : l'ATTACH "file:...?mode=ro" des
+# archives est ainsi en lecture seule même si SQLite n'est pas compilé avec
+# SQLITE_USE_URI (le nom serait sinon pris pour un chemin de fichier)
+@db.event.listens_for(Engine, 'do_connect')
+def sqlite_noms_uri(dialect, connection_record, cargs, cparams):
+    if dialect.name == 'sqlite':
+        cparams['uri'] = True
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
@@ -61,6 +163,310 @@ def add_security_headers(response):
     response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
     return response
 
+# ===== BUDGET DE REQUÊTES SQL =====
+# Garde-fou contre les N+1 : en mode test (app.testing ou SQL_BUDGET_ACTIF=1),
+# chaque requête HTTP compte ses instructions SQL et échoue si elle dépasse le
+# budget de sa route (@budget_sql, sinon SQL_BUDGET_DEFAUT). Les threads de
+# fond (écritures groupées, KPIs) ne sont pas comptés. Les réponses en flux
+# exécutent leurs requêtes après le contrôle et ne sont donc pas couvertes.
+# Le contrôle a lieu après la vue, donc après son commit : toute route qui
+# écrit doit avoir un budget juste (par élément pour les lots) ou être
+# exemptée avec @budget_sql(None), sinon elle répond 500 en test alors que
+# ses données sont enregistrées.
+
+class BudgetSqlDepasse(AssertionError):
+    """Une route a exécuté plus d'instructions SQL que son budget"""
+
+def budget_sql(max_requetes, par_element=0, elements=None):
+    """Budget d'instructions SQL d'une vue (à placer sous @app.route).
+    
+    max_requetes=None exempte la vue. Pour un lot, elements() donne le nombre
+    d'éléments de la requête HTTP et chacun ajoute par_element au budget.
+    """
+    def decorator(f):
+        if max_requetes is None or elements is None:
+            f.budget_sql = lambda: max_requetes
+        else:
+            f.budget_sql = lambda: max_requetes + par_element * elements()
+        return f
+    return decorator
+
+def budget_sql_actif():
+    return app.testing or app.config['SQL_BUDGET_ACTIF']
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def compter_requete_sql(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'requetes_sql' in g:
+        g.requetes_sql.append(statement)
+
+@app.before_request
+def demarrer_budget_sql():
+    if budget_sql_actif():
+        g.requetes_sql = []
+
+@app.after_request
+def verifier_budget_sql(response):
+    requetes = g.pop('requetes_sql', None)
+    if requetes is None or response.is_streamed:
+        return response
+    vue = app.view_functions.get(request.endpoint)
+    budget = vue.budget_sql() if hasattr(vue, 'budget_sql') else app.config['SQL_BUDGET_DEFAUT']
+    if budget is not None and len(requetes) > budget:
+        raise BudgetSqlDepasse(
+            f'{request.method} {request.path} : {len(requetes)} requêtes SQL '
+            f'(budget {budget})\n' + '\n'.join(requetes)
+        )
+    return response
+
+# ===== PROFILAGE SQL PAR ROUTE =====
+# Avec SQL_PROFILING=1, chaque requête HTTP mesure sa durée, le nombre et la
+# durée de ses instructions SQL ; les résultats sont agrégés en mémoire par
+# endpoint (réservoirs bornés) et exposés aux admins sur /api/_metrics/sql.
+# Les instructions sont normalisées (littéraux et listes IN remplacés par ?)
+# pour regrouper les variantes d'une même requête.
+
+@lru_cache(maxsize=2048)
+def normaliser_sql(statement):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', sql)
+    return ' '.join(sql.split())
+
+class StatsRoute:
+    """Agrégats d'un endpoint : compteurs, réservoir de durées, requêtes SQL les plus lentes"""
+    
+    def __init__(self, taille_reservoir, taille_top):
+        self.taille_reservoir = taille_reservoir
+        self.taille_top = taille_top
+        self.requetes = 0
+        self.duree_totale = 0.0
+        self.duree_max = 0.0
+        self.sql_nombre = 0
+        self.sql_duree = 0.0
+        self.reservoir = []
+        # SQL normalisé -> [exécutions, durée totale, durée max]
+        self.lentes = {}
+    
+    def ajouter(self, duree, instructions):
+        self.requetes += 1
+        self.duree_totale += duree
+        self.duree_max = max(self.duree_max, duree)
+        # Échantillonnage uniforme (algorithme R) : taille fixe quel que soit le trafic
+        if len(self.reservoir) < self.taille_reservoir:
+            self.reservoir.append(duree)
+        else:
+            i = random.randrange(self.requetes)
+            if i < self.taille_reservoir:
+                self.reservoir[i] = duree
+        for statement, duree_sql in instructions:
+            self.sql_nombre += 1
+            self.sql_duree += duree_sql
+            self._noter_lente(normaliser_sql(statement), duree_sql)
+    
+    def _noter_lente(self, sql, duree):
+        entree = self.lentes.get(sql)
+        if entree is None:
+            if len(self.lentes) >= self.taille_top:
+                plus_rapide = min(self.lentes, key=lambda k: self.lentes[k][2])
+                if self.lentes[plus_rapide][2] >= duree:
+                    return
+                del self.lentes[plus_rapide]
+            entree = self.lentes[sql] = [0, 0.0, 0.0]
+        entree[0] += 1
+        entree[1] += duree
+        entree[2] = max(entree[2], duree)
+    
+    def rapport(self):
+        echantillon = sorted(self.reservoir)
+        centile = lambda p: round(echantillon[min(len(echantillon) - 1, int(p * len(echantillon)))] * 1000, 2)
+        return {
+            'requetes': self.requetes,
+            'duree_moyenne_ms': round(self.duree_totale / self.requetes * 1000, 2),
+            'duree_p50_ms': centile(0.5),
+            'duree_p95_ms': centile(0.95),
+            'duree_max_ms': round(self.duree_max * 1000, 2),
+            'sql_par_requete': round(self.sql_nombre / self.requetes, 2),
+            'sql_ms_par_requete': round(self.sql_duree / self.requetes * 1000, 2),
+            'sql_lentes': [
+                {'sql': sql, 'executions': n, 'moyenne_ms': round(total / n * 1000, 2),
+                 'max_ms': round(maxi * 1000, 2)}
+                for sql, (n, total, maxi) in sorted(self.lentes.items(), key=lambda e: -e[1][2])
+            ],
+        }
+
+class ProfileurSql:
+    """Statistiques SQL et durée des requêtes HTTP, par endpoint"""
+    
+    def __init__(self, taille_reservoir, taille_top):
+        self.taille_reservoir = taille_reservoir
+        self.taille_top = taille_top
+        self.lock = Lock()
+        self.routes = {}
+        self.depuis = datetime.now()
+    
+    def ajouter(self, endpoint, duree, instructions):
+        with self.lock:
+            stats = self.routes.get(endpoint)
+            if stats is None:
+                stats = self.routes[endpoint] = StatsRoute(self.taille_reservoir, self.taille_top)
+            stats.ajouter(duree, instructions)
+    
+    def rapport(self):
+        with self.lock:
+            routes = {endpoint: stats.rapport() for endpoint, stats in self.routes.items()}
+        return {'depuis': self.depuis.isoformat(timespec='seconds'), 'routes': routes}
+    
+    def reinitialiser(self):
+        with self.lock:
+            self.routes = {}
+            self.depuis = datetime.now()
+
+profileur_sql = ProfileurSql(app.config['SQL_PROFILING_ECHANTILLONS'], app.config['SQL_PROFILING_TOP'])
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def chronometrer_requete_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'profil_sql' in g:
+        context.profil_debut = time.perf_counter()
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def enregistrer_requete_sql(conn, cursor, statement, parameters, context, executemany):
+    debut = getattr(context, 'profil_debut', None)
+    if debut is not None and has_request_context() and 'profil_sql' in g:
+        g.profil_sql.append((statement, time.perf_counter() - debut))
+
+@app.before_request
+def demarrer_profil_sql():
+    if app.config['SQL_PROFILING']:
+        g.profil_debut = time.perf_counter()
+        g.profil_sql = []
+
+@app.teardown_request
+def terminer_profil_sql(exc):
+    # teardown : après la fin d'une réponse en flux, et même en cas d'erreur
+    instructions = g.pop('profil_sql', None)
+    if instructions is not None:
+        profileur_sql.ajouter(request.endpoint or 'inconnu',
+                              time.perf_counter() - g.profil_debut, instructions)
+
+# ===== MÉTRIQUES PROMETHEUS =====
+# /metrics au format texte Prometheus (voir metriques.py : compteurs par thread,
+# sans verrou sur le chemin des requêtes). Les jauges (pool SQL, clients
+# Socket.IO) sont calculées au moment de la lecture.
+
+metriques = instrumenter_flask(app, Registre('globibat'), app.config['METRICS_TOKEN'])
+metrique_badges = metriques.compteur('badges_total', 'Badges enregistrés (rate() * 60 = badges par minute)', ('type',))
+metrique_pdf = metriques.histogramme('pdf_rendu_duree_secondes', 'Durée de génération des PDF', ('document',))
+metrique_export = metriques.histogramme('export_duree_secondes', 'Durée des exports de fichiers', ('export',))
+metrique_positions_perdues = metriques.compteur('positions_perdues_total',
+                                                'Positions abandonnées (file du PositionWriter pleine)')
+
+def etat_pool_sql():
+    pool = db.engine.pool
+    etats = {}
+    for etat, methode in (('taille', 'size'), ('utilisees', 'checkedout'),
+                          ('disponibles', 'checkedin'), ('debordement', 'overflow')):
+        if hasattr(pool, methode):
+            etats[(etat,)] = getattr(pool, methode)()
+    return etats
+
+def clients_socketio_par_salle():
+    clients = {}
+    for namespace, salles in socketio.server.manager.rooms.items():
+        for salle, sids in salles.items():
+            if salle in sids:
+                continue  # salle personnelle d'un client (= son sid)
+            clients[(namespace, salle or 'tous')] = len(sids)
+    return clients
+
+metriques.jauge('db_pool_connexions', 'Connexions du pool SQLAlchemy', ('etat',), etat_pool_sql)
+metriques.jauge('socketio_clients', 'Clients Socket.IO connectés par salle', ('namespace', 'salle'),
+                clients_socketio_par_salle)
+
+# ===== DIFFUSION WEBSOCKET =====
+# Les emits des routes passent par une file bornée vidée par un thread dédié :
+# un tableau de bord lent ne ralentit plus la requête (badge, avancement...).
+# Les rafales d'un même événement sont regroupées en une trame '<event>_batch'.
+
+class DiffuseurWebSocket:
+    """Thread de diffusion Socket.IO avec file bornée et regroupement des rafales"""
+    
+    def __init__(self, sio, taille_max=1000, fenetre_ms=100, seuil_retard_ms=1000):
+        self.socketio = sio
+        self.fenetre = fenetre_ms / 1000.0
+        self.seuil_retard = seuil_retard_ms / 1000.0
+        self.queue = Queue(maxsize=taille_max)
+        self.thread = None
+        self.lock = Lock()
+        self.compteurs = {'recus': 0, 'diffuses': 0, 'trames': 0, 'regroupes': 0,
+                          'perdus': 0, 'retardes': 0, 'erreurs': 0}
+        self.retard_max = 0.0
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._run, name='websocket-diffuseur', daemon=True)
+                self.thread.start()
+    
+    def emit(self, event, data, room=None):
+        """Met l'événement en file sans bloquer ; perdu (et compté) si la file est pleine"""
+        self.start()
+        try:
+            self.queue.put_nowait((event, data, room, time.monotonic()))
+            cle = 'recus'
+        except Full:
+            cle = 'perdus'
+        with self.lock:
+            self.compteurs[cle] += 1
+    
+    def _run(self):
+        while True:
+            lot = [self.queue.get()]
+            limite = time.monotonic() + self.fenetre
+            while True:
+                reste = limite - time.monotonic()
+                if reste <= 0:
+                    break
+                try:
+                    lot.append(self.queue.get(timeout=reste))
+                except Empty:
+                    break
+            self._diffuser(lot)
+    
+    def _diffuser(self, lot):
+        # Regrouper par (événement, room) en gardant l'ordre d'arrivée
+        groupes = OrderedDict()
+        for event, data, room, recu in lot:
+            groupes.setdefault((event, room), []).append((data, recu))
+        for (event, room), items in groupes.items():
+            try:
+                if len(items) == 1:
+                    self.socketio.emit(event, items[0][0], to=room)
+                else:
+                    self.socketio.emit(f'{event}_batch', {'events': [data for data, _ in items]}, to=room)
+                    self.compteurs['regroupes'] += len(items)
+            except Exception as e:
+                self.compteurs['erreurs'] += 1
+                print(f'[WARNING] Diffusion WebSocket {event}: {e}')
+                continue
+            self.compteurs['trames'] += 1
+            self.compteurs['diffuses'] += len(items)
+            maintenant = time.monotonic()
+            for _, recu in items:
+                retard = maintenant - recu
+                self.retard_max = max(self.retard_max, retard)
+                if retard > self.seuil_retard:
+                    self.compteurs['retardes'] += 1
+    
+    def stats(self):
+        return dict(self.compteurs,
+                    en_attente=self.queue.qsize(),
+                    capacite=self.queue.maxsize,
+                    retard_max_ms=round(self.retard_max * 1000, 1))
+
+diffuseur = DiffuseurWebSocket(socketio,
+                               taille_max=app.config['WS_QUEUE_MAX'],
+                               fenetre_ms=app.config['WS_COALESCE_MS'])
+
 # ===== MODÈLES =====
 
 class Admin(UserMixin, db.Model):
@@ -124,6 +530,35 @@ class Pointage(db.Model):
     retard_matin = db.Column(db.Boolean, default=False)
     retard_apres_midi = db.Column(db.Boolean, default=False)
     employe = db.relationship('Employe', backref='pointages')
+    
+    # Un seul pointage par employé et par jour (sert aussi d'index pour les badges)
+    __table_args__ = (
+        db.Index('ux_pointage_employe_date', 'employe_id', 'date_pointage', unique=True),
+    )
+
+# insert() avec on_conflict_do_update, par moteur pris en charge
+INSERTS_UPSERT = {'postgresql': pg_insert, 'sqlite': sqlite_insert}
+
+def insert_upsert():
+    """insert() du dialecte courant, avec on_conflict_do_update"""
+    try:
+        return INSERTS_UPSERT[db.engine.dialect.name]
+    except KeyError:
+        raise RuntimeError(
+            f'Moteur {db.engine.dialect.name} non pris en charge (upsert) : '
+            'utiliser SQLite ou PostgreSQL'
+        ) from None
+
+def pointage_du_jour(employe_id, jour):
+    """Trouve ou crée le pointage du jour en une seule requête (upsert atomique)"""
+    table = Pointage.__table__
+    stmt = insert_upsert()(table).values(employe_id=employe_id, date_pointage=jour)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.employe_id, table.c.date_pointage],
+        set_={'employe_id': stmt.excluded.employe_id}
+    ).returning(table.c.id)
+    pointage_id = db.session.execute(stmt).scalar_one()
+    return db.session.get(Pointage, pointage_id)
 
 class Client(db.Model):
     __tablename__ = 'client'
@@ -141,15 +576,20 @@ class Client(db.Model):
     notes = db.Column(db.Text)
 
 @app.route('/clients/<int:client_id>')
+@budget_sql(6)
 @login_required
 def client_detail(client_id: int):
-    client = db.session.get(Client, client_id)
+    # Les collections affichées par le template sont chargées en une requête chacune
+    client = db.session.get(Client, client_id, options=[
+        selectinload(Client.chantiers),
+        selectinload(Client.devis),
+        selectinload(Client.factures),
+    ])
     if not client:
         flash('Client introuvable', 'error')
         return redirect(url_for('clients'))
-    chantiers = Chantier.query.filter_by(client_id=client.id).all()
-    factures = Facture.query.filter_by(client_id=client.id).all()
-    return render_template('client_detail.html', client=client, chantiers=chantiers, factures=factures)
+    return render_template('client_detail.html', client=client,
+                           chantiers=client.chantiers, factures=client.factures)
 
 class Chantier(db.Model):
     __tablename__ = 'chantier'
@@ -247,6 +687,749 @@ class Absence(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class BadgeHorsLigne(db.Model):
+    """Badges reçus via /api/badge/batch (déduplication des renvois d'appareils)"""
+    __tablename__ = 'badge_hors_ligne'
+    id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(64), unique=True, nullable=False)  # identifiant généré par l'appareil
+    appareil = db.Column(db.String(100))
+    matricule = db.Column(db.String(50))
+    type_badge = db.Column(db.String(20))
+    horodatage = db.Column(db.DateTime, nullable=False)  # heure du badge sur l'appareil
+    succes = db.Column(db.Boolean, default=False)
+    message = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PositionEmploye(db.Model):
+    """Historique des positions (append-only), coordonnées en micro-degrés"""
+    __tablename__ = 'position_employe'
+    id = db.Column(db.Integer, primary_key=True)
+    employe_id = db.Column(db.Integer, db.ForeignKey('employe.id'), nullable=False)
+    horodatage = db.Column(db.DateTime, nullable=False, index=True)
+    latitude_e6 = db.Column(db.Integer, nullable=False)
+    longitude_e6 = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_position_employe_employe_horodatage', 'employe_id', 'horodatage'),
+    )
+
+# ===== NUMÉROTATION (devis, factures, matricules) =====
+# Un compteur par (type, année), incrémenté par un UPDATE ... RETURNING dans la
+# transaction de la création : le numéro est réservé par le verrou d'écriture
+# jusqu'au commit (pas de doublon entre créations concurrentes) et annulé avec
+# elle en cas de rollback (pas de trou). Au premier usage d'une année, le
+# compteur repart du plus grand numéro existant.
+
+class Compteur(db.Model):
+    __tablename__ = 'compteur'
+    type = db.Column(db.String(20), primary_key=True)
+    annee = db.Column(db.Integer, primary_key=True)  # 0 = sans remise à zéro annuelle
+    valeur = db.Column(db.Integer, nullable=False, default=0)
+
+# type -> (colonne numérotée, préfixe selon l'année, format complet)
+NUMEROTATIONS = {
+    'devis': (Devis.numero, lambda annee: f'DEV-{annee}-', '{prefixe}{valeur:04d}'),
+    'facture': (Facture.numero, lambda annee: f'FAC-{annee}-', '{prefixe}{valeur:04d}'),
+    'employe': (Employe.matricule, lambda annee: 'EMP', '{prefixe}{valeur:03d}'),
+}
+
+def _plus_grand_numero(colonne, prefixe):
+    """Plus grand suffixe numérique parmi les numéros existants (une fois par année)"""
+    plus_grand = 0
+    for (numero,) in db.session.execute(db.select(colonne).where(colonne.startswith(prefixe, autoescape=True))):
+        suffixe = numero[len(prefixe):]
+        if suffixe.isdigit():
+            plus_grand = max(plus_grand, int(suffixe))
+    return plus_grand
+
+def prochain_numero(type_, annee=None):
+    """Réserve et retourne le prochain numéro (ex. DEV-2025-0042) dans la transaction courante"""
+    colonne, prefixe_annee, modele = NUMEROTATIONS[type_]
+    if annee is None:
+        annee = date.today().year if type_ != 'employe' else 0
+    prefixe = prefixe_annee(annee)
+    table = Compteur.__table__
+    condition = (table.c.type == type_) & (table.c.annee == annee)
+    valeur = db.session.execute(
+        table.update().where(condition).values(valeur=table.c.valeur + 1).returning(table.c.valeur)
+    ).scalar()
+    if valeur is None:
+        stmt = insert_upsert()(table).values(
+            type=type_, annee=annee, valeur=_plus_grand_numero(colonne, prefixe) + 1)
+        valeur = db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.type, table.c.annee],
+            set_={'valeur': table.c.valeur + 1}
+        ).returning(table.c.valeur)).scalar_one()
+    return modele.format(prefixe=prefixe, valeur=valeur)
+
+# ===== LISTES API (pagination, filtres, projection) =====
+# Les listes /api/* acceptent :
+#   ?limit=&after=      pagination par curseur (id croissant), curseur suivant
+#                       renvoyé dans l'en-tête X-Next-Cursor
+#   ?fields=a,b         projection : seules ces colonnes sont lues en SQL
+#   filtres             actif, statut (liste séparée par des virgules),
+#                       client_id, employe_id, date_min / date_max
+# Sans limit ni after, la liste complète est renvoyée dans l'ordre historique,
+# en flux (morceaux JSON lus par yield_per) pour borner la mémoire.
+
+def iso(valeur):
+    return valeur.isoformat() if valeur else None
+
+class ListeApi:
+    """Liste JSON d'un modèle : colonnes projetées, filtres et pagination keyset"""
+    
+    def __init__(self, modele, champs, filtres=(), colonne_date=None, ordre=None):
+        self.modele = modele
+        # nom JSON -> (colonne, formatage)
+        self.champs = OrderedDict(
+            (nom, (getattr(modele, colonne), formatage))
+            for nom, colonne, formatage in champs
+        )
+        self.filtres = filtres
+        self.colonne_date = getattr(modele, colonne_date) if colonne_date else None
+        self.ordre = ordre or []
+    
+    def _noms_champs(self):
+        demandes = request.args.get('fields')
+        if not demandes:
+            return list(self.champs)
+        noms = [n.strip() for n in demandes.split(',') if n.strip() in self.champs]
+        if not noms:
+            raise ValueError('Aucun champ valide dans fields')
+        return noms
+    
+    def _filtrer(self, requete):
+        args = request.args
+        for nom in self.filtres:
+            valeur = args.get(nom)
+            if valeur is None or valeur == '':
+                continue
+            colonne = getattr(self.modele, nom)
+            if nom == 'actif':
+                requete = requete.where(colonne == (valeur.lower() in ('1', 'true', 'oui', 'yes')))
+            elif nom == 'statut':
+                requete = requete.where(colonne.in_(valeur.split(',')))
+            else:
+                requete = requete.where(colonne == int(valeur))
+        if self.colonne_date is not None:
+            if args.get('date_min'):
+                requete = requete.where(self.colonne_date >= datetime.strptime(args['date_min'], '%Y-%m-%d').date())
+            if args.get('date_max'):
+                requete = requete.where(self.colonne_date <= datetime.strptime(args['date_max'], '%Y-%m-%d').date())
+        return requete
+    
+    def requete(self):
+        """(select SQL, noms des champs, taille de page ou None) pour la requête HTTP courante"""
+        noms = self._noms_champs()
+        colonnes = [self.champs[nom][0] for nom in noms]
+        # L'id sert de curseur : toujours lu, même s'il n'est pas demandé
+        requete = self._filtrer(db.select(self.modele.id, *colonnes))
+        
+        after = request.args.get('after')
+        if after is None and 'limit' not in request.args:
+            return self._archives(requete.order_by(*self.ordre)), noms, None
+        
+        # limit invalide -> taille par défaut ; toujours entre 1 et API_PAGE_MAX
+        # (LIMIT -1 signifie "sans limite" pour SQLite)
+        limit = request.args.get('limit', app.config['API_PAGE_DEFAULT'], type=int)
+        limit = max(1, min(limit, app.config['API_PAGE_MAX']))
+        if after:
+            requete = requete.where(self.modele.id > int(after))
+        return self._archives(requete.order_by(self.modele.id).limit(limit)), noms, limit
+    
+    def _archives(self, requete):
+        """Étend la requête aux années archivées si date_min remonte jusqu'à elles"""
+        if self.colonne_date is None or not request.args.get('date_min'):
+            return requete
+        debut = datetime.strptime(request.args['date_min'], '%Y-%m-%d').date()
+        fin = datetime.strptime(request.args['date_max'], '%Y-%m-%d').date() if request.args.get('date_max') else None
+        return archives.adapter(requete, self.modele, debut, fin)
+    
+    def serialiser(self, ligne, noms):
+        return {nom: self.champs[nom][1](valeur) if self.champs[nom][1] else valeur
+                for nom, valeur in zip(noms, ligne[1:])}
+    
+    def flux(self, requete, noms, taille_lot=500):
+        """Tableau JSON produit par morceaux depuis un curseur yield_per"""
+        dumps = app.json.dumps
+        yield '['
+        premier = True
+        for lot in db.session.execute(requete.execution_options(yield_per=taille_lot)).partitions():
+            morceau = ','.join(dumps(self.serialiser(ligne, noms), separators=(',', ':')) for ligne in lot)
+            yield morceau if premier else ',' + morceau
+            premier = False
+        yield ']'
+    
+    def reponse(self):
+        try:
+            requete, noms, limit = self.requete()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Paramètres de liste invalides'}), 400
+        if limit is None:
+            # Liste complète : envoyée en flux, la mémoire ne dépend pas de la taille de la table
+            return app.response_class(stream_with_context(self.flux(requete, noms)),
+                                      mimetype='application/json')
+        lignes = db.session.execute(requete).all()
+        response = jsonify([self.serialiser(ligne, noms) for ligne in lignes])
+        if limit and len(lignes) == limit:
+            curseur = lignes[-1][0]
+            response.headers['X-Next-Cursor'] = str(curseur)
+            args = request.args.to_dict()
+            args['after'] = curseur
+            response.headers['Link'] = f'<{url_for(request.endpoint, _external=False, **args)}>; rel="next"'
+        return response
+
+LISTE_EMPLOYES = ListeApi(Employe, [
+    ('id', 'id', None), ('matricule', 'matricule', None), ('nom', 'nom', None),
+    ('prenom', 'prenom', None), ('departement', 'departement', None),
+    ('position', 'position', None), ('email', 'email', None),
+    ('telephone', 'telephone', None), ('actif', 'actif', None),
+], filtres=('actif',), colonne_date='date_embauche', ordre=[Employe.id])
+
+LISTE_CLIENTS = ListeApi(Client, [
+    ('id', 'id', None), ('nom', 'nom', None), ('type_client', 'type_client', None),
+    ('contact', 'contact', None), ('telephone', 'telephone', None),
+    ('email', 'email', None), ('ville', 'ville', None), ('actif', 'actif', None),
+], filtres=('actif',), colonne_date='date_creation', ordre=[Client.id])
+
+LISTE_DEVIS = ListeApi(Devis, [
+    ('id', 'id', None), ('numero', 'numero', None), ('client_id', 'client_id', None),
+    ('description', 'description', None), ('montant_ht', 'montant_ht', None),
+    ('tva', 'tva', None), ('montant_ttc', 'montant_ttc', None),
+    ('date_devis', 'date_devis', iso), ('statut', 'statut', None),
+], filtres=('statut', 'client_id'), colonne_date='date_devis', ordre=[Devis.date_devis.desc()])
+
+LISTE_FACTURES = ListeApi(Facture, [
+    ('id', 'id', None), ('numero', 'numero', None), ('client_id', 'client_id', None),
+    ('montant_ht', 'montant_ht', None), ('tva', 'tva', None),
+    ('montant_ttc', 'montant_ttc', None), ('date_facture', 'date_facture', iso),
+    ('date_echeance', 'date_echeance', iso), ('statut', 'statut', None),
+], filtres=('statut', 'client_id'), colonne_date='date_facture', ordre=[Facture.date_facture.desc()])
+
+LISTE_CHANTIERS = ListeApi(Chantier, [
+    ('id', 'id', None), ('nom', 'nom', None), ('client_id', 'client_id', None),
+    ('adresse', 'adresse', None), ('date_debut', 'date_debut', iso),
+    ('date_fin_prevue', 'date_fin_prevue', iso),
+    ('statut', 'statut', lambda s: s or 'planifie'),
+], filtres=('statut', 'client_id'), colonne_date='date_debut', ordre=[Chantier.date_debut.desc().nullslast()])
+
+LISTE_AVANCEMENTS = ListeApi(Avancement, [
+    ('id', 'id', None), ('employe_id', 'employe_id', None), ('tache', 'tache', None),
+    ('pourcentage', 'pourcentage', None), ('statut', 'statut', None),
+    ('date', 'date', iso),
+], filtres=('statut', 'employe_id', 'chantier_id'), colonne_date='date', ordre=[Avancement.date.desc()])
+
+LISTE_ABSENCES = ListeApi(Absence, [
+    ('id', 'id', None), ('employe_id', 'employe_id', None), ('type', 'type_absence', None),
+    ('debut', 'date_debut', iso), ('fin', 'date_fin', iso), ('statut', 'statut', None),
+], filtres=('statut', 'employe_id'), colonne_date='date_debut', ordre=[Absence.id])
+
+# ===== VERSIONS DES TABLES (ETag / GET conditionnel) =====
+# Chaque table a un compteur de version incrémenté au COMMIT de toute écriture
+# SQLAlchemy (ORM, UPDATE/INSERT groupés, upserts). Les GET décorés avec
+# @conditionnel calculent leur ETag à partir de ces compteurs : une donnée
+# inchangée répond 304 sans requête SQL ni sérialisation JSON.
+# Les compteurs sont en mémoire : valables pour un processus unique, comme le
+# serveur Socket.IO ; le jeton de démarrage invalide les ETags au redémarrage.
+# Avec plusieurs workers (WEB_CONCURRENCY > 1) ou processus partageant la base,
+# les écritures d'un autre processus ne changeraient pas ces compteurs :
+# ETAG_ACTIF est alors faux et @conditionnel sert toujours la réponse complète.
+# Seul l'ETag décide d'un 304 : If-Modified-Since (précision à la seconde) est
+# ignoré, une écriture dans la même seconde qu'un GET le rendrait périmé.
+# Toute écriture compte, quelle que soit la colonne : un écrivain fréquent dont
+# les colonnes ne sont lues par aucune vue @conditionnel ni par les KPIs doit
+# s'exclure avec execution_options(version_tables=False), sans quoi chacune
+# de ses écritures invalide les ETags et relance le calcul des KPIs.
+
+class VersionsTables:
+    """Compteurs de version et date de dernière modification par table"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.versions = {}
+        self.modifications = {}
+        self.jeton = os.urandom(4).hex()
+    
+    def incrementer(self, tables):
+        maintenant = datetime.utcnow().replace(microsecond=0)
+        with self.lock:
+            for table in tables:
+                self.versions[table] = self.versions.get(table, 0) + 1
+                self.modifications[table] = maintenant
+    
+    def etat(self, tables):
+        """(liste des versions, date de dernière modification ou None)"""
+        with self.lock:
+            versions = [self.versions.get(t, 0) for t in tables]
+            dates = [self.modifications[t] for t in tables if t in self.modifications]
+        return versions, max(dates) if dates else None
+
+versions_tables = VersionsTables()
+
+@db.event.listens_for(Engine, 'after_execute')
+def noter_table_modifiee(conn, clauseelement, multiparams, params, execution_options, result):
+    if isinstance(clauseelement, UpdateBase) and execution_options.get('version_tables', True):
+        conn.info.setdefault('tables_modifiees', set()).add(clauseelement.table.name)
+
+@db.event.listens_for(Engine, 'commit')
+def publier_tables_modifiees(conn):
+    tables = conn.info.pop('tables_modifiees', None)
+    if tables:
+        versions_tables.incrementer(tables)
+        if not tables.isdisjoint(TABLES_INDICATEURS):
+            pousseur_kpi.planifier()
+
+@db.event.listens_for(Engine, 'rollback')
+def oublier_tables_modifiees(conn):
+    conn.info.pop('tables_modifiees', None)
+
+def conditionnel(*tables, par_jour=False):
+    """GET conditionnel (ETag) d'une vue dépendant de `tables`.
+    
+    par_jour : la réponse dépend aussi de la date du jour (ex. CA du mois).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method != 'GET' or not app.config['ETAG_ACTIF']:
+                return f(*args, **kwargs)
+            versions, derniere_modif = versions_tables.etat(tables)
+            cle = f"{request.full_path}|{'-'.join(map(str, versions))}"
+            if par_jour:
+                cle += f'|{date.today().isoformat()}'
+            etag = f'{versions_tables.jeton}-{zlib.crc32(cle.encode()):08x}'
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if derniere_modif:
+                response.last_modified = derniere_modif
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated
+    return decorator
+
+# ===== INDICATEURS DU TABLEAU DE BORD =====
+# Les KPIs sont lus dans la ligne unique de indicateur_cumule (lecture par clé
+# primaire). Chaque flush ORM sur Employe, Client, Chantier, Lead ou Facture y
+# applique ses deltas dans la même transaction ; une réconciliation périodique
+# (KPI_RECONCILIATION_SECONDES) recalcule tout pour corriger une dérive
+# (écritures hors ORM, changement de mois pour le CA).
+
+TABLES_INDICATEURS = ('employe', 'client', 'chantier', 'lead', 'facture')
+COLONNES_INDICATEURS = ('employes_actifs', 'clients_actifs', 'chantiers_en_cours', 'leads_nouveaux',
+                        'factures_impayees', 'ca_mois', 'total_clients', 'total_employes')
+# Table source de chaque indicateur (version à incrémenter quand il est corrigé)
+TABLE_INDICATEUR = {
+    'employes_actifs': 'employe', 'total_employes': 'employe',
+    'clients_actifs': 'client', 'total_clients': 'client',
+    'chantiers_en_cours': 'chantier', 'leads_nouveaux': 'lead',
+    'factures_impayees': 'facture', 'ca_mois': 'facture',
+}
+
+class IndicateurCumule(db.Model):
+    __tablename__ = 'indicateur_cumule'
+    id = db.Column(db.Integer, primary_key=True)
+    mois = db.Column(db.Date, nullable=False)  # mois de référence de ca_mois
+    employes_actifs = db.Column(db.Integer, default=0)
+    clients_actifs = db.Column(db.Integer, default=0)
+    chantiers_en_cours = db.Column(db.Integer, default=0)
+    leads_nouveaux = db.Column(db.Integer, default=0)
+    factures_impayees = db.Column(db.Integer, default=0)
+    ca_mois = db.Column(db.Float, default=0)
+    total_clients = db.Column(db.Integer, default=0)
+    total_employes = db.Column(db.Integer, default=0)
+    reconcilie_le = db.Column(db.DateTime)
+
+def contribution_indicateurs(obj, valeur, mois):
+    """Part d'une ligne dans chaque indicateur (valeur(colonne) donne l'état voulu)"""
+    if isinstance(obj, Employe):
+        return {'total_employes': 1, 'employes_actifs': int(bool(valeur('actif')))}
+    if isinstance(obj, Client):
+        return {'total_clients': 1, 'clients_actifs': int(bool(valeur('actif')))}
+    if isinstance(obj, Chantier):
+        return {'chantiers_en_cours': int(valeur('statut') == 'en_cours')}
+    if isinstance(obj, Lead):
+        return {'leads_nouveaux': int(valeur('statut') == 'nouveau')}
+    if isinstance(obj, Facture):
+        date_facture = valeur('date_facture')
+        payee_du_mois = valeur('statut') == 'payee' and date_facture is not None and date_facture >= mois
+        return {'factures_impayees': int(valeur('statut') in ('envoyee', 'retard')),
+                'ca_mois': (valeur('montant_ttc') or 0) if payee_du_mois else 0}
+    return None
+
+def _valeur_actuelle(obj, nouveau):
+    def valeur(colonne):
+        v = getattr(obj, colonne)
+        if v is None and nouveau:
+            # Défaut Python de la colonne, appliqué seulement à l'INSERT
+            defaut = obj.__table__.c[colonne].default
+            if defaut is not None and defaut.is_scalar:
+                v = defaut.arg
+            elif defaut is not None and defaut.is_callable:
+                v = defaut.arg(None)
+        return v
+    return valeur
+
+def _valeur_avant(obj):
+    etat = db.inspect(obj)
+    def valeur(colonne):
+        historique = etat.attrs[colonne].history
+        if historique.deleted:
+            return historique.deleted[0]
+        return historique.unchanged[0] if historique.unchanged else getattr(obj, colonne)
+    return valeur
+
+@db.event.listens_for(db.session, 'before_flush')
+def calculer_deltas_indicateurs(sess, flush_context, instances):
+    mois = date.today().replace(day=1)
+    deltas = sess.info.setdefault('deltas_indicateurs', {})
+    
+    def ajouter(contribution, signe):
+        for colonne, valeur in (contribution or {}).items():
+            deltas[colonne] = deltas.get(colonne, 0) + signe * valeur
+    
+    for obj in sess.new:
+        ajouter(contribution_indicateurs(obj, _valeur_actuelle(obj, True), mois), 1)
+    for obj in sess.deleted:
+        ajouter(contribution_indicateurs(obj, _valeur_avant(obj), mois), -1)
+    for obj in sess.dirty:
+        if obj in sess.deleted or not sess.is_modified(obj):
+            continue
+        avant = contribution_indicateurs(obj, _valeur_avant(obj), mois)
+        if avant is not None:
+            ajouter(avant, -1)
+            ajouter(contribution_indicateurs(obj, _valeur_actuelle(obj, False), mois), 1)
+
+@db.event.listens_for(db.session, 'after_flush')
+def appliquer_deltas_indicateurs(sess, flush_context):
+    deltas = {c: d for c, d in sess.info.pop('deltas_indicateurs', {}).items() if d}
+    if not deltas:
+        return
+    table = IndicateurCumule.__table__
+    sess.connection().execute(
+        table.update().where(table.c.id == 1).values(
+            {colonne: table.c[colonne] + delta for colonne, delta in deltas.items()}
+        )
+    )
+
+@db.event.listens_for(db.session, 'after_rollback')
+def oublier_deltas_indicateurs(sess):
+    sess.info.pop('deltas_indicateurs', None)
+
+def calculer_indicateurs(mois):
+    """Recalcul complet des indicateurs en une seule requête agrégée"""
+    compter = lambda modele, *conditions: db.select(db.func.count(modele.id)).where(*conditions).scalar_subquery()
+    requete = db.select(
+        compter(Employe, Employe.actif.is_(True)).label('employes_actifs'),
+        compter(Client, Client.actif.is_(True)).label('clients_actifs'),
+        compter(Chantier, Chantier.statut == 'en_cours').label('chantiers_en_cours'),
+        compter(Lead, Lead.statut == 'nouveau').label('leads_nouveaux'),
+        compter(Facture, Facture.statut.in_(['envoyee', 'retard'])).label('factures_impayees'),
+        db.select(db.func.coalesce(db.func.sum(Facture.montant_ttc), 0)).where(
+            Facture.date_facture >= mois,
+            Facture.statut == 'payee'
+        ).scalar_subquery().label('ca_mois'),
+        compter(Client).label('total_clients'),
+        compter(Employe).label('total_employes'),
+    )
+    return dict(db.session.execute(requete).one()._mapping)
+
+def reconcilier_indicateurs():
+    """Réécrit la ligne cumulée à partir des tables ; retourne les écarts corrigés.
+    
+    La ligne est verrouillée par un UPDATE avant le comptage (voie d'écriture et
+    verrou d'écriture en SQLite, verrou de ligne en PostgreSQL) : comptage et
+    réécriture se font dans la même transaction d'écriture, aucun delta ne peut
+    s'appliquer entre les deux et être écrasé.
+    Une correction incrémente au commit la version des tables concernées : ETags
+    de /api/stats/dashboard et cache des KPIs ne servent plus l'ancienne valeur.
+    """
+    mois = date.today().replace(day=1)
+    table = IndicateurCumule.__table__
+    db.session.execute(table.update().where(table.c.id == 1).values(reconcilie_le=datetime.now()))
+    valeurs = calculer_indicateurs(mois)
+    cumul = db.session.get(IndicateurCumule, 1, populate_existing=True)
+    if cumul is None:
+        cumul = IndicateurCumule(id=1)
+        db.session.add(cumul)
+    ecarts = {c: valeurs[c] - (getattr(cumul, c) or 0) for c in COLONNES_INDICATEURS
+              if cumul.mois == mois and (getattr(cumul, c) or 0) != valeurs[c]}
+    for colonne, valeur in valeurs.items():
+        setattr(cumul, colonne, valeur)
+    cumul.mois = mois
+    cumul.reconcilie_le = datetime.now()
+    if ecarts:
+        # Publié par publier_tables_modifiees au commit, oublié en cas de rollback
+        db.session.connection().info.setdefault('tables_modifiees', set()).update(
+            TABLE_INDICATEUR[colonne] for colonne in ecarts)
+    db.session.commit()
+    return ecarts
+
+class IndicateursDashboard:
+    """KPIs du tableau de bord partagés par /dashboard et /api/stats/dashboard.
+    
+    Lecture de la ligne cumulée, mise en cache KPI_CACHE_TTL secondes ; toute
+    écriture commitée sur une des tables concernées (compteurs de
+    versions_tables) invalide le cache immédiatement.
+    """
+    
+    def __init__(self, ttl, intervalle_reconciliation):
+        self.ttl = ttl
+        self.intervalle_reconciliation = intervalle_reconciliation
+        self.lock = Lock()
+        self.cle = None
+        self.expiration = 0
+        self.valeurs = None
+        self.thread = None
+    
+    def _reconcilier_periodiquement(self):
+        with app.app_context():
+            while True:
+                time.sleep(self.intervalle_reconciliation)
+                try:
+                    ecarts = reconcilier_indicateurs()
+                    if ecarts:
+                        print(f'[WARNING] Indicateurs corrigés par la réconciliation: {ecarts}')
+                except Exception as e:
+                    db.session.rollback()
+                    print(f'[WARNING] Réconciliation des indicateurs: {e}')
+                finally:
+                    db.session.remove()
+    
+    def _lire(self, aujourd_hui):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._reconcilier_periodiquement,
+                                     name='kpi-reconciliation', daemon=True)
+                self.thread.start()
+        cumul = db.session.get(IndicateurCumule, 1, populate_existing=True)
+        if cumul is None or cumul.mois != aujourd_hui.replace(day=1):
+            reconcilier_indicateurs()
+            cumul = db.session.get(IndicateurCumule, 1)
+        valeurs = {colonne: getattr(cumul, colonne) or 0 for colonne in COLONNES_INDICATEURS}
+        valeurs['chantiers_actifs'] = valeurs['chantiers_en_cours']
+        return valeurs
+    
+    def get(self):
+        aujourd_hui = date.today()
+        cle = (tuple(versions_tables.etat(TABLES_INDICATEURS)[0]), aujourd_hui)
+        with self.lock:
+            if self.valeurs is not None and self.cle == cle and time.monotonic() < self.expiration:
+                return dict(self.valeurs)
+        valeurs = self._lire(aujourd_hui)
+        with self.lock:
+            self.cle, self.valeurs = cle, valeurs
+            self.expiration = time.monotonic() + self.ttl
+        return dict(valeurs)
+
+indicateurs_dashboard = IndicateursDashboard(app.config['KPI_CACHE_TTL'],
+                                             app.config['KPI_RECONCILIATION_SECONDES'])
+
+class PousseurKpi:
+    """Pousse les KPIs modifiés à la room Socket.IO 'dashboard' (avec anti-rebond).
+    
+    Une rafale d'écritures sur les tables des indicateurs ne déclenche qu'un
+    envoi, KPI_PUSH_DEBOUNCE_MS après la première ; seuls les indicateurs dont
+    la valeur a changé depuis le dernier envoi sont transmis.
+    """
+    
+    def __init__(self, delai_ms):
+        self.delai = delai_ms / 1000.0
+        self.lock = Lock()
+        self.timer = None
+        self.derniers = {}
+    
+    def planifier(self):
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = Timer(self.delai, self._pousser)
+            self.timer.daemon = True
+            self.timer.start()
+    
+    def _pousser(self):
+        with self.lock:
+            self.timer = None
+        with app.app_context():
+            try:
+                valeurs = indicateurs_dashboard.get()
+            except Exception as e:
+                print(f'[WARNING] Envoi des KPIs: {e}')
+                return
+            finally:
+                db.session.remove()
+        with self.lock:
+            deltas = {k: v for k, v in valeurs.items() if self.derniers.get(k) != v}
+            self.derniers = valeurs
+        if deltas:
+            diffuseur.emit('kpi_update', deltas, room='dashboard')
+
+pousseur_kpi = PousseurKpi(app.config['KPI_PUSH_DEBOUNCE_MS'])
+
+# ===== RECHERCHE GLOBALE (FTS5) =====
+# Index plein texte SQLite commun aux clients, leads, chantiers, devis et
+# factures, tenu à jour par des triggers (toute écriture, ORM ou SQL brut).
+# Le rowid encode la source : id * 8 + code du type, ce qui permet aux
+# triggers de mettre à jour une entrée sans parcourir l'index.
+# L'index est créé (et rempli à partir des données existantes) par
+# db.create_all() ; sur un autre moteur que SQLite, /api/search utilise une
+# recherche ILIKE portable sur les mêmes colonnes (sans index).
+
+# type -> (code, table, colonne titre, colonnes de contenu)
+SOURCES_RECHERCHE = OrderedDict([
+    ('client', (1, 'client', 'nom', ('contact', 'ville', 'notes'))),
+    ('lead', (2, 'lead', 'nom', ('entreprise', 'email'))),
+    ('chantier', (3, 'chantier', 'nom', ('adresse', 'description'))),
+    ('devis', (4, 'devis', 'numero', ('description',))),
+    ('facture', (5, 'facture', 'numero', ())),
+])
+TYPES_RECHERCHE = {code: type_ for type_, (code, *_reste) in SOURCES_RECHERCHE.items()}
+
+def _sql_entree_recherche(code, titre, contenu, alias):
+    """(rowid, type, titre, contenu) d'une ligne source en SQL"""
+    texte = " || ' ' || ".join(f"coalesce({alias}.{c}, '')" for c in contenu) or "''"
+    return f"{alias}.id * 8 + {code}, '{TYPES_RECHERCHE[code]}', {alias}.{titre}, {texte}"
+
+def ddl_recherche():
+    """Instructions de création de l'index et de ses triggers"""
+    instructions = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS recherche_index USING fts5("
+        "type UNINDEXED, titre, contenu, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ]
+    for code, table, titre, contenu in SOURCES_RECHERCHE.values():
+        inserer = (f"INSERT INTO recherche_index(rowid, type, titre, contenu) "
+                   f"VALUES ({_sql_entree_recherche(code, titre, contenu, 'new')});")
+        supprimer = f"DELETE FROM recherche_index WHERE rowid = old.id * 8 + {code};"
+        instructions += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_recherche_ai AFTER INSERT ON {table} "
+            f"BEGIN {inserer} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_recherche_au AFTER UPDATE ON {table} "
+            f"BEGIN {supprimer} {inserer} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_recherche_ad AFTER DELETE ON {table} "
+            f"BEGIN {supprimer} END",
+        ]
+    return instructions
+
+def reindexer_recherche(connection):
+    """Reconstruit tout l'index à partir des tables sources"""
+    connection.exec_driver_sql("DELETE FROM recherche_index")
+    for code, table, titre, contenu in SOURCES_RECHERCHE.values():
+        connection.exec_driver_sql(
+            f"INSERT INTO recherche_index(rowid, type, titre, contenu) "
+            f"SELECT {_sql_entree_recherche(code, titre, contenu, 's')} FROM {table} AS s"
+        )
+
+@db.event.listens_for(db.metadata, 'after_create')
+def creer_index_recherche(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    existe = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recherche_index'"
+    ).first()
+    for instruction in ddl_recherche():
+        connection.exec_driver_sql(instruction)
+    if not existe:
+        reindexer_recherche(connection)
+
+@db.event.listens_for(db.metadata, 'before_drop')
+def supprimer_index_recherche(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("DROP TABLE IF EXISTS recherche_index")
+
+def mots_recherche(texte):
+    return re.findall(r'\w+', texte, re.UNICODE)
+
+def requete_fts(mots):
+    """Mots -> requête FTS5 : chaque mot est un préfixe, tous requis.
+    Les mots sont cités pour neutraliser la syntaxe FTS (AND, *, ", ...)."""
+    return ' '.join(f'"{mot}"*' for mot in mots)
+
+def rechercher_fts(mots, types, limite):
+    """(type, id, titre, extrait, score) via l'index FTS5, classés par bm25"""
+    sql = ("SELECT rowid, type, titre, "
+           "snippet(recherche_index, 2, '', '', '…', 12), "
+           "bm25(recherche_index, 0.0, 10.0, 1.0) AS score "
+           "FROM recherche_index WHERE recherche_index MATCH :q")
+    params = {'q': requete_fts(mots), 'limite': limite}
+    if len(types) < len(SOURCES_RECHERCHE):
+        sql += " AND type IN (%s)" % ', '.join(f':t{i}' for i in range(len(types)))
+        params.update({f't{i}': t for i, t in enumerate(types)})
+    sql += " ORDER BY score LIMIT :limite"
+    for rowid, type_, titre, extrait, score in db.session.execute(db.text(sql), params):
+        yield type_, rowid // 8, titre, extrait, -score
+
+def rechercher_sql(mots, types, limite):
+    """Équivalent portable (PostgreSQL...) sans index plein texte : ILIKE sur les
+    mêmes colonnes, titre commençant par un mot > titre le contenant > contenu"""
+    selects = []
+    for type_ in types:
+        _code, nom_table, titre, contenu = SOURCES_RECHERCHE[type_]
+        table = db.metadata.tables[nom_table]
+        colonne_titre = table.c[titre]
+        colonnes_contenu = [table.c[c] for c in contenu]
+        texte = db.literal('')
+        for colonne in colonnes_contenu:
+            texte = texte + db.func.coalesce(colonne, '') + ' '
+        score = db.literal(0)
+        conditions = []
+        for mot in mots:
+            score = score + db.case(
+                (colonne_titre.istartswith(mot, autoescape=True), 10),
+                (colonne_titre.icontains(mot, autoescape=True), 5),
+                else_=1)
+            conditions.append(db.or_(*[c.icontains(mot, autoescape=True)
+                                       for c in [colonne_titre] + colonnes_contenu]))
+        selects.append(db.select(
+            db.literal(type_).label('type'), table.c.id.label('id'), colonne_titre.label('titre'),
+            texte.label('extrait'), score.label('score')
+        ).where(*conditions))
+    union = db.union_all(*selects).subquery()
+    requete = db.select(union).order_by(union.c.score.desc(), union.c.titre).limit(limite)
+    for type_, ref_id, titre, extrait, score in db.session.execute(requete):
+        yield type_, ref_id, titre, extrait.strip()[:160], float(score)
+
+URLS_RECHERCHE = {
+    'client': lambda ref_id: url_for('client_detail', client_id=ref_id),
+    'lead': lambda ref_id: url_for('leads'),
+    'chantier': lambda ref_id: url_for('chantier_detail', id=ref_id),
+    'devis': lambda ref_id: url_for('devis'),
+    'facture': lambda ref_id: url_for('factures'),
+}
+
+@app.route('/api/search')
+@login_required
+@conditionnel(*(table for _code, table, *_reste in SOURCES_RECHERCHE.values()))
+def api_search():
+    """Recherche globale classée (titre prioritaire), préfixes pour l'autocomplétion.
+
+    ?q=texte  ?type=client,lead,...  ?limit= (20 par défaut, 100 max)
+    """
+    mots = mots_recherche(request.args.get('q', ''))
+    if not mots:
+        return jsonify([])
+    try:
+        limite = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit invalide'}), 400
+    types = [t for t in request.args.get('type', '').split(',') if t in SOURCES_RECHERCHE]
+    types = types or list(SOURCES_RECHERCHE)
+
+    rechercher = rechercher_fts if db.engine.dialect.name == 'sqlite' else rechercher_sql
+    return jsonify([{
+        'type': type_,
+        'id': ref_id,
+        'titre': titre,
+        'extrait': extrait,
+        'score': round(score, 4),
+        'url': URLS_RECHERCHE[type_](ref_id),
+    } for type_, ref_id, titre, extrait, score in rechercher(mots, types, limite)])
+
 # ===== VUES SECONDAIRES/DETAILS =====
 
 @app.route('/employes/<int:employe_id>')
@@ -350,13 +1533,14 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Statistiques
+    # Statistiques (service partagé avec /api/stats/dashboard)
+    kpis = indicateurs_dashboard.get()
     stats = {
-        'nb_employes': Employe.query.filter_by(actif=True).count(),
-        'nb_clients': Client.query.filter_by(actif=True).count(),
-        'chantiers_actifs': Chantier.query.filter_by(statut='en_cours').count(),
-        'leads_nouveaux': Lead.query.filter_by(statut='nouveau').count(),
-        'factures_impayees': Facture.query.filter(Facture.statut.in_(['envoyee', 'retard'])).count()
+        'nb_employes': kpis['employes_actifs'],
+        'nb_clients': kpis['clients_actifs'],
+        'chantiers_actifs': kpis['chantiers_en_cours'],
+        'leads_nouveaux': kpis['leads_nouveaux'],
+        'factures_impayees': kpis['factures_impayees']
     }
     
     # Pointages du jour
@@ -392,17 +1576,24 @@ def employes():
                          departements=[d[0] for d in departements if d[0]])
 
 @app.route('/clients')
+@budget_sql(4)
 @login_required
 def clients():
-    clients = Client.query.order_by(Client.nom).all()
+    # Le template compte les chantiers et additionne les factures de chaque client
+    clients = Client.query.options(
+        selectinload(Client.chantiers), selectinload(Client.factures)
+    ).order_by(Client.nom).all()
     return render_template('clients.html', clients=clients)
 
 # Route déplacée plus haut dans le fichier pour éviter la duplication
 
 @app.route('/chantiers')
+@budget_sql(5)
 @login_required
 def chantiers():
-    chantiers = Chantier.query.order_by(Chantier.date_debut.desc()).all()
+    chantiers = Chantier.query.options(
+        joinedload(Chantier.client), joinedload(Chantier.chef_chantier)
+    ).order_by(Chantier.date_debut.desc()).all()
     clients = Client.query.filter_by(actif=True).all()
     chefs = Employe.query.filter_by(actif=True, departement='Construction').all()
     return render_template('chantiers.html', 
@@ -411,9 +1602,10 @@ def chantiers():
                          chefs=chefs)
 
 @app.route('/devis')
+@budget_sql(4)
 @login_required
 def devis():
-    devis_list = Devis.query.order_by(Devis.date_devis.desc()).all()
+    devis_list = Devis.query.options(joinedload(Devis.client)).order_by(Devis.date_devis.desc()).all()
     clients = Client.query.filter_by(actif=True).all()
     from datetime import date
     return render_template('devis.html', 
@@ -422,9 +1614,10 @@ def devis():
                          date=date)
 
 @app.route('/factures')
+@budget_sql(5)
 @login_required
 def factures():
-    factures = Facture.query.order_by(Facture.date_facture.desc()).all()
+    factures = Facture.query.options(joinedload(Facture.client)).order_by(Facture.date_facture.desc()).all()
     clients = Client.query.filter_by(actif=True).all()
     chantiers = Chantier.query.all()
     from datetime import date
@@ -450,15 +1643,24 @@ def avancements():
     return render_template('avancements.html', 
                          avancements=avancements,
                          employes=employes,
-                         chantiers=chantiers)
+                         chantiers=chantiers,
+                         date=date)
 
 @app.route('/api/avancements', methods=['GET', 'POST'])
 @login_required
+@conditionnel('avancement')
 def api_avancements():
     if request.method == 'POST':
         data = request.get_json()
+        try:
+            jour = datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else date.today()
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Date invalide (AAAA-MM-JJ)'}), 400
+        if archives.est_archivee(jour):
+            return jsonify(refus_annee_archivee(jour)), 409
         avancement = Avancement(
             employe_id=data['employe_id'],
+            date=jour,
             chantier_id=data.get('chantier_id'),
             tache=data['tache'],
             description=data.get('description'),
@@ -471,24 +1673,16 @@ def api_avancements():
         db.session.commit()
         
         # Notification WebSocket
-        socketio.emit('avancement_update', {
+        diffuseur.emit('avancement_update', {
             'employe': avancement.employe_id,
             'tache': avancement.tache,
             'pourcentage': avancement.pourcentage
-        }, broadcast=True)
+        })
         
         return jsonify({'success': True, 'id': avancement.id})
     
     # GET - Liste des avancements
-    avancements = Avancement.query.order_by(Avancement.date.desc()).all()
-    return jsonify([{
-        'id': a.id,
-        'employe_id': a.employe_id,
-        'tache': a.tache,
-        'pourcentage': a.pourcentage,
-        'statut': a.statut,
-        'date': a.date.isoformat()
-    } for a in avancements])
+    return LISTE_AVANCEMENTS.reponse()
 
 @app.route('/absences')
 @login_required
@@ -500,6 +1694,7 @@ def absences():
 
 @app.route('/api/absences', methods=['GET', 'POST', 'PUT'])
 @login_required
+@conditionnel('absence')
 def api_absences():
     if request.method == 'POST':
         data = request.get_json()
@@ -527,80 +1722,16 @@ def api_absences():
         return jsonify({'success': False, 'error': 'Absence non trouvée'}), 404
     
     # GET
-    absences = Absence.query.all()
-    return jsonify([{
-        'id': a.id,
-        'employe_id': a.employe_id,
-        'type': a.type_absence,
-        'debut': a.date_debut.isoformat(),
-        'fin': a.date_fin.isoformat(),
-        'statut': a.statut
-    } for a in absences])
+    return LISTE_ABSENCES.reponse()
 
 @app.route('/badges')
 @login_required
 def badges():
     aujourd_hui = date.today()
-    pointages = db.session.query(Pointage, Employe).join(Employe).filter(
-        Pointage.date_pointage == aujourd_hui
-    ).all()
-    
-    employes_actifs = Employe.query.filter_by(actif=True).all()
-    employes_badges = [p.employe_id for p, e in pointages]
-    absents = [e for e in employes_actifs if e.id not in employes_badges]
-    
-    # Calculer les statistiques
-    stats = {
-        'presents': len(pointages),
-        'retards': sum(1 for p, e in pointages if p.retard_matin or p.retard_apres_midi),
-        'absents': len(absents),
-        'total': len(employes_actifs)
-    }
-    
-    # Construire un historique récent des badges du jour
-    badges_events = []
-    for p, e in pointages:
-        if p.arrivee_matin:
-            badges_events.append({
-                'employe': e,
-                'type': 'arrivee_matin',
-                'timestamp': p.arrivee_matin,
-                'latitude': e.latitude,
-                'longitude': e.longitude,
-                'anomalie': bool(p.retard_matin)
-            })
-        if p.depart_midi:
-            badges_events.append({
-                'employe': e,
-                'type': 'depart_midi',
-                'timestamp': p.depart_midi,
-                'latitude': e.latitude,
-                'longitude': e.longitude,
-                'anomalie': False
-            })
-        if p.arrivee_apres_midi:
-            badges_events.append({
-                'employe': e,
-                'type': 'arrivee_apres_midi',
-                'timestamp': p.arrivee_apres_midi,
-                'latitude': e.latitude,
-                'longitude': e.longitude,
-                'anomalie': bool(p.retard_apres_midi)
-            })
-        if p.depart_soir:
-            badges_events.append({
-                'employe': e,
-                'type': 'depart_soir',
-                'timestamp': p.depart_soir,
-                'latitude': e.latitude,
-                'longitude': e.longitude,
-                'anomalie': False
-            })
-    badges_recent = sorted(badges_events, key=lambda b: b['timestamp'], reverse=True)[:20]
+    # Résumé maintenu à chaque badge : pas de rechargement des pointages du jour
+    stats, badges_recent = resume_presence.snapshot(aujourd_hui)
     
     return render_template('badges.html',
-                         pointages=pointages,
-                         absents=absents,
                          aujourd_hui=aujourd_hui,
                          stats=stats,
                          badges_recent=badges_recent)
@@ -646,189 +1777,656 @@ def badge_employee():
     """Interface de badge pour les employés (sans authentification requise)"""
     return render_template('badge_mobile_elite.html')
 
-@app.route('/api/badge/check', methods=['POST'])
-def badge_check():
-    """Enregistrer un pointage via matricule"""
-    try:
-        data = request.json
-        matricule = data.get('matricule')
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        badge_type = data.get('type')  # 'matin', 'midi', 'reprise', 'soir'
-        
-        if not matricule:
-            return jsonify({
-                'success': False,
-                'message': 'Matricule requis'
-            }), 400
-        
-        # Trouver l'employé
-        employe = Employe.query.filter_by(matricule=matricule, actif=True).first()
-        
-        if not employe:
-            return jsonify({
-                'success': False,
-                'message': 'Matricule invalide ou employé inactif'
-            }), 404
-        
-        # Mettre à jour la géolocalisation
-        if latitude and longitude:
-            employe.latitude = latitude
-            employe.longitude = longitude
-            employe.derniere_localisation = datetime.now()
-        
-        # Logique de pointage
-        aujourd_hui = date.today()
-        pointage = Pointage.query.filter_by(
-            employe_id=employe.id,
-            date_pointage=aujourd_hui
-        ).first()
+# Cache matricule -> employé pour les endpoints publics de badge.
+# Un enregistrement compact et immuable suffit pour valider un badge et
+# construire la réponse, sans charger l'objet ORM complet.
+EmployeBadge = namedtuple('EmployeBadge', 'id matricule nom prenom departement position photo')
+
+# Colonnes dont la modification invalide l'entrée du cache
+CHAMPS_EMPLOYE_BADGE = ('matricule', 'nom', 'prenom', 'departement', 'position', 'photo', 'actif')
+
+class EmployeCache:
+    """Cache LRU borné des employés actifs, indexé par matricule"""
+    
+    def __init__(self, taille_max=5000):
+        self.taille_max = taille_max
+        self.entrees = OrderedDict()
+        self.lock = Lock()
+    
+    def get(self, matricule):
+        with self.lock:
+            employe = self.entrees.get(matricule)
+            if employe is not None:
+                self.entrees.move_to_end(matricule)
+        if employe is not None:
+            return employe
         
-        if not pointage:
-            pointage = Pointage(
-                employe_id=employe.id,
-                date_pointage=aujourd_hui
+        row = db.session.query(
+            Employe.id, Employe.matricule, Employe.nom, Employe.prenom,
+            Employe.departement, Employe.position, Employe.photo
+        ).filter_by(matricule=matricule, actif=True).first()
+        if row is None:
+            return None
+        employe = EmployeBadge(*row)
+        with self.lock:
+            self.entrees[matricule] = employe
+            if len(self.entrees) > self.taille_max:
+                self.entrees.popitem(last=False)
+        return employe
+    
+    def invalidate(self, *matricules):
+        with self.lock:
+            for matricule in matricules:
+                self.entrees.pop(matricule, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entrees.clear()
+
+employe_cache = EmployeCache(app.config['EMPLOYE_CACHE_SIZE'])
+
+def _matricules_modifies(employe):
+    """Matricules (ancien et nouveau) d'un employé dont un champ du cache a changé"""
+    etat = db.inspect(employe)
+    if not any(etat.attrs[champ].history.has_changes() for champ in CHAMPS_EMPLOYE_BADGE):
+        return []
+    return [employe.matricule] + list(etat.attrs.matricule.history.deleted or [])
+
+@db.event.listens_for(db.session, 'after_flush')
+def invalider_cache_employes(sess, flush_context):
+    # Couvre toutes les écritures ORM : API employés, imports, scripts...
+    matricules = set()
+    effectif_modifie = False
+    for obj in sess.new | sess.dirty:
+        if isinstance(obj, Employe):
+            matricules.update(_matricules_modifies(obj))
+            effectif_modifie = effectif_modifie or obj in sess.new or \
+                db.inspect(obj).attrs.actif.history.has_changes()
+    for obj in sess.deleted:
+        if isinstance(obj, Employe):
+            matricules.add(obj.matricule)
+            effectif_modifie = True
+    if effectif_modifie:
+        # Le nombre d'absents dépend des employés actifs
+        resume_presence.invalider()
+    if matricules:
+        employe_cache.invalidate(*matricules)
+        sess.info.setdefault('matricules_modifies', set()).update(matricules)
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalider_cache_employes_commit(sess):
+    # Une lecture concurrente a pu remettre l'ancienne version en cache avant le commit
+    matricules = sess.info.pop('matricules_modifies', None)
+    if matricules:
+        employe_cache.invalidate(*matricules)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def oublier_cache_employes(sess):
+    sess.info.pop('matricules_modifies', None)
+
+HEURE_LIMITE_MATIN = datetime.strptime('09:00', '%H:%M').time()
+HEURE_LIMITE_APRES_MIDI = datetime.strptime('14:00', '%H:%M').time()
+
+def heures_pointage(arrivee_matin, depart_midi, arrivee_apres_midi, depart_soir):
+    """Heures travaillées et supplémentaires (au-delà de 8h) d'une journée"""
+    secondes = 0
+    if arrivee_matin and depart_midi:
+        secondes += (depart_midi - arrivee_matin).total_seconds()
+    if arrivee_apres_midi and depart_soir:
+        secondes += (depart_soir - arrivee_apres_midi).total_seconds()
+    total_heures = round(secondes / 3600, 2)
+    return total_heures, round(total_heures - 8, 2) if total_heures > 8 else 0
+
+def calculer_heures(pointage):
+    """Met à jour heures_travaillees / heures_supplementaires d'un pointage"""
+    total_heures, heures_sup = heures_pointage(
+        pointage.arrivee_matin, pointage.depart_midi,
+        pointage.arrivee_apres_midi, pointage.depart_soir
+    )
+    pointage.heures_travaillees = total_heures
+    pointage.heures_supplementaires = heures_sup
+    return total_heures
+
+# Type de badge -> (colonne du pointage, motif de refus si le créneau est déjà pris)
+CRENEAUX_BADGE = {
+    'matin': ('arrivee_matin', 'Arrivée du matin déjà enregistrée'),
+    'midi': ('depart_midi', 'Départ midi déjà enregistré'),
+    'reprise': ('arrivee_apres_midi', 'Reprise après-midi déjà enregistrée'),
+    'soir': ('depart_soir', 'Départ du soir déjà enregistré'),
+}
+
+def verifier_badge(pointage, badge_type):
+    """Type de badge effectif, ou motif de refus, sans modifier le pointage.
+    
+    pointage vaut None si l'employé n'a pas encore badgé ce jour-là.
+    Retourne (badge_type, None) ou (None, message).
+    """
+    if not badge_type:
+        # Sans type spécifique, on prend le premier créneau libre (logique séquentielle)
+        for type_, (colonne, _refus) in CRENEAUX_BADGE.items():
+            if pointage is None or not getattr(pointage, colonne):
+                return type_, None
+        return None, 'Tous les pointages du jour sont déjà enregistrés'
+    if badge_type not in CRENEAUX_BADGE:
+        return None, 'Type de badge inconnu'
+    colonne, refus = CRENEAUX_BADGE[badge_type]
+    if pointage is not None and getattr(pointage, colonne):
+        return None, refus
+    return badge_type, None
+
+def appliquer_badge(pointage, employe, badge_type, maintenant):
+    """Applique un badge sur le pointage du jour.
+    
+    Retourne (action_type, message). action_type vaut None si le badge est refusé,
+    le message contient alors la raison du refus.
+    """
+    badge_type, refus = verifier_badge(pointage, badge_type)
+    if refus:
+        return None, refus
+    
+    heure = maintenant.strftime('%H:%M')
+    
+    if badge_type == 'matin':
+        pointage.arrivee_matin = maintenant
+        if maintenant.time() > HEURE_LIMITE_MATIN:
+            pointage.retard_matin = True
+        return "arrivee_matin", f"Bonjour {employe.prenom}! Arrivée enregistrée à {heure}"
+    
+    if badge_type == 'midi':
+        pointage.depart_midi = maintenant
+        return "depart_midi", f"Bon appétit {employe.prenom}! Départ midi enregistré à {heure}"
+    
+    if badge_type == 'reprise':
+        pointage.arrivee_apres_midi = maintenant
+        if maintenant.time() > HEURE_LIMITE_APRES_MIDI:
+            pointage.retard_apres_midi = True
+        return "arrivee_apres_midi", f"Bon retour {employe.prenom}! Retour enregistré à {heure}"
+    
+    pointage.depart_soir = maintenant
+    total_heures = calculer_heures(pointage)
+    return "depart_soir", f"Bonne soirée {employe.prenom}! Départ enregistré à {heure}. Total: {total_heures}h"
+
+def enregistrer_badge(data, maintenant):
+    """Valide et applique un badge dans la session courante (sans commit).
+    
+    Retourne (code_http, reponse_json, BadgeEnregistre ou None).
+    """
+    matricule = data.get('matricule')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    badge_type = data.get('type')  # 'matin', 'midi', 'reprise', 'soir'
+    
+    if not matricule:
+        return 400, {'success': False, 'message': 'Matricule requis'}, None
+    
+    # Trouver l'employé (cache matricule -> employé)
+    employe = employe_cache.get(matricule)
+    if not employe:
+        return 404, {'success': False, 'message': 'Matricule invalide ou employé inactif'}, None
+    
+    # Le badge est vérifié avant de créer le pointage du jour : un badge refusé
+    # (type inconnu, créneau déjà pris) ne laisse pas de pointage vide
+    jour = maintenant.date()
+    if archives.est_archivee(jour):
+        return 409, refus_annee_archivee(jour), None
+    pointage = db.session.execute(
+        db.select(Pointage).filter_by(employe_id=employe.id, date_pointage=jour)
+    ).scalar_one_or_none()
+    badge_type, refus = verifier_badge(pointage, badge_type)
+    if refus:
+        return 400, {'success': False, 'message': refus}, None
+    if pointage is None:
+        pointage = pointage_du_jour(employe.id, jour)
+    
+    action_type, message = appliquer_badge(pointage, employe, badge_type, maintenant)
+    if not action_type:
+        return 400, {'success': False, 'message': message}, None
+    
+    anomalie = bool(pointage.retard_matin) if action_type == 'arrivee_matin' else \
+        bool(pointage.retard_apres_midi) if action_type == 'arrivee_apres_midi' else False
+    badge = BadgeEnregistre(employe, action_type, maintenant, anomalie, latitude, longitude, pointage.id)
+    return 200, {
+        'success': True,
+        'message': message,
+        'action_type': action_type,
+        'employee': {
+            'name': f"{employe.prenom} {employe.nom}",
+            'position': employe.position,
+            'department': employe.departement,
+            'photo': employe.photo
+        }
+    }, badge
+
+# Badge validé, transmis après le commit au résumé du jour et aux clients WebSocket
+# (pointage_id + type identifient l'événement : un même badge n'est compté qu'une fois)
+BadgeEnregistre = namedtuple('BadgeEnregistre', 'employe type timestamp anomalie latitude longitude pointage_id',
+                             defaults=(None,))
+
+# Créneaux du pointage : (colonne / type de badge, colonne du retard associé)
+CRENEAUX_POINTAGE = (
+    ('arrivee_matin', 'retard_matin'),
+    ('depart_midi', None),
+    ('arrivee_apres_midi', 'retard_apres_midi'),
+    ('depart_soir', None),
+)
+
+class ResumePresence:
+    """Résumé des présences du jour maintenu à chaque badge.
+    
+    Présents / retards / employés actifs sont des ensembles d'identifiants et
+    les derniers badges un buffer circulaire : la page /badges se rend sans
+    recharger les pointages du jour. Le résumé est reconstruit depuis la base
+    au changement de jour ou après invalidation.
+    """
+    
+    def __init__(self, taille_historique=20):
+        self.taille_historique = taille_historique
+        self.lock = Lock()
+        self.jour = None
+        self.actifs = set()
+        self.presents = set()
+        self.retards = set()
+        self.presents_actifs = 0
+        self.recents = deque(maxlen=taille_historique)
+    
+    def _reconstruire(self, jour):
+        actifs = {row[0] for row in db.session.query(Employe.id).filter_by(actif=True)}
+        lignes = db.session.query(Pointage, Employe).join(Employe).filter(
+            Pointage.date_pointage == jour
+        ).all()
+        presents, retards, evenements = set(), set(), []
+        for p, e in lignes:
+            presents.add(e.id)
+            if p.retard_matin or p.retard_apres_midi:
+                retards.add(e.id)
+            employe = EmployeBadge(e.id, e.matricule, e.nom, e.prenom, e.departement, e.position, e.photo)
+            for creneau, retard in CRENEAUX_POINTAGE:
+                horodatage = getattr(p, creneau)
+                if horodatage:
+                    evenements.append(BadgeEnregistre(
+                        employe, creneau, horodatage,
+                        bool(getattr(p, retard)) if retard else False,
+                        e.latitude, e.longitude, p.id
+                    ))
+        evenements.sort(key=lambda b: b.timestamp)
+        self.jour = jour
+        self.actifs = actifs
+        self.presents = presents
+        self.retards = retards
+        self.presents_actifs = len(presents & actifs)
+        self.recents = deque(evenements[-self.taille_historique:], maxlen=self.taille_historique)
+    
+    def _du_jour(self, jour):
+        if self.jour != jour:
+            self._reconstruire(jour)
+    
+    def enregistrer(self, badge):
+        """Applique un badge commité au résumé (ignoré s'il concerne un autre jour)"""
+        with self.lock:
+            if self.jour != badge.timestamp.date():
+                return
+            if badge.employe.id not in self.presents:
+                self.presents.add(badge.employe.id)
+                if badge.employe.id in self.actifs:
+                    self.presents_actifs += 1
+            if badge.anomalie:
+                self.retards.add(badge.employe.id)
+            self._ajouter_recent(badge)
+    
+    def _ajouter_recent(self, badge):
+        # Déjà présent : reconstruction concurrente qui a relu le badge commité
+        if badge.pointage_id is not None and any(
+                (b.pointage_id, b.type) == (badge.pointage_id, badge.type) for b in self.recents):
+            return
+        if not self.recents or badge.timestamp >= self.recents[-1].timestamp:
+            self.recents.append(badge)
+            return
+        # Badge plus ancien que le dernier (lot hors ligne) : inséré à sa place
+        recents = sorted(list(self.recents) + [badge], key=lambda b: b.timestamp)
+        self.recents = deque(recents[-self.taille_historique:], maxlen=self.taille_historique)
+    
+    def invalider(self):
+        with self.lock:
+            self.jour = None
+    
+    def snapshot(self, jour):
+        """Statistiques et derniers badges (plus récent en premier) du jour"""
+        with self.lock:
+            self._du_jour(jour)
+            stats = {
+                'presents': len(self.presents),
+                'retards': len(self.retards),
+                'absents': len(self.actifs) - self.presents_actifs,
+                'total': len(self.actifs)
+            }
+            return stats, list(reversed(self.recents))
+
+resume_presence = ResumePresence()
+
+def diffuser_badge(badge):
+    """Après commit : met à jour le résumé du jour, l'historique des positions
+    et notifie les clients WebSocket"""
+    resume_presence.enregistrer(badge)
+    metrique_badges.inc(type=badge.type)
+    if badge.latitude and badge.longitude:
+        position_writer.ajouter(badge.employe.id, badge.timestamp, badge.latitude, badge.longitude)
+    diffuseur.emit('badge_update', {
+        'employe': f'{badge.employe.prenom} {badge.employe.nom}',
+        'matricule': badge.employe.matricule,
+        'type': badge.type,
+        'heure': badge.timestamp.strftime('%H:%M'),
+        'timestamp': badge.timestamp.isoformat()
+    })
+
+# ===== INGESTION GROUPÉE DES BADGES =====
+# En mode groupé (BADGE_GROUP_COMMIT=1), les badges sont validés par un thread
+# unique qui les applique en mémoire puis les écrit par lots avec un seul COMMIT
+# toutes les quelques millisecondes. Chaque appelant attend le résultat de son
+# propre badge : message de succès ou d'erreur inchangé. Un appelant qui
+# abandonne (503 après le délai d'attente) marque son ticket : le writer
+# l'ignore, le badge refait par l'employé ne crée donc pas de doublon. Un
+# ticket déjà pris dans un lot est attendu jusqu'à son commit.
+
+TICKET_EN_ATTENTE, TICKET_EN_COURS, TICKET_ABANDONNE = 'attente', 'en_cours', 'abandonne'
+
+class BadgeTicket:
+    """Badge en attente d'écriture par le BadgeWriter"""
+    __slots__ = ('data', 'maintenant', 'done', 'resultat', 'etat')
+    
+    def __init__(self, data, maintenant):
+        self.data = data
+        self.maintenant = maintenant
+        self.done = Event()
+        self.resultat = None
+        self.etat = TICKET_EN_ATTENTE
+
+class BadgeWriter:
+    """Thread d'écriture unique qui regroupe les badges en petits commits"""
+    
+    def __init__(self, flask_app, intervalle_ms=5, taille_max=200):
+        self.app = flask_app
+        self.intervalle = intervalle_ms / 1000.0
+        self.taille_max = taille_max
+        self.queue = Queue()
+        self.thread = None
+        self.lock = Lock()
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._run, name='badge-writer', daemon=True)
+                self.thread.start()
+    
+    def submit(self, data, maintenant, timeout=10):
+        """Soumet un badge et attend son résultat (code, réponse, événement)"""
+        self.start()
+        ticket = BadgeTicket(data, maintenant)
+        self.queue.put(ticket)
+        if not ticket.done.wait(timeout):
+            with self.lock:
+                if ticket.etat == TICKET_EN_ATTENTE:
+                    ticket.etat = TICKET_ABANDONNE
+                    return 503, {'success': False, 'message': 'Serveur de pointage surchargé, réessayez'}, None
+            # Déjà dans un lot en cours d'écriture : son résultat arrive avec le commit
+            ticket.done.wait()
+        return ticket.resultat
+    
+    def _prendre(self, lot):
+        """Tickets du lot encore attendus par leur appelant, marqués en cours"""
+        with self.lock:
+            lot = [ticket for ticket in lot if ticket.etat == TICKET_EN_ATTENTE]
+            for ticket in lot:
+                ticket.etat = TICKET_EN_COURS
+        return lot
+    
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                lot = [self.queue.get()]
+                # Laisser quelques millisecondes aux autres badges pour rejoindre le lot
+                limite = time.monotonic() + self.intervalle
+                while len(lot) < self.taille_max:
+                    reste = limite - time.monotonic()
+                    if reste <= 0:
+                        break
+                    try:
+                        lot.append(self.queue.get(timeout=reste))
+                    except Empty:
+                        break
+                lot = self._prendre(lot)
+                if lot:
+                    self._ecrire_lot(lot)
+                db.session.remove()
+    
+    def _ecrire_lot(self, lot):
+        try:
+            for ticket in lot:
+                ticket.resultat = enregistrer_badge(ticket.data, ticket.maintenant)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Rejouer badge par badge pour isoler celui qui échoue
+            for ticket in lot:
+                ticket.resultat = self._ecrire_un(ticket)
+        for ticket in lot:
+            ticket.done.set()
+            code, reponse, badge = ticket.resultat
+            if badge:
+                diffuser_badge(badge)
+    
+    def _ecrire_un(self, ticket):
+        try:
+            resultat = enregistrer_badge(ticket.data, ticket.maintenant)
+            db.session.commit()
+            return resultat
+        except Exception as e:
+            db.session.rollback()
+            return 500, {'success': False, 'message': f'Erreur lors du pointage: {str(e)}'}, None
+
+badge_writer = BadgeWriter(app,
+                           intervalle_ms=app.config['BADGE_GROUP_COMMIT_MS'],
+                           taille_max=app.config['BADGE_GROUP_COMMIT_MAX'])
+
+# ===== HISTORIQUE DES POSITIONS =====
+# Les positions des badges sont ajoutées à position_employe par un thread de
+# fond, hors de la transaction du badge. Toutes les positions sont gardées
+# POSITIONS_RETENTION_JOURS jours, puis une seule par employé et par
+# POSITIONS_PAS_ANCIEN_MINUTES. Employe.latitude/longitude reste la dernière
+# position connue (carte), mise à jour par lot par ce même thread sans
+# changer la version de la table employe : aucune vue en cache ni aucun KPI
+# ne lit la position, un badge n'invalide donc ni /api/employes ni le
+# tableau de bord. La file est bornée (POSITIONS_FILE_MAX) : si le thread
+# d'écriture prend du retard, les positions les plus anciennes sont
+# abandonnées et comptées (globibat_positions_perdues_total).
+
+class PositionWriter:
+    """Écrit les positions par lots et sous-échantillonne l'historique ancien"""
+    
+    def __init__(self, flask_app, intervalle=1.0, taille_max=500, taille_file=20000):
+        self.app = flask_app
+        self.intervalle = intervalle
+        self.taille_max = taille_max
+        self.queue = Queue(maxsize=taille_file)
+        self.thread = None
+        self.lock = Lock()
+        self.prochain_sous_echantillonnage = 0
+        self.limite_traitee = None
+        self.dernier_id = 0
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self._run, name='position-writer', daemon=True)
+                self.thread.start()
+    
+    def ajouter(self, employe_id, horodatage, latitude, longitude):
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            return
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return
+        self.start()
+        position = (employe_id, horodatage, latitude, longitude)
+        while True:
+            try:
+                self.queue.put_nowait(position)
+                return
+            except Full:
+                # File pleine : la position la plus ancienne cède sa place
+                try:
+                    self.queue.get_nowait()
+                    metrique_positions_perdues.inc()
+                except Empty:
+                    pass
+    
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    lot = [self.queue.get(timeout=self.intervalle)]
+                except Empty:
+                    lot = []
+                while lot and len(lot) < self.taille_max:
+                    try:
+                        lot.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                try:
+                    if lot:
+                        self._ecrire(lot)
+                    if time.monotonic() >= self.prochain_sous_echantillonnage:
+                        self.prochain_sous_echantillonnage = time.monotonic() + 3600
+                        self.sous_echantillonner()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f'[WARNING] Historique des positions: {e}')
+                finally:
+                    db.session.remove()
+    
+    def _ecrire(self, lot):
+        db.session.execute(db.insert(PositionEmploye), [{
+            'employe_id': employe_id,
+            'horodatage': horodatage,
+            'latitude_e6': int(round(latitude * 1e6)),
+            'longitude_e6': int(round(longitude * 1e6))
+        } for employe_id, horodatage, latitude, longitude in lot])
+        # Une seule mise à jour par employé : sa position la plus récente du lot
+        dernieres = {}
+        for employe_id, horodatage, latitude, longitude in lot:
+            if employe_id not in dernieres or horodatage >= dernieres[employe_id][0]:
+                dernieres[employe_id] = (horodatage, latitude, longitude)
+        for employe_id, (horodatage, latitude, longitude) in dernieres.items():
+            db.session.execute(
+                db.update(Employe).where(
+                    Employe.id == employe_id,
+                    db.or_(Employe.derniere_localisation.is_(None),
+                           Employe.derniere_localisation <= horodatage)
+                ).values(latitude=latitude, longitude=longitude, derniere_localisation=horodatage)
+                .execution_options(version_tables=False)
             )
-            db.session.add(pointage)
+        db.session.commit()
+    
+    def sous_echantillonner(self, maintenant=None):
+        """Ne garde qu'un point par employé et par pas de temps au-delà de la rétention"""
+        maintenant = maintenant or datetime.now()
+        limite = maintenant - timedelta(days=app.config['POSITIONS_RETENTION_JOURS'])
+        pas = app.config['POSITIONS_PAS_ANCIEN_MINUTES'] * 60
+        dernier_id = db.session.query(db.func.max(PositionEmploye.id)).scalar() or 0
         
-        maintenant = datetime.now()
-        action_type = None
-        message = ""
+        requete = db.session.query(
+            PositionEmploye.id, PositionEmploye.employe_id, PositionEmploye.horodatage
+        ).filter(PositionEmploye.horodatage < limite)
+        borne = None
+        # Les points plus anciens que la limite précédente sont déjà sous-échantillonnés
+        if self.limite_traitee is not None:
+            borne = self.limite_traitee - timedelta(seconds=pas)
+            requete = requete.filter(PositionEmploye.horodatage >= borne)
+        gardes, a_supprimer = set(), []
+        for position_id, employe_id, horodatage in requete.order_by(PositionEmploye.horodatage).yield_per(5000):
+            cle = (employe_id, int(horodatage.timestamp()) // pas)
+            if cle in gardes:
+                a_supprimer.append(position_id)
+            else:
+                gardes.add(cle)
         
-        # Si un type spécifique est demandé
-        if badge_type:
-            if badge_type == 'matin':
-                if pointage.arrivee_matin:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Arrivée du matin déjà enregistrée'
-                    }), 400
-                pointage.arrivee_matin = maintenant
-                if maintenant.time() > datetime.strptime('09:00', '%H:%M').time():
-                    pointage.retard_matin = True
-                action_type = "arrivee_matin"
-                message = f"Bonjour {employe.prenom}! Arrivée enregistrée à {maintenant.strftime('%H:%M')}"
-            
-            elif badge_type == 'midi':
-                if pointage.depart_midi:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Départ midi déjà enregistré'
-                    }), 400
-                pointage.depart_midi = maintenant
-                action_type = "depart_midi"
-                message = f"Bon appétit {employe.prenom}! Départ midi enregistré à {maintenant.strftime('%H:%M')}"
-            
-            elif badge_type == 'reprise':
-                if pointage.arrivee_apres_midi:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Reprise après-midi déjà enregistrée'
-                    }), 400
-                pointage.arrivee_apres_midi = maintenant
-                if maintenant.time() > datetime.strptime('14:00', '%H:%M').time():
-                    pointage.retard_apres_midi = True
-                action_type = "arrivee_apres_midi"
-                message = f"Bon retour {employe.prenom}! Retour enregistré à {maintenant.strftime('%H:%M')}"
-            
-            elif badge_type == 'soir':
-                if pointage.depart_soir:
-                    return jsonify({
-                        'success': False,
-                        'message': 'Départ du soir déjà enregistré'
-                    }), 400
-                pointage.depart_soir = maintenant
-                action_type = "depart_soir"
-                
-                # Calculer les heures
-                heures_matin = 0
-                heures_apres_midi = 0
-                
-                if pointage.arrivee_matin and pointage.depart_midi:
-                    delta_matin = pointage.depart_midi - pointage.arrivee_matin
-                    heures_matin = delta_matin.total_seconds() / 3600
-                
-                if pointage.arrivee_apres_midi and pointage.depart_soir:
-                    delta_apres_midi = pointage.depart_soir - pointage.arrivee_apres_midi
-                    heures_apres_midi = delta_apres_midi.total_seconds() / 3600
-                
-                total_heures = round(heures_matin + heures_apres_midi, 2)
-                pointage.heures_travaillees = total_heures
-                
-                if total_heures > 8:
-                    pointage.heures_supplementaires = round(total_heures - 8, 2)
-                
-                message = f"Bonne soirée {employe.prenom}! Départ enregistré à {maintenant.strftime('%H:%M')}. Total: {total_heures}h"
+        # Points arrivés en retard (badges hors ligne) dans la partie déjà traitée
+        if borne is not None:
+            tardifs = db.session.query(
+                PositionEmploye.id, PositionEmploye.employe_id, PositionEmploye.horodatage
+            ).filter(PositionEmploye.id > self.dernier_id, PositionEmploye.horodatage < borne).all()
+            for position_id, employe_id, horodatage in tardifs:
+                debut = datetime.fromtimestamp(int(horodatage.timestamp()) // pas * pas)
+                autre = db.session.query(PositionEmploye.id).filter(
+                    PositionEmploye.employe_id == employe_id,
+                    PositionEmploye.horodatage >= debut,
+                    PositionEmploye.horodatage < debut + timedelta(seconds=pas),
+                    PositionEmploye.id != position_id,
+                    PositionEmploye.id.notin_(a_supprimer)
+                ).first()
+                if autre:
+                    a_supprimer.append(position_id)
         
-        # Si pas de type spécifique, utiliser la logique séquentielle
-        else:
-        if not pointage.arrivee_matin:
-            pointage.arrivee_matin = maintenant
-            if maintenant.time() > datetime.strptime('09:00', '%H:%M').time():
-                pointage.retard_matin = True
-            action_type = "arrivee_matin"
-            message = f"Bonjour {employe.prenom}! Arrivée enregistrée à {maintenant.strftime('%H:%M')}"
-        elif not pointage.depart_midi:
-            pointage.depart_midi = maintenant
-            action_type = "depart_midi"
-            message = f"Bon appétit {employe.prenom}! Départ midi enregistré à {maintenant.strftime('%H:%M')}"
-        elif not pointage.arrivee_apres_midi:
-            pointage.arrivee_apres_midi = maintenant
-            if maintenant.time() > datetime.strptime('14:00', '%H:%M').time():
-                pointage.retard_apres_midi = True
-            action_type = "arrivee_apres_midi"
-            message = f"Bon retour {employe.prenom}! Retour enregistré à {maintenant.strftime('%H:%M')}"
-        elif not pointage.depart_soir:
-            pointage.depart_soir = maintenant
-            action_type = "depart_soir"
-            
-            # Calculer les heures
-            heures_matin = 0
-            heures_apres_midi = 0
-            
-            if pointage.arrivee_matin and pointage.depart_midi:
-                delta_matin = pointage.depart_midi - pointage.arrivee_matin
-                heures_matin = delta_matin.total_seconds() / 3600
-            
-            if pointage.arrivee_apres_midi and pointage.depart_soir:
-                delta_apres_midi = pointage.depart_soir - pointage.arrivee_apres_midi
-                heures_apres_midi = delta_apres_midi.total_seconds() / 3600
-            
-            total_heures = round(heures_matin + heures_apres_midi, 2)
-            pointage.heures_travaillees = total_heures
-            
-            if total_heures > 8:
-                pointage.heures_supplementaires = round(total_heures - 8, 2)
-            
-            message = f"Bonne soirée {employe.prenom}! Départ enregistré à {maintenant.strftime('%H:%M')}. Total: {total_heures}h"
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Tous les pointages du jour sont déjà enregistrés'
-            }), 400
+        for debut in range(0, len(a_supprimer), 500):
+            db.session.execute(db.delete(PositionEmploye).where(
+                PositionEmploye.id.in_(a_supprimer[debut:debut + 500])
+            ))
+        db.session.commit()
+        self.limite_traitee = limite
+        self.dernier_id = dernier_id
+        return len(a_supprimer)
+
+position_writer = PositionWriter(app, taille_file=app.config['POSITIONS_FILE_MAX'])
+
+def historique_positions(employe_id, debut, fin, limite=5000):
+    """Trajet d'un employé entre deux instants (parcours de l'index employe/horodatage)"""
+    lignes = db.session.query(
+        PositionEmploye.horodatage, PositionEmploye.latitude_e6, PositionEmploye.longitude_e6
+    ).filter(
+        PositionEmploye.employe_id == employe_id,
+        PositionEmploye.horodatage >= debut,
+        PositionEmploye.horodatage < fin
+    ).order_by(PositionEmploye.horodatage).limit(limite)
+    return [{
+        'timestamp': horodatage.isoformat(),
+        'latitude': lat / 1e6,
+        'longitude': lon / 1e6
+    } for horodatage, lat, lon in lignes]
+
+# Champs d'un badge reçu qui doivent être des chaînes (ou absents)
+CHAMPS_TEXTE_BADGE = ('id', 'matricule', 'type')
+
+def champs_badge_valides(data):
+    """Vrai si data est un objet JSON dont les champs texte du badge sont des chaînes"""
+    return isinstance(data, dict) and all(
+        data.get(champ) is None or isinstance(data.get(champ), str) for champ in CHAMPS_TEXTE_BADGE
+    )
+
+@app.route('/api/badge/check', methods=['POST'])
+def badge_check():
+    """Enregistrer un pointage via matricule"""
+    # L'heure est prise à la réception : le retard ne dépend pas de l'attente du lot
+    maintenant = datetime.now()
+    data = request.get_json(silent=True)
+    if not champs_badge_valides(data):
+        return jsonify({'success': False, 'message': 'Badge invalide'}), 400
+    
+    if app.config['BADGE_GROUP_COMMIT']:
+        code, reponse, badge = badge_writer.submit(data, maintenant)
+        return jsonify(reponse), code
+    
+    try:
+        code, reponse, badge = enregistrer_badge(data, maintenant)
+        if code != 200:
+            db.session.rollback()
+            return jsonify(reponse), code
         
         db.session.commit()
         
-        # Émettre l'événement WebSocket
-        socketio.emit('badge_update', {
-            'employe': f'{employe.prenom} {employe.nom}',
-            'matricule': employe.matricule,
-            'type': action_type,
-            'heure': maintenant.strftime('%H:%M'),
-            'timestamp': maintenant.isoformat()
-        })
+        # Résumé du jour + événement WebSocket
+        diffuser_badge(badge)
         
-        return jsonify({
-            'success': True,
-            'message': message,
-            'action_type': action_type,
-            'employee': {
-                'name': f"{employe.prenom} {employe.nom}",
-                'position': employe.position,
-                'department': employe.departement,
-                'photo': employe.photo
-            }
-        })
+        return jsonify(reponse)
         
     except Exception as e:
         db.session.rollback()
@@ -837,31 +2435,156 @@ def badge_check():
             'message': f'Erreur lors du pointage: {str(e)}'
         }), 500
 
+def lire_horodatage(valeur):
+    """Convertit l'horodatage ISO d'un appareil en datetime local naïf"""
+    horodatage = datetime.fromisoformat(str(valeur).replace('Z', '+00:00'))
+    if horodatage.tzinfo is not None:
+        horodatage = horodatage.astimezone().replace(tzinfo=None)
+    return horodatage
+
+def nb_badges_recus():
+    data = request.get_json(silent=True)
+    badges_recus = data.get('punches') if isinstance(data, dict) else None
+    return len(badges_recus) if isinstance(badges_recus, list) else 0
+
+def uid_badge_hors_ligne(appareil, item, horodatage):
+    """Identifiant de déduplication d'un badge hors ligne.
+    
+    Les identifiants générés par les appareils ne sont uniques que sur un appareil :
+    l'uid est donc "device_id|id". Sans identifiant, le badge est identifié par son
+    contenu. Une valeur trop longue pour la colonne est remplacée par son empreinte.
+    """
+    if item.get('id'):
+        uid = f"{appareil or ''}|{item['id']}"
+    else:
+        uid = f"{appareil or ''}|{item['matricule']}|{item['type']}|{horodatage.isoformat()}"
+    if len(uid) > 64:
+        uid = hashlib.sha256(uid.encode('utf-8')).hexdigest()
+    return uid
+
+@app.route('/api/badge/batch', methods=['POST'])
+@budget_sql(4, par_element=9, elements=nb_badges_recus)
+def badge_batch():
+    """Enregistrer les badges mis en file hors ligne par un appareil.
+    
+    Chaque badge est appliqué dans son propre savepoint : un badge invalide ou en
+    erreur a son propre résultat sans empêcher l'enregistrement des autres. Un
+    badge en erreur serveur est marqué retry (l'appareil le garde en file).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Liste de badges requise'}), 400
+    appareil = data.get('device_id')
+    badges_recus = data.get('punches')
+    if appareil is not None and not isinstance(appareil, str):
+        return jsonify({'success': False, 'message': 'device_id invalide'}), 400
+    
+    if not isinstance(badges_recus, list) or not badges_recus:
+        return jsonify({'success': False, 'message': 'Liste de badges requise'}), 400
+    if len(badges_recus) > app.config['BADGE_BATCH_MAX']:
+        return jsonify({
+            'success': False,
+            'message': f"Maximum {app.config['BADGE_BATCH_MAX']} badges par envoi"
+        }), 413
+    
+    maintenant = datetime.now()
+    plus_ancien = maintenant - timedelta(days=app.config['BADGE_OFFLINE_MAX_DAYS'])
+    tolerance = maintenant + timedelta(minutes=5)
+    
+    resultats = [None] * len(badges_recus)
+    a_traiter = []
+    vus = set()
+    for index, item in enumerate(badges_recus):
+        if not champs_badge_valides(item):
+            resultats[index] = {'id': item.get('id') if isinstance(item, dict) else None,
+                                'success': False, 'message': 'Badge invalide'}
+            continue
+        try:
+            horodatage = lire_horodatage(item.get('timestamp'))
+        except (TypeError, ValueError):
+            resultats[index] = {'id': item.get('id'), 'success': False, 'message': 'Horodatage invalide'}
+            continue
+        if horodatage > tolerance or horodatage < plus_ancien:
+            resultats[index] = {'id': item.get('id'), 'success': False, 'message': 'Horodatage hors période autorisée'}
+            continue
+        uid = uid_badge_hors_ligne(appareil, item, horodatage)
+        if uid in vus:
+            resultats[index] = {'id': item.get('id'), 'success': True, 'duplicate': True, 'message': 'Badge déjà reçu'}
+            continue
+        vus.add(uid)
+        a_traiter.append((horodatage, index, uid, item))
+    
+    # Badges déjà enregistrés lors d'un envoi précédent (renvoi après coupure réseau)
+    deja_recus = {}
+    uids = [uid for _, _, uid, _ in a_traiter]
+    if uids:
+        deja_recus = {b.uid: b for b in BadgeHorsLigne.query.filter(BadgeHorsLigne.uid.in_(uids))}
+    
+    badges = []
+    try:
+        # Rejouer dans l'ordre chronologique pour que la logique séquentielle reste valable
+        for horodatage, index, uid, item in sorted(a_traiter, key=lambda t: (t[0], t[1])):
+            precedent = deja_recus.get(uid)
+            if precedent:
+                resultats[index] = {'id': item.get('id'), 'success': precedent.succes,
+                                    'duplicate': True, 'message': precedent.message}
+                continue
+            try:
+                with db.session.begin_nested():
+                    code, reponse, badge = enregistrer_badge(item, horodatage)
+                    db.session.add(BadgeHorsLigne(
+                        uid=uid,
+                        appareil=appareil,
+                        matricule=item.get('matricule'),
+                        type_badge=reponse.get('action_type') or item.get('type'),
+                        horodatage=horodatage,
+                        succes=reponse['success'],
+                        message=reponse['message'][:255]
+                    ))
+                    db.session.flush()
+            except Exception as e:
+                # Savepoint annulé : seul ce badge est perdu, l'appareil le renverra
+                resultats[index] = {'id': item.get('id'), 'success': False, 'retry': True,
+                                    'message': f'Erreur lors du pointage: {str(e)}'}
+                continue
+            resultats[index] = {'id': item.get('id'), 'success': reponse['success'],
+                                'message': reponse['message'],
+                                'action_type': reponse.get('action_type'),
+                                'employee': reponse.get('employee')}
+            if badge:
+                badges.append(badge)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': f'Erreur lors du pointage: {str(e)}'
+        }), 500
+    
+    for badge in badges:
+        diffuser_badge(badge)
+    
+    return jsonify({
+        'success': True,
+        'recus': len(badges_recus),
+        'enregistres': sum(1 for r in resultats if r['success'] and not r.get('duplicate')),
+        'results': resultats
+    })
+
 # ===== API ENDPOINTS =====
 
 @app.route('/api/employes', methods=['GET', 'POST'])
 @login_required
+@conditionnel('employe')
 def api_employes():
     if request.method == 'GET':
-        employes = Employe.query.all()
-        return jsonify([{
-            'id': e.id,
-            'matricule': e.matricule,
-            'nom': e.nom,
-            'prenom': e.prenom,
-            'departement': e.departement,
-            'position': e.position,
-            'email': e.email,
-            'telephone': e.telephone,
-            'actif': e.actif
-        } for e in employes])
+        return LISTE_EMPLOYES.reponse()
     
     elif request.method == 'POST':
         data = request.json
         
         # Générer matricule automatique
-        count = Employe.query.count() + 1
-        matricule = f"EMP{count:03d}"
+        matricule = prochain_numero('employe')
         
         employe = Employe(
             matricule=matricule,
@@ -898,21 +2621,24 @@ def api_employe_detail(id):
         db.session.commit()
         return jsonify({'success': True})
 
+@app.route('/api/employes/<int:id>/positions')
+@login_required
+def api_employe_positions(id):
+    """Trajet d'un employé : ?debut=&fin= (ISO, défaut 24 dernières heures)"""
+    try:
+        fin = datetime.fromisoformat(request.args['fin']) if request.args.get('fin') else datetime.now()
+        debut = datetime.fromisoformat(request.args['debut']) if request.args.get('debut') else fin - timedelta(days=1)
+        limite = min(int(request.args.get('limit', 5000)), 50000)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Paramètres invalides'}), 400
+    return jsonify(historique_positions(id, debut, fin, limite))
+
 @app.route('/api/clients', methods=['GET', 'POST'])
 @login_required
+@conditionnel('client')
 def api_clients():
     if request.method == 'GET':
-        clients = Client.query.all()
-        return jsonify([{
-            'id': c.id,
-            'nom': c.nom,
-            'type_client': c.type_client,
-            'contact': c.contact,
-            'telephone': c.telephone,
-            'email': c.email,
-            'ville': c.ville,
-            'actif': c.actif
-        } for c in clients])
+        return LISTE_CLIENTS.reponse()
     
     elif request.method == 'POST':
         data = request.json
@@ -955,27 +2681,16 @@ def api_client_detail(id: int):
 
 @app.route('/api/devis', methods=['GET', 'POST'])
 @login_required
+@conditionnel('devis')
 def api_devis():
     if request.method == 'GET':
-        devis_list = Devis.query.order_by(Devis.date_devis.desc()).all()
-        return jsonify([{
-            'id': d.id,
-            'numero': d.numero,
-            'client_id': d.client_id,
-            'description': d.description,
-            'montant_ht': d.montant_ht,
-            'tva': d.tva,
-            'montant_ttc': d.montant_ttc,
-            'date_devis': d.date_devis.isoformat() if d.date_devis else None,
-            'statut': d.statut
-        } for d in devis_list])
+        return LISTE_DEVIS.reponse()
     
     # POST - création
     data = request.json
     
     # Générer numéro de devis
-    count = Devis.query.count() + 1
-    numero = f"DEV-{datetime.now().year}-{count:04d}"
+    numero = prochain_numero('devis')
     
     devis = Devis(
         numero=numero,
@@ -1021,28 +2736,16 @@ def api_devis_detail(id):
 
 @app.route('/api/factures', methods=['GET', 'POST'])
 @login_required
+@conditionnel('facture')
 def api_factures():
     if request.method == 'GET':
-        factures = Facture.query.order_by(Facture.date_facture.desc()).all()
-        return jsonify([{
-            'id': f.id,
-            'numero': f.numero,
-            'client_id': f.client_id,
-            'description': f.description,
-            'montant_ht': f.montant_ht,
-            'tva': f.tva,
-            'montant_ttc': f.montant_ttc,
-            'date_facture': f.date_facture.isoformat() if f.date_facture else None,
-            'date_echeance': f.date_echeance.isoformat() if f.date_echeance else None,
-            'statut': f.statut
-        } for f in factures])
+        return LISTE_FACTURES.reponse()
     
     # POST - création
     data = request.json
     
     # Générer numéro de facture
-    count = Facture.query.count() + 1
-    numero = f"FAC-{datetime.now().year}-{count:04d}"
+    numero = prochain_numero('facture')
     
     facture = Facture(
         numero=numero,
@@ -1089,10 +2792,10 @@ def api_facture_detail(id):
 
 @app.route('/api/chantiers', methods=['GET', 'POST'])
 @login_required
+@conditionnel('chantier')
 def api_chantiers():
     if request.method == 'GET':
-        items = Chantier.query.order_by(Chantier.date_debut.desc().nullslast()).all()
-        return jsonify([{ 'id': c.id, 'nom': c.nom, 'client_id': c.client_id, 'adresse': c.adresse, 'date_debut': c.date_debut.isoformat() if c.date_debut else None, 'date_fin_prevue': c.date_fin_prevue.isoformat() if c.date_fin_prevue else None, 'statut': c.statut or 'planifie' } for c in items])
+        return LISTE_CHANTIERS.reponse()
     data = request.json
     chantier = Chantier(
         nom=data['nom'],
@@ -1187,18 +2890,7 @@ def api_badge_post():
             db.session.commit()
         
         # Trouver ou créer le pointage du jour
-        today = date.today()
-        pointage = Pointage.query.filter_by(
-            employe_id=employe_id,
-            date_pointage=today
-        ).first()
-        
-        if not pointage:
-            pointage = Pointage(
-                employe_id=employe_id,
-                date_pointage=today
-            )
-            db.session.add(pointage)
+        pointage = pointage_du_jour(employe_id, date.today())
         
         # Enregistrer l'heure selon le type (utiliser datetime au lieu de time pour SQLite)
         current_datetime = datetime.now()
@@ -1212,13 +2904,14 @@ def api_badge_post():
             pointage.depart_soir = current_datetime
         
         db.session.commit()
+        resume_presence.invalider()
         
         # Émettre via WebSocket
-        socketio.emit('badge_update', {
+        diffuseur.emit('badge_update', {
             'employe_id': employe_id,
             'type': type_pointage,
             'time': current_datetime.strftime('%H:%M:%S')
-        }, broadcast=True)
+        })
         
         return jsonify({'success': True, 'message': 'Badge enregistré'})
         
@@ -1228,28 +2921,306 @@ def api_badge_post():
 
 @app.route('/api/stats/dashboard')
 @login_required
+@conditionnel('employe', 'client', 'chantier', 'lead', 'facture', par_jour=True)
 def api_dashboard_stats():
-    stats = {
-        'employes_actifs': Employe.query.filter_by(actif=True).count(),
-        'clients_actifs': Client.query.filter_by(actif=True).count(),
-        'chantiers_en_cours': Chantier.query.filter_by(statut='en_cours').count(),
-        'leads_nouveaux': Lead.query.filter_by(statut='nouveau').count(),
-        'factures_impayees': Facture.query.filter(Facture.statut.in_(['envoyee', 'retard'])).count(),
-        'ca_mois': db.session.query(db.func.sum(Facture.montant_ttc)).filter(
-            Facture.date_facture >= date.today().replace(day=1),
-            Facture.statut == 'payee'
-        ).scalar() or 0,
-        # Ajout des métriques manquantes pour les tests
-        'total_clients': Client.query.count(),
-        'total_employes': Employe.query.count(),
-        'chantiers_actifs': Chantier.query.filter_by(statut='en_cours').count()
+    return jsonify(indicateurs_dashboard.get())
+
+# ===== RECALCUL DES HEURES =====
+
+def recalculer_pointages(debut, fin, employe_id=None, taille_lot=5000):
+    """Recalcule heures travaillées, heures supplémentaires et retards sur une période.
+    
+    Seules les quatre colonnes d'horodatage (et les valeurs actuelles) sont lues,
+    par lots de `taille_lot` lignes traités colonne par colonne ; les lignes qui
+    changent sont réécrites par UPDATE groupés (executemany sur la clé primaire).
+    """
+    debut_chrono = time.perf_counter()
+    requete = db.select(
+        Pointage.id, Pointage.arrivee_matin, Pointage.depart_midi,
+        Pointage.arrivee_apres_midi, Pointage.depart_soir,
+        Pointage.heures_travaillees, Pointage.heures_supplementaires,
+        Pointage.retard_matin, Pointage.retard_apres_midi
+    ).where(Pointage.date_pointage >= debut, Pointage.date_pointage <= fin)
+    if employe_id:
+        requete = requete.where(Pointage.employe_id == employe_id)
+    requete = requete.order_by(Pointage.id).execution_options(yield_per=taille_lot)
+    
+    total, modifications = 0, []
+    for lot in db.session.execute(requete).partitions():
+        ids, matins, midis, reprises, soirs, heures, sups, retards_m, retards_am = zip(*lot)
+        total += len(ids)
+        calculs = list(map(heures_pointage, matins, midis, reprises, soirs))
+        nouveaux_retards_m = [bool(h and h.time() > HEURE_LIMITE_MATIN) for h in matins]
+        nouveaux_retards_am = [bool(h and h.time() > HEURE_LIMITE_APRES_MIDI) for h in reprises]
+        for i, (h, s) in enumerate(calculs):
+            if (h, s, nouveaux_retards_m[i], nouveaux_retards_am[i]) != \
+                    (heures[i] or 0, sups[i] or 0, bool(retards_m[i]), bool(retards_am[i])):
+                modifications.append({
+                    'id': ids[i],
+                    'heures_travaillees': h,
+                    'heures_supplementaires': s,
+                    'retard_matin': nouveaux_retards_m[i],
+                    'retard_apres_midi': nouveaux_retards_am[i]
+                })
+    
+    for i in range(0, len(modifications), taille_lot):
+        db.session.execute(db.update(Pointage), modifications[i:i + taille_lot])
+    db.session.commit()
+    if modifications and debut <= date.today() <= fin:
+        resume_presence.invalider()
+    
+    return {
+        'pointages': total,
+        'modifies': len(modifications),
+        'duree_ms': round((time.perf_counter() - debut_chrono) * 1000, 1)
     }
-    return jsonify(stats)
+
+@app.route('/api/admin/pointages/recalcul', methods=['POST'])
+@login_required
+def api_recalcul_pointages():
+    """Recalcul des heures sur une période de paie : {debut, fin, employe_id?}"""
+    if not isinstance(current_user, Admin):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        debut = datetime.strptime(data['debut'], '%Y-%m-%d').date()
+        fin = datetime.strptime(data['fin'], '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Dates debut/fin requises (AAAA-MM-JJ)'}), 400
+    if fin < debut:
+        return jsonify({'success': False, 'message': 'La date de fin précède la date de début'}), 400
+    for annee in range(debut.year, fin.year + 1):
+        if archives.est_archivee(date(annee, 1, 1)):
+            return jsonify(refus_annee_archivee(date(annee, 1, 1))), 409
+    
+    resultat = recalculer_pointages(debut, fin, data.get('employe_id'))
+    return jsonify(dict(resultat, success=True))
+
+@app.route('/api/_metrics/websocket')
+@login_required
+def api_metrics_websocket():
+    """Compteurs du diffuseur WebSocket (événements perdus, regroupés, retardés)"""
+    if not isinstance(current_user, Admin):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs'}), 403
+    return jsonify(diffuseur.stats())
+
+@app.route('/api/_metrics/sql', methods=['GET', 'DELETE'])
+@login_required
+def api_metrics_sql():
+    """Profil SQL par endpoint (SQL_PROFILING=1) ; DELETE remet les compteurs à zéro"""
+    if not isinstance(current_user, Admin):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs'}), 403
+    if request.method == 'DELETE':
+        profileur_sql.reinitialiser()
+        return jsonify({'success': True})
+    return jsonify(dict(profileur_sql.rapport(), actif=app.config['SQL_PROFILING']))
+
+# ===== ARCHIVES HISTORIQUES =====
+# Les années closes de Pointage et Avancement sont déplacées dans un fichier
+# SQLite par année (ARCHIVE_DIR/historique_AAAA.db), compacté puis laissé en
+# lecture seule : la base principale ne garde que les ARCHIVE_ANNEES_CHAUDES
+# dernières années, ce qui garde rapides badges et tableaux de bord.
+# Les rapports sur une période (export des pointages, liste des avancements
+# avec date_min) passent par archives.adapter() : si la période touche une
+# année archivée, le fichier est attaché en lecture seule à la connexion et la
+# table est remplacée par un UNION ALL base + archives, sans changer la requête.
+# Une année archivée n'est plus modifiable : badges, avancements et recalcul
+# datés d'une année archivée sont refusés (409).
+
+class ArchiveAnnee(db.Model):
+    __tablename__ = 'archive_annee'
+    annee = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    fichier = db.Column(db.String(255), nullable=False)
+    pointages = db.Column(db.Integer, default=0)
+    avancements = db.Column(db.Integer, default=0)
+    archive_le = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Tables archivées et leur colonne de date
+TABLES_ARCHIVEES = {
+    'pointage': (Pointage, 'date_pointage'),
+    'avancement': (Avancement, 'date'),
+}
+
+class AnneeDejaArchivee(ValueError):
+    """Année déjà archivée, éventuellement par un archivage concurrent"""
+
+class Archives:
+    """Archivage annuel et couche de requête transparente sur les années archivées"""
+    
+    def __init__(self, dossier):
+        self.dossier = dossier
+        self.lock = Lock()
+        self.verrou_archivage = Lock()
+        self._annees = None
+        self._tables = {}
+    
+    def annees(self):
+        """{année archivée: fichier}, lu une fois puis gardé en mémoire"""
+        with self.lock:
+            if self._annees is None:
+                self._annees = dict(db.session.execute(db.select(ArchiveAnnee.annee, ArchiveAnnee.fichier)).all())
+            return self._annees
+    
+    def invalider(self):
+        with self.lock:
+            self._annees = None
+    
+    def est_archivee(self, jour):
+        """Vrai si `jour` tombe dans une année archivée (plus modifiable)"""
+        return jour is not None and jour.year in self.annees()
+    
+    def table(self, nom, annee):
+        """Table `nom` du fichier d'archive de `annee` (schéma SQLite archive_AAAA)"""
+        cle = (nom, annee)
+        with self.lock:
+            if cle not in self._tables:
+                source = TABLES_ARCHIVEES[nom][0].__table__
+                schema = f'archive_{annee}'
+                colonne_date = TABLES_ARCHIVEES[nom][1]
+                self._tables[cle] = db.Table(
+                    nom, db.MetaData(),
+                    *[db.Column(c.name, c.type, primary_key=c.primary_key) for c in source.columns],
+                    db.Index(f'ix_{nom}_{colonne_date}', colonne_date),
+                    db.Index(f'ix_{nom}_employe_id', 'employe_id'),
+                    schema=schema,
+                )
+            return self._tables[cle]
+    
+    def _attacher(self, connection, annee, lecture_seule=True):
+        schema = f'archive_{annee}'
+        attachees = {ligne[1] for ligne in connection.exec_driver_sql('PRAGMA database_list')}
+        if schema in attachees and not lecture_seule:
+            # Connexion du pool qui a servi à une lecture : attachée en lecture seule
+            connection.exec_driver_sql(f'DETACH DATABASE {schema}')
+            attachees.discard(schema)
+        if schema not in attachees:
+            chemin = os.path.abspath(os.path.join(self.dossier, f'historique_{annee}.db'))
+            cible = f'file:{chemin}?mode=ro' if lecture_seule else chemin
+            connection.exec_driver_sql(f'ATTACH DATABASE ? AS {schema}', (cible,))
+        return schema
+    
+    def adapter(self, requete, modele, debut, fin=None):
+        """`requete` (écrite sur la table du modèle) étendue aux années archivées de [debut, fin]"""
+        table = modele.__table__
+        if db.engine.dialect.name != 'sqlite' or debut is None or table.name not in TABLES_ARCHIVEES:
+            return requete
+        archivees = self.annees()
+        fin = fin or date.today()
+        annees = [a for a in range(debut.year, fin.year + 1) if a in archivees]
+        if not annees:
+            return requete
+        connection = db.session.connection()
+        selects = [db.select(table)]
+        for annee in annees:
+            self._attacher(connection, annee)
+            archive = self.table(table.name, annee)
+            selects.append(db.select(*[archive.c[c.name] for c in table.columns]))
+        return ClauseAdapter(db.union_all(*selects).subquery(table.name)).traverse(requete)
+    
+    def archiver(self, annee, compacter_base=False):
+        """Déplace l'année `annee` (close) vers son fichier d'archive ; retourne les lignes déplacées"""
+        # Un archivage à la fois dans le processus ; entre processus, la clé
+        # primaire d'archive_annee refuse le second (AnneeDejaArchivee)
+        with self.verrou_archivage:
+            self.invalider()
+            return self._archiver(annee, compacter_base)
+    
+    def _archiver(self, annee, compacter_base):
+        if db.engine.dialect.name != 'sqlite':
+            raise ValueError('Archivage disponible uniquement avec SQLite')
+        if annee > date.today().year - app.config['ARCHIVE_ANNEES_CHAUDES']:
+            raise ValueError(f"L'année {annee} n'est pas close (ARCHIVE_ANNEES_CHAUDES="
+                             f"{app.config['ARCHIVE_ANNEES_CHAUDES']})")
+        if annee in self.annees():
+            raise AnneeDejaArchivee(f"L'année {annee} est déjà archivée")
+        
+        os.makedirs(self.dossier, exist_ok=True)
+        chemin = os.path.join(self.dossier, f'historique_{annee}.db')
+        mode_initial = None
+        if os.path.exists(chemin):
+            mode_initial = os.stat(chemin).st_mode & 0o777
+            os.chmod(chemin, 0o644)  # reprise d'un archivage interrompu
+        debut, fin = date(annee, 1, 1), date(annee + 1, 1, 1)
+        lignes = {}
+        with db.engine.connect() as connection:
+            schema = self._attacher(connection, annee, lecture_seule=False)
+            connection.commit()
+            try:
+                # Copie puis suppression dans une même transaction ; la copie est
+                # idempotente (OR REPLACE) pour pouvoir relancer après une interruption
+                with connection.begin():
+                    for nom, (modele, colonne_date) in TABLES_ARCHIVEES.items():
+                        archive = self.table(nom, annee)
+                        archive.create(connection, checkfirst=True)
+                        for index in archive.indexes:
+                            index.create(connection, checkfirst=True)
+                        source = modele.__table__
+                        periode = (source.c[colonne_date] >= debut) & (source.c[colonne_date] < fin)
+                        noms = [c.name for c in source.columns]
+                        connection.execute(archive.insert().prefix_with('OR REPLACE').from_select(
+                            noms, db.select(*[source.c[n] for n in noms]).where(periode)))
+                        lignes[nom] = connection.execute(source.delete().where(periode)).rowcount
+                    connection.execute(db.insert(ArchiveAnnee).values(
+                        annee=annee, fichier=os.path.basename(chemin),
+                        pointages=lignes['pointage'], avancements=lignes['avancement']))
+            except IntegrityError:
+                # Archivée entre-temps par un autre processus : rien n'a été déplacé
+                if mode_initial is not None:
+                    os.chmod(chemin, mode_initial)
+                self.invalider()
+                raise AnneeDejaArchivee(f"L'année {annee} est déjà archivée") from None
+            finally:
+                connection.rollback()
+                connection.exec_driver_sql(f'DETACH DATABASE {schema}')
+                connection.commit()
+        
+        # Compactage de l'archive puis lecture seule sur disque
+        import sqlite3
+        fichier = sqlite3.connect(chemin)
+        fichier.execute('VACUUM')
+        fichier.close()
+        os.chmod(chemin, 0o444)
+        if compacter_base:
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql('VACUUM')
+        self.invalider()
+        return lignes
+
+archives = Archives(app.config['ARCHIVE_DIR'])
+
+def refus_annee_archivee(jour):
+    return {'success': False, 'message': f"L'année {jour.year} est archivée : modification impossible"}
+
+@app.route('/api/admin/archives', methods=['GET', 'POST'])
+@budget_sql(None)  # maintenance : DDL et copies, sans rapport avec un N+1
+@login_required
+def api_archives():
+    """Années archivées (GET) ; archivage d'une année close (POST {annee, compacter?})"""
+    if not isinstance(current_user, Admin):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            annee = int(data['annee'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Année requise'}), 400
+        try:
+            lignes = archives.archiver(annee, compacter_base=bool(data.get('compacter')))
+        except AnneeDejaArchivee as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return jsonify({'success': True, 'annee': annee, 'lignes': lignes})
+    return jsonify([{
+        'annee': a.annee, 'fichier': a.fichier, 'pointages': a.pointages,
+        'avancements': a.avancements, 'archive_le': iso(a.archive_le),
+    } for a in ArchiveAnnee.query.order_by(ArchiveAnnee.annee)])
 
 # ===== GÉNÉRATION PDF =====
 
 @app.route('/api/devis/<int:id>/pdf')
 @login_required
+@metrique_pdf.chronometrer(document='devis')
 def devis_pdf(id):
     devis = Devis.query.get_or_404(id)
     
@@ -1319,6 +3290,7 @@ def devis_pdf(id):
 
 @app.route('/api/factures/<int:id>/pdf')
 @login_required
+@metrique_pdf.chronometrer(document='facture')
 def facture_pdf(id):
     facture = Facture.query.get_or_404(id)
     buffer = io.BytesIO()
@@ -1356,6 +3328,7 @@ def facture_pdf(id):
 
 @app.route('/api/export/employes')
 @login_required
+@metrique_export.chronometrer(export='employes')
 def export_employes_csv():
     output = pyio.StringIO()
     writer = csv.writer(output, delimiter=';')
@@ -1369,6 +3342,7 @@ def export_employes_csv():
 
 @app.route('/api/export/clients')
 @login_required
+@metrique_export.chronometrer(export='clients')
 def export_clients_csv():
     output = pyio.StringIO()
     writer = csv.writer(output, delimiter=';')
@@ -1380,6 +3354,65 @@ def export_clients_csv():
     buffer.seek(0)
     return send_file(buffer, mimetype='text/csv', as_attachment=True, download_name='clients.csv')
 
+@app.route('/api/export/pointages')
+@login_required
+@metrique_export.chronometrer(export='pointages')
+def export_pointages_xlsx():
+    """Feuille de temps mensuelle (?month=AAAA-MM) au format XLSX.
+    
+    Classeur openpyxl en mode write-only alimenté par un curseur serveur
+    (yield_per) : la mémoire reste constante quel que soit le nombre de lignes,
+    le fichier est construit sur disque puis envoyé par morceaux.
+    """
+    try:
+        mois = datetime.strptime(request.args.get('month') or date.today().strftime('%Y-%m'), '%Y-%m').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Paramètre month invalide (AAAA-MM)'}), 400
+    fin = (mois + timedelta(days=32)).replace(day=1)
+    
+    wb = Workbook(write_only=True)
+    feuille = wb.create_sheet('Pointages')
+    feuille.append(['Matricule', 'Nom', 'Prénom', 'Date', 'Arrivée matin', 'Départ midi',
+                    'Reprise', 'Départ soir', 'Heures', 'Heures sup.', 'Retard matin', 'Retard après-midi'])
+    
+    requete = db.select(
+        Employe.matricule, Employe.nom, Employe.prenom, Pointage.date_pointage,
+        Pointage.arrivee_matin, Pointage.depart_midi, Pointage.arrivee_apres_midi, Pointage.depart_soir,
+        Pointage.heures_travaillees, Pointage.heures_supplementaires,
+        Pointage.retard_matin, Pointage.retard_apres_midi
+    ).join(Employe, Pointage.employe_id == Employe.id).where(
+        Pointage.date_pointage >= mois, Pointage.date_pointage < fin
+    ).order_by(Employe.nom, Employe.prenom, Employe.id, Pointage.date_pointage).execution_options(yield_per=1000)
+    requete = archives.adapter(requete, Pointage, mois, fin - timedelta(days=1))
+    
+    heure = lambda dt: dt.time().replace(microsecond=0) if dt else None
+    synthese = []  # une ligne par employé : reste petit
+    courant = None
+    for (matricule, nom, prenom, jour, matin, midi, reprise, soir,
+         heures, heures_sup, retard_m, retard_am) in db.session.execute(requete):
+        if courant is None or courant[0] != matricule:
+            courant = [matricule, nom, prenom, 0, 0.0, 0.0, 0]
+            synthese.append(courant)
+        courant[3] += 1
+        courant[4] += heures or 0
+        courant[5] += heures_sup or 0
+        courant[6] += int(bool(retard_m)) + int(bool(retard_am))
+        feuille.append([matricule, nom, prenom, jour, heure(matin), heure(midi), heure(reprise), heure(soir),
+                        heures or 0, heures_sup or 0, 'Oui' if retard_m else 'Non', 'Oui' if retard_am else 'Non'])
+    
+    recap = wb.create_sheet('Synthèse')
+    recap.append(['Matricule', 'Nom', 'Prénom', 'Jours pointés', 'Heures', 'Heures sup.', 'Retards'])
+    for matricule, nom, prenom, jours, heures, heures_sup, retards in synthese:
+        recap.append([matricule, nom, prenom, jours, round(heures, 2), round(heures_sup, 2), retards])
+    
+    fichier = tempfile.TemporaryFile()
+    wb.save(fichier)
+    fichier.seek(0)
+    return send_file(fichier,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     as_attachment=True,
+                     download_name=f"pointages_{mois.strftime('%Y-%m')}.xlsx")
+
 @app.route('/favicon.ico')
 def favicon():
     # Supprime les 404 favicon dans les logs
@@ -1425,6 +3458,14 @@ def handle_connect():
 def handle_disconnect():
     print(f'Client déconnecté: {request.sid}')
 
+@socketio.on('join_dashboard')
+def on_join_dashboard(data=None):
+    """Abonne un tableau de bord aux KPIs poussés (kpi_update)"""
+    if not current_user.is_authenticated:
+        return
+    join_room('dashboard')
+    emit('kpi_update', indicateurs_dashboard.get())
+
 @socketio.on('join_chantier')
 def on_join_chantier(data):
     chantier_id = data['chantier_id']
@@ -1459,183 +3500,261 @@ def handle_notification(data):
 
 # ===== INITIALISATION =====
 
-def init_db():
-    with app.app_context():
-        # Supprimer et recréer les tables
-        db.drop_all()
-        db.create_all()
-        
-        # Créer l'admin principal
-        admin = Admin(
-            username='admin',
-            email='info@globibat.com'
+# Le schéma est versionné : la table schema_version liste les migrations
+# appliquées et init_db() n'exécute que les étapes manquantes (une requête sur
+# une base à jour). Une base vide est créée directement au dernier schéma.
+# Les données de démonstration ne sont insérées que dans une base vide :
+# redémarrer l'application ne supprime jamais de données.
+# Nouvelle évolution du schéma = nouvelle étape à la fin de MIGRATIONS, en DDL
+# explicite (pas de create_all) pour les bases déjà en production.
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    nom = db.Column(db.String(200), nullable=False)
+    applique_le = db.Column(db.DateTime, default=datetime.utcnow)
+
+def migration_nouvelles_tables(connection):
+    db.metadata.create_all(connection, tables=[
+        BadgeHorsLigne.__table__, PositionEmploye.__table__,
+        IndicateurCumule.__table__, Compteur.__table__,
+    ])
+
+def migration_pointage_unique(connection):
+    doublons = connection.execute(
+        db.select(Pointage.employe_id, Pointage.date_pointage)
+        .group_by(Pointage.employe_id, Pointage.date_pointage)
+        .having(db.func.count() > 1)
+    ).all()
+    if doublons:
+        raise RuntimeError(
+            f'{len(doublons)} employé(s)/jour(s) ont plusieurs pointages '
+            f'(ex. employe_id={doublons[0][0]}, {doublons[0][1]}) : '
+            'fusionner ces lignes avant de relancer la migration'
         )
-        admin.set_password('Miser1597532684$')
-        db.session.add(admin)
-        
-        # Ajouter des employés de test
-        employes = [
-            Employe(matricule='EMP001', nom='Dupont', prenom='Jean', departement='Construction', 
-                   position='Chef de chantier', email='j.dupont@globibat.com', telephone='0612345678'),
-            Employe(matricule='EMP002', nom='Martin', prenom='Marie', departement='Administration', 
-                   position='Secrétaire', email='m.martin@globibat.com', telephone='0623456789'),
-            Employe(matricule='EMP003', nom='Bernard', prenom='Pierre', departement='Construction', 
-                   position='Maçon', email='p.bernard@globibat.com', telephone='0634567890'),
-            Employe(matricule='EMP004', nom='Durand', prenom='Sophie', departement='Logistique', 
-                   position='Responsable', email='s.durand@globibat.com', telephone='0645678901'),
-            Employe(matricule='EMP005', nom='Moreau', prenom='Luc', departement='Construction', 
-                   position='Électricien', email='l.moreau@globibat.com', telephone='0656789012'),
-        ]
-        for emp in employes:
-            db.session.add(emp)
-        
-        # Ajouter des clients
-        clients = [
-            Client(nom='Mairie de Toulouse', type_client='collectivite', contact='Service Travaux',
-                  telephone='0561223344', email='travaux@mairie-toulouse.fr', 
-                  adresse='Place du Capitole', ville='Toulouse', code_postal='31000'),
-            Client(nom='SARL Construction Plus', type_client='entreprise', contact='M. Dupont',
-                  telephone='0561334455', email='contact@constructionplus.fr',
-                  adresse='12 rue de l\'Industrie', ville='Blagnac', code_postal='31700'),
-            Client(nom='M. et Mme Martinez', type_client='particulier', contact='M. Martinez',
-                  telephone='0677889900', email='martinez@email.com',
-                  adresse='45 avenue des Roses', ville='Colomiers', code_postal='31770'),
-        ]
-        for client in clients:
-            db.session.add(client)
-        
-        # Ajouter des chantiers
-        chantiers = [
-            Chantier(
-                nom='Rénovation Mairie - Salle des fêtes',
-                client_id=1,
-                chef_chantier_id=1,
-                adresse='Place du Capitole, Toulouse',
-                date_debut=date.today() - timedelta(days=30),
-                date_fin_prevue=date.today() + timedelta(days=60),
-                statut='en_cours',
-                budget_initial=250000,
-                budget_consomme=87000,
-                latitude=43.6047,
-                longitude=1.4442,
-                description='Rénovation complète de la salle des fêtes municipale'
-            ),
-            Chantier(
-                nom='Construction Villa Martinez',
-                client_id=3,
-                chef_chantier_id=1,
-                adresse='45 avenue des Roses, Colomiers',
-                date_debut=date.today() + timedelta(days=15),
-                date_fin_prevue=date.today() + timedelta(days=120),
-                statut='planifie',
-                budget_initial=180000,
-                latitude=43.6118,
-                longitude=1.3369,
-                description='Construction d\'une villa individuelle de 150m²'
-            ),
-        ]
-        for chantier in chantiers:
-            db.session.add(chantier)
-        
-        # Ajouter des leads
-        leads = [
-            Lead(
-                nom='M. Dubois',
-                entreprise='Dubois Immobilier',
-                telephone='0656789012',
-                email='contact@dubois-immo.fr',
-                source='site_web',
-                potentiel_ca=150000,
-            ),
-            Lead(
-                nom='Mme Petit',
-                telephone='0623456789',
-                email='petit.marie@email.com',
-                source='telephone',
-                statut='contacte',
-                potentiel_ca=85000,
-            ),
-            Lead(
-                nom='SCI Les Jardins',
-                entreprise='SCI Les Jardins',
-                email='contact@jardins.fr',
-                source='salon',
-                potentiel_ca=320000,
-            ),
-        ]
-        for lead in leads:
-            db.session.add(lead)
-
-        # Créer un compte employé de démonstration
-        if not EmployeUser.query.first():
-            first_emp = Employe.query.first()
-            if first_emp:
-                emp_user = EmployeUser(
-                    employe_id=first_emp.id,
-                    email='employe@globibat.com'
-                )
-                emp_user.set_password('Globibat123!')
-                db.session.add(emp_user)
-        
-        # Ajouter des devis
-        devis = [
-            Devis(
-                numero='DEV-2025-0001',
-                client_id=2,
-                montant_ht=45000,
-                tva=9000,
-                montant_ttc=54000,
-                statut='envoye',
-                description='Extension bureau 50m²',
-                date_validite=date.today() + timedelta(days=30)
-            ),
-        ]
-        for d in devis:
-            db.session.add(d)
-        
-        # Ajouter des factures
-        factures = [
-            Facture(
-                numero='FAC-2025-0001',
-                client_id=1,
-                chantier_id=1,
-                montant_ht=50000,
-                tva=10000,
-                montant_ttc=60000,
-                statut='payee',
-                date_echeance=date.today() - timedelta(days=15)
-            ),
-            Facture(
-                numero='FAC-2025-0002',
-                client_id=2,
-                montant_ht=15000,
-                tva=3000,
-                montant_ttc=18000,
-                statut='envoyee',
-                date_echeance=date.today() + timedelta(days=15)
-            ),
-        ]
-        for facture in factures:
-            db.session.add(facture)
-        
-        # Ajouter des pointages pour aujourd'hui
-        aujourd_hui = date.today()
-        maintenant = datetime.now()
-        
-        for i in range(3):
-            pointage = Pointage(
-                employe_id=i+1,
-                date_pointage=aujourd_hui,
-                arrivee_matin=maintenant.replace(hour=8, minute=i*5),
-                depart_midi=maintenant.replace(hour=12, minute=0),
-                arrivee_apres_midi=maintenant.replace(hour=14, minute=i*3),
-                heures_travaillees=7.5,
-                retard_matin=(i == 2)
+    for index in Pointage.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+def migration_index_recherche(connection):
+    creer_index_recherche(db.metadata, connection)
+
+def migration_archives(connection):
+    ArchiveAnnee.__table__.create(connection, checkfirst=True)
+
+MIGRATIONS = [
+    (1, 'Tables badges hors ligne, positions, indicateurs et compteurs', migration_nouvelles_tables),
+    (2, 'Pointage unique par employé et par jour', migration_pointage_unique),
+    (3, 'Index de recherche plein texte', migration_index_recherche),
+    (4, 'Registre des années archivées', migration_archives),
+]
+
+def migrer():
+    """Applique les migrations manquantes ; retourne la liste des versions appliquées"""
+    with db.engine.begin() as connection:
+        SchemaVersion.__table__.create(connection, checkfirst=True)
+        version = connection.execute(db.select(db.func.max(SchemaVersion.version))).scalar()
+        if version is None and not db.inspect(connection).has_table(Employe.__tablename__):
+            # Base vide : schéma complet d'emblée, toutes les étapes marquées appliquées
+            db.metadata.create_all(connection)
+            connection.execute(db.insert(SchemaVersion), [
+                {'version': numero, 'nom': nom} for numero, nom, _etape in MIGRATIONS
+            ])
+            return [numero for numero, _nom, _etape in MIGRATIONS]
+    
+    appliquees = []
+    for numero, nom, etape in MIGRATIONS:
+        if numero <= (version or 0):
+            continue
+        # Une transaction par étape : une erreur laisse les étapes précédentes acquises
+        with db.engine.begin() as connection:
+            etape(connection)
+            connection.execute(db.insert(SchemaVersion).values(version=numero, nom=nom))
+        print(f"[MIGRATION] {numero} - {nom}")
+        appliquees.append(numero)
+    return appliquees
+
+def base_vide():
+    return db.session.query(Admin.id).first() is None and db.session.query(Employe.id).first() is None
+
+def peupler_demo():
+    """Données de démonstration (base vide uniquement)"""
+    # Créer l'admin principal
+    admin = Admin(
+        username='admin',
+        email='info@globibat.com'
+    )
+    admin.set_password('Miser1597532684$')
+    db.session.add(admin)
+    
+    # Ajouter des employés de test
+    employes = [
+        Employe(matricule='EMP001', nom='Dupont', prenom='Jean', departement='Construction', 
+               position='Chef de chantier', email='j.dupont@globibat.com', telephone='0612345678'),
+        Employe(matricule='EMP002', nom='Martin', prenom='Marie', departement='Administration', 
+               position='Secrétaire', email='m.martin@globibat.com', telephone='0623456789'),
+        Employe(matricule='EMP003', nom='Bernard', prenom='Pierre', departement='Construction', 
+               position='Maçon', email='p.bernard@globibat.com', telephone='0634567890'),
+        Employe(matricule='EMP004', nom='Durand', prenom='Sophie', departement='Logistique', 
+               position='Responsable', email='s.durand@globibat.com', telephone='0645678901'),
+        Employe(matricule='EMP005', nom='Moreau', prenom='Luc', departement='Construction', 
+               position='Électricien', email='l.moreau@globibat.com', telephone='0656789012'),
+    ]
+    for emp in employes:
+        db.session.add(emp)
+    
+    # Ajouter des clients
+    clients = [
+        Client(nom='Mairie de Toulouse', type_client='collectivite', contact='Service Travaux',
+              telephone='0561223344', email='travaux@mairie-toulouse.fr', 
+              adresse='Place du Capitole', ville='Toulouse', code_postal='31000'),
+        Client(nom='SARL Construction Plus', type_client='entreprise', contact='M. Dupont',
+              telephone='0561334455', email='contact@constructionplus.fr',
+              adresse='12 rue de l\'Industrie', ville='Blagnac', code_postal='31700'),
+        Client(nom='M. et Mme Martinez', type_client='particulier', contact='M. Martinez',
+              telephone='0677889900', email='martinez@email.com',
+              adresse='45 avenue des Roses', ville='Colomiers', code_postal='31770'),
+    ]
+    for client in clients:
+        db.session.add(client)
+    
+    # Ajouter des chantiers
+    chantiers = [
+        Chantier(
+            nom='Rénovation Mairie - Salle des fêtes',
+            client_id=1,
+            chef_chantier_id=1,
+            adresse='Place du Capitole, Toulouse',
+            date_debut=date.today() - timedelta(days=30),
+            date_fin_prevue=date.today() + timedelta(days=60),
+            statut='en_cours',
+            budget_initial=250000,
+            budget_consomme=87000,
+            latitude=43.6047,
+            longitude=1.4442,
+            description='Rénovation complète de la salle des fêtes municipale'
+        ),
+        Chantier(
+            nom='Construction Villa Martinez',
+            client_id=3,
+            chef_chantier_id=1,
+            adresse='45 avenue des Roses, Colomiers',
+            date_debut=date.today() + timedelta(days=15),
+            date_fin_prevue=date.today() + timedelta(days=120),
+            statut='planifie',
+            budget_initial=180000,
+            latitude=43.6118,
+            longitude=1.3369,
+            description='Construction d\'une villa individuelle de 150m²'
+        ),
+    ]
+    for chantier in chantiers:
+        db.session.add(chantier)
+    
+    # Ajouter des leads
+    leads = [
+        Lead(
+            nom='M. Dubois',
+            entreprise='Dubois Immobilier',
+            telephone='0656789012',
+            email='contact@dubois-immo.fr',
+            source='site_web',
+            potentiel_ca=150000,
+        ),
+        Lead(
+            nom='Mme Petit',
+            telephone='0623456789',
+            email='petit.marie@email.com',
+            source='telephone',
+            statut='contacte',
+            potentiel_ca=85000,
+        ),
+        Lead(
+            nom='SCI Les Jardins',
+            entreprise='SCI Les Jardins',
+            email='contact@jardins.fr',
+            source='salon',
+            potentiel_ca=320000,
+        ),
+    ]
+    for lead in leads:
+        db.session.add(lead)
+
+    # Créer un compte employé de démonstration
+    if not EmployeUser.query.first():
+        first_emp = Employe.query.first()
+        if first_emp:
+            emp_user = EmployeUser(
+                employe_id=first_emp.id,
+                email='employe@globibat.com'
             )
-            db.session.add(pointage)
-        
-        db.session.commit()
-        print("✅ Base de données initialisée avec succès")
+            emp_user.set_password('Globibat123!')
+            db.session.add(emp_user)
+    
+    # Ajouter des devis
+    devis = [
+        Devis(
+            numero='DEV-2025-0001',
+            client_id=2,
+            montant_ht=45000,
+            tva=9000,
+            montant_ttc=54000,
+            statut='envoye',
+            description='Extension bureau 50m²',
+            date_validite=date.today() + timedelta(days=30)
+        ),
+    ]
+    for d in devis:
+        db.session.add(d)
+    
+    # Ajouter des factures
+    factures = [
+        Facture(
+            numero='FAC-2025-0001',
+            client_id=1,
+            chantier_id=1,
+            montant_ht=50000,
+            tva=10000,
+            montant_ttc=60000,
+            statut='payee',
+            date_echeance=date.today() - timedelta(days=15)
+        ),
+        Facture(
+            numero='FAC-2025-0002',
+            client_id=2,
+            montant_ht=15000,
+            tva=3000,
+            montant_ttc=18000,
+            statut='envoyee',
+            date_echeance=date.today() + timedelta(days=15)
+        ),
+    ]
+    for facture in factures:
+        db.session.add(facture)
+    
+    # Ajouter des pointages pour aujourd'hui
+    aujourd_hui = date.today()
+    maintenant = datetime.now()
+    
+    for i in range(3):
+        pointage = Pointage(
+            employe_id=i+1,
+            date_pointage=aujourd_hui,
+            arrivee_matin=maintenant.replace(hour=8, minute=i*5),
+            depart_midi=maintenant.replace(hour=12, minute=0),
+            arrivee_apres_midi=maintenant.replace(hour=14, minute=i*3),
+            heures_travaillees=7.5,
+            retard_matin=(i == 2)
+        )
+        db.session.add(pointage)
+    
+    db.session.commit()
+
+def init_db():
+    with app.app_context():
+        migrer()
+        if base_vide():
+            peupler_demo()
+            print("✅ Base de données initialisée avec succès")
 
 # ===== ROUTES DE SYNCHRONISATION =====
 
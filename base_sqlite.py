@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Réglages SQLite de production pour le CRM.
+
+- PRAGMA appliqués à chaque connexion : journal WAL (lecteurs et écrivain ne
+  se bloquent plus), busy_timeout (attente au lieu de "database is locked"),
+  synchronous=NORMAL (sûr en WAL, un fsync par checkpoint au lieu d'un par
+  commit), cache_size et mmap_size.
+- Voie d'écriture unique : les sessions lisent via le pool habituel, mais dès
+  leur première écriture (flush, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE)
+  elles passent sur un moteur "ecriture" limité à une connexion. Les
+  transactions d'écriture sont ainsi sérialisées dans le processus au lieu
+  de se disputer le verrou SQLite, et aucune n'est démarrée sur un instantané
+  de lecture périmé (cause des SQLITE_BUSY immédiats en WAL).
+
+Activé par SQLITE_TUNING=1 (défaut) ; sans effet sur un autre moteur que SQLite.
+"""
+
+import sqlite3
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import Select
+
+BIND_ECRITURE = 'ecriture'
+_CLE_ECRITURE = 'voie_ecriture'
+
+
+def pragmas(config):
+    """Instructions PRAGMA exécutées à l'ouverture de chaque connexion"""
+    return [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        # Valeur négative : taille en Kio plutôt qu'en pages
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE_MB']) * 1024 * 1024}",
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+
+def configurer(app):
+    """Applique les réglages si l'application utilise SQLite et SQLITE_TUNING=1.
+
+    À appeler avant SQLAlchemy(app) : ajoute le bind "ecriture" (même base,
+    une seule connexion) et la classe de session qui y route les écritures.
+    Retourne les options de session à passer à SQLAlchemy.
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not app.config['SQLITE_TUNING'] or not uri.startswith('sqlite'):
+        return {}
+
+    instructions = pragmas(app.config)
+
+    @event.listens_for(Engine, 'connect')
+    def appliquer_pragmas(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            curseur = dbapi_connection.cursor()
+            for instruction in instructions:
+                curseur.execute(instruction)
+            curseur.close()
+
+    if app.config['SQLITE_ECRIVAIN_UNIQUE']:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[BIND_ECRITURE] = {
+            'url': uri,
+            'pool_size': 1,
+            'max_overflow': 0,
+            # Attente max de la voie d'écriture (secondes) avant échec
+            'pool_timeout': 30,
+        }
+        return {'class_': SessionEcrivainUnique}
+    return {}
+
+
+def _est_ecriture(clause):
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, Select):
+        return clause._for_update_arg is not None
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(('SELECT', 'WITH', 'PRAGMA'))
+    return False
+
+
+class SessionEcrivainUnique(Session):
+    """Session Flask-SQLAlchemy qui bascule sur le moteur d'écriture à la première écriture.
+
+    Une fois basculée, toutes ses requêtes (lectures comprises) passent par la
+    connexion d'écriture jusqu'à la fin de la transaction, pour relire ses
+    propres écritures non commitées.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engines = self._db.engines
+            if BIND_ECRITURE in engines and (
+                    self.info.get(_CLE_ECRITURE) or self._flushing or _est_ecriture(clause)):
+                self.info[_CLE_ECRITURE] = True
+                return engines[BIND_ECRITURE]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(SessionEcrivainUnique, 'after_transaction_end')
+def liberer_voie_ecriture(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_CLE_ECRITURE, None)
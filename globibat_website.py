@@ -11,6 +11,7 @@ import os
 import json
 from werkzeug.utils import secure_filename
 import re
+from metriques import Registre, instrumenter_flask
 
 # Configuration Flask
 app = Flask(__name__, 
@@ -21,6 +22,9 @@ app.config['SECRET_KEY'] = 'globibat-premium-2024'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 CORS(app)
 
+# Métriques Prometheus (/metrics, protégé par METRICS_TOKEN si défini)
+metriques = instrumenter_flask(app, Registre('globibat_site'), os.environ.get('METRICS_TOKEN') or None)
+
 # Headers de sécurité
 @app.after_request
 def add_security_headers(response):
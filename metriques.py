@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Métriques Prometheus (format texte) communes au CRM et au site web.
+
+Les incréments sont sans verrou : chaque thread incrémente son propre
+dictionnaire (aucune contention entre requêtes), et la lecture /metrics
+additionne les dictionnaires de tous les threads. Le verrou du registre ne
+sert qu'à l'inscription d'un nouveau thread et à la lecture : les threads
+terminés (serveur threading : un thread par requête) y sont fusionnés dans
+une base commune, à chaque lecture et à chaque inscription, ce qui borne la
+mémoire même sans lecture /metrics.
+
+Exemple :
+    registre = Registre('globibat')
+    badges = registre.compteur('badges_total', 'Badges enregistrés', ('type',))
+    badges.inc(type='matin')
+    instrumenter_flask(app, registre)   # métriques HTTP + route /metrics
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+from flask import g, request
+
+TYPE_CONTENU = 'text/plain; version=0.0.4; charset=utf-8'
+
+BUCKETS_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_TAILLE = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _echapper(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(noms, valeurs, extra=''):
+    paires = [f'{nom}="{_echapper(v)}"' for nom, v in zip(noms, valeurs)]
+    if extra:
+        paires.append(extra)
+    return '{' + ','.join(paires) + '}' if paires else ''
+
+
+def _format_nombre(valeur):
+    if valeur == float('inf'):
+        return '+Inf'
+    return repr(float(valeur)) if isinstance(valeur, float) else str(valeur)
+
+
+class Registre:
+    """Ensemble des métriques d'une application et de leurs valeurs par thread"""
+
+    def __init__(self, prefixe):
+        self.prefixe = prefixe
+        self.metriques = []
+        self._local = threading.local()
+        self._fragments = []  # (thread, dict des valeurs du thread), threads vivants
+        self._base = {}       # valeurs fusionnées des threads terminés
+        self._lock = threading.Lock()
+
+    def _valeurs(self):
+        """Dictionnaire du thread courant (créé et inscrit au premier usage)"""
+        try:
+            return self._local.valeurs
+        except AttributeError:
+            valeurs = self._local.valeurs = {}
+            with self._lock:
+                self._fusionner_termines()
+                self._fragments.append((threading.current_thread(), valeurs))
+            return valeurs
+
+    def _fusionner_termines(self):
+        """Verse les valeurs des threads terminés dans la base (verrou du registre tenu)"""
+        i = 0
+        while i < len(self._fragments):
+            thread, valeurs = self._fragments[i]
+            if thread.is_alive():
+                i += 1
+                continue
+            # Un thread terminé n'écrit plus : ses valeurs sont définitives
+            for cle, v in valeurs.items():
+                self._base[cle] = self._base.get(cle, 0) + v
+            self._fragments[i] = self._fragments[-1]
+            self._fragments.pop()
+
+    def ajouter(self, cle, delta):
+        valeurs = self._valeurs()
+        valeurs[cle] = valeurs.get(cle, 0) + delta
+
+    def totaux(self):
+        """Somme des valeurs de tous les threads (les threads morts sont fusionnés)"""
+        with self._lock:
+            self._fusionner_termines()
+            totaux = dict(self._base)
+            for _thread, valeurs in self._fragments:
+                for cle, v in valeurs.copy().items():
+                    totaux[cle] = totaux.get(cle, 0) + v
+        return totaux
+
+    def compteur(self, nom, aide, labels=()):
+        return self._enregistrer(Compteur(self, f'{self.prefixe}_{nom}', aide, labels))
+
+    def histogramme(self, nom, aide, labels=(), buckets=BUCKETS_DUREE):
+        return self._enregistrer(Histogramme(self, f'{self.prefixe}_{nom}', aide, labels, buckets))
+
+    def jauge(self, nom, aide, labels=(), fonction=None):
+        """Jauge calculée à la lecture : fonction() -> nombre ou {(valeurs de labels): nombre}"""
+        return self._enregistrer(Jauge(self, f'{self.prefixe}_{nom}', aide, labels, fonction))
+
+    def _enregistrer(self, metrique):
+        self.metriques.append(metrique)
+        return metrique
+
+    def exposition(self):
+        totaux = self.totaux()
+        lignes = []
+        for metrique in self.metriques:
+            lignes.append(f'# HELP {metrique.nom} {metrique.aide}')
+            lignes.append(f'# TYPE {metrique.nom} {metrique.type}')
+            lignes.extend(metrique.lignes(totaux))
+        return '\n'.join(lignes) + '\n'
+
+
+class Compteur:
+    type = 'counter'
+
+    def __init__(self, registre, nom, aide, labels):
+        self.registre, self.nom, self.aide, self.labels = registre, nom, aide, tuple(labels)
+
+    def inc(self, delta=1, **labels):
+        self.registre.ajouter((self.nom, tuple(labels[n] for n in self.labels)), delta)
+
+    def lignes(self, totaux):
+        for cle, v in sorted(totaux.items(), key=str):
+            if cle[0] == self.nom:
+                yield f'{self.nom}{_format_labels(self.labels, cle[1])} {_format_nombre(v)}'
+
+
+class Histogramme:
+    type = 'histogram'
+
+    def __init__(self, registre, nom, aide, labels, buckets):
+        self.registre, self.nom, self.aide, self.labels = registre, nom, aide, tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observer(self, valeur, **labels):
+        cle = tuple(labels[n] for n in self.labels)
+        registre = self.registre
+        # Un seul bucket incrémenté (non cumulé) : le cumul est fait à la lecture
+        registre.ajouter((self.nom, cle, bisect_left(self.buckets, valeur)), 1)
+        registre.ajouter((self.nom + '_sum', cle), valeur)
+
+    def chronometrer(self, **labels):
+        """Décorateur mesurant la durée d'exécution de la fonction"""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                debut = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observer(time.perf_counter() - debut, **labels)
+            return decorated
+        return decorator
+
+    def lignes(self, totaux):
+        series = {}
+        for cle, v in totaux.items():
+            if cle[0] == self.nom:
+                series.setdefault(cle[1], [0] * len(self.buckets))[cle[2]] += v
+        for valeurs in sorted(series, key=str):
+            cumul = 0
+            for borne, n in zip(self.buckets, series[valeurs]):
+                cumul += n
+                extra = f'le="{_format_nombre(borne)}"'
+                yield f'{self.nom}_bucket{_format_labels(self.labels, valeurs, extra)} {cumul}'
+            etiquettes = _format_labels(self.labels, valeurs)
+            yield f'{self.nom}_sum{etiquettes} {_format_nombre(totaux.get((self.nom + "_sum", valeurs), 0))}'
+            yield f'{self.nom}_count{etiquettes} {cumul}'
+
+
+class Jauge:
+    type = 'gauge'
+
+    def __init__(self, registre, nom, aide, labels, fonction):
+        self.registre, self.nom, self.aide, self.labels = registre, nom, aide, tuple(labels)
+        self.fonction = fonction
+
+    def lignes(self, totaux):
+        try:
+            valeur = self.fonction()
+        except Exception:
+            return
+        if not isinstance(valeur, dict):
+            valeur = {(): valeur}
+        for valeurs, v in sorted(valeur.items(), key=str):
+            yield f'{self.nom}{_format_labels(self.labels, valeurs)} {_format_nombre(v)}'
+
+
+def instrumenter_flask(app, registre, jeton=None):
+    """Métriques HTTP par endpoint (latence, taille, requêtes en cours) et route /metrics.
+
+    jeton : si défini, /metrics exige l'en-tête Authorization: Bearer <jeton>.
+    """
+    duree = registre.histogramme('http_requete_duree_secondes', 'Durée des requêtes HTTP',
+                                 ('endpoint', 'methode'))
+    taille = registre.histogramme('http_reponse_taille_octets', 'Taille des réponses HTTP',
+                                  ('endpoint',), buckets=BUCKETS_TAILLE)
+    requetes = registre.compteur('http_requetes_total', 'Requêtes HTTP traitées',
+                                 ('endpoint', 'methode', 'statut'))
+    # En cours = débutées - terminées : deux compteurs, pas de verrou partagé
+    debutees = ('http_debutees',)
+    terminees = ('http_terminees',)
+    registre.jauge('http_requetes_en_cours', 'Requêtes HTTP en cours de traitement', fonction=lambda: (
+        lambda t: t.get(debutees, 0) - t.get(terminees, 0))(registre.totaux()))
+
+    @app.before_request
+    def metriques_debut_requete():
+        g.metriques_debut = time.perf_counter()
+        registre.ajouter(debutees, 1)
+
+    @app.after_request
+    def metriques_fin_requete(response):
+        debut = g.get('metriques_debut')
+        if debut is not None:
+            endpoint = request.endpoint or 'inconnu'
+            duree.observer(time.perf_counter() - debut, endpoint=endpoint, methode=request.method)
+            requetes.inc(endpoint=endpoint, methode=request.method, statut=str(response.status_code))
+            if response.content_length is not None:
+                taille.observer(response.content_length, endpoint=endpoint)
+        return response
+
+    @app.teardown_request
+    def metriques_teardown_requete(exc):
+        if g.pop('metriques_debut', None) is not None:
+            registre.ajouter(terminees, 1)
+
+    @app.route('/metrics')
+    def metrics():
+        if jeton and request.headers.get('Authorization') != f'Bearer {jeton}':
+            return app.response_class('Non autorisé\n', status=401, mimetype='text/plain')
+        return app.response_class(registre.exposition(), headers={'Content-Type': TYPE_CONTENU})
+
+    return registre
@@ -1,6 +1,9 @@
+import os
+
 import requests
 
-BASE = "http://127.0.0.1:5005"
+# URL du CRM testé (ex. instance lancée avec DATABASE_URL=postgresql://...)
+BASE = os.environ.get("CRM_URL", "http://127.0.0.1:5005")
 
 def get(path):
     r = requests.get(BASE + path, allow_redirects=False)
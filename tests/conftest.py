@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Base de test : TEST_DATABASE_URL (ex. postgresql://... pour valider PostgreSQL),
+# sinon une base SQLite temporaire. Jamais la base du CRM dans instance/.
+_DOSSIER = tempfile.mkdtemp(prefix='globibat_tests_')
+atexit.register(shutil.rmtree, _DOSSIER, True)
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or \
+    'sqlite:///' + os.path.join(_DOSSIER, 'tests.db').replace('\\', '/')
+os.environ['ARCHIVE_DIR'] = os.path.join(_DOSSIER, 'archives')
+
+
+@pytest.fixture(scope='session')
+def crm():
+    import app as crm
+    crm.app.config['TESTING'] = True  # active aussi le budget de requêtes SQL
+    crm.init_db()
+    return crm
+
+
+@pytest.fixture
+def sqlite_uniquement(crm):
+    """Ignore le test si la base de test n'est pas SQLite (TEST_DATABASE_URL)"""
+    with crm.app.app_context():
+        dialecte = crm.db.engine.dialect.name
+    if dialecte != 'sqlite':
+        pytest.skip('fonctionnalité propre à SQLite')
+
+
+@pytest.fixture
+def contexte(crm):
+    with crm.app.app_context():
+        yield crm
+        crm.db.session.remove()
+
+
+@pytest.fixture
+def client(crm):
+    """Client HTTP connecté avec l'administrateur de démonstration"""
+    client = crm.app.test_client()
+    with crm.app.app_context():
+        admin_id = crm.db.session.query(crm.Admin.id).order_by(crm.Admin.id).scalar()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def nouvel_employe(crm):
+    """Fabrique d'employés actifs sans pointage : retourne (id, matricule)"""
+    def fabriquer():
+        with crm.app.app_context():
+            matricule = f'T{os.urandom(4).hex().upper()}'
+            employe = crm.Employe(matricule=matricule, nom='Test', prenom='Badge', actif=True)
+            crm.db.session.add(employe)
+            crm.db.session.commit()
+            return employe.id, matricule
+    return fabriquer
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Archives historiques : relecture par l'export, années archivées non modifiables"""
+
+import io
+import os
+from datetime import date, datetime
+
+import pytest
+from openpyxl import load_workbook
+
+ANNEE = date.today().year - 6
+
+
+@pytest.fixture(scope='module')
+def archivee(crm, sqlite_uniquement_module):
+    """Employé avec deux pointages et un avancement en mars ANNEE, puis ANNEE archivée"""
+    client = crm.app.test_client()
+    with crm.app.app_context():
+        admin_id = crm.db.session.query(crm.Admin.id).order_by(crm.Admin.id).scalar()
+        employe = crm.Employe(matricule=f'ARCH{ANNEE}', nom='Archive', prenom='Test', actif=True)
+        crm.db.session.add(employe)
+        crm.db.session.flush()
+        for jour, heures in ((3, 7.5), (4, 8.0)):
+            crm.db.session.add(crm.Pointage(
+                employe_id=employe.id, date_pointage=date(ANNEE, 3, jour),
+                arrivee_matin=datetime(ANNEE, 3, jour, 8, 0), depart_soir=datetime(ANNEE, 3, jour, 17, 0),
+                heures_travaillees=heures))
+        crm.db.session.add(crm.Avancement(employe_id=employe.id, tache='Dalle', date=date(ANNEE, 3, 3)))
+        crm.db.session.commit()
+        employe_id, matricule = employe.id, employe.matricule
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    r = client.post('/api/admin/archives', json={'annee': ANNEE})
+    assert r.status_code == 200, r.get_json()
+    assert r.get_json()['lignes']['pointage'] >= 2
+    return employe_id, matricule
+
+
+@pytest.fixture(scope='module')
+def sqlite_uniquement_module(crm):
+    with crm.app.app_context():
+        if crm.db.engine.dialect.name != 'sqlite':
+            pytest.skip('fonctionnalité propre à SQLite')
+
+
+def test_export_relit_annee_archivee(crm, client, archivee):
+    employe_id, matricule = archivee
+    with crm.app.app_context():
+        restants = crm.db.session.query(crm.Pointage).filter_by(employe_id=employe_id).count()
+    assert restants == 0  # déplacés hors de la base principale
+    r = client.get(f'/api/export/pointages?month={ANNEE}-03')
+    assert r.status_code == 200
+    feuille = load_workbook(io.BytesIO(r.data), read_only=True)['Pointages']
+    lignes = [ligne for ligne in feuille.iter_rows(values_only=True) if ligne[0] == matricule]
+    assert [(ligne[3].date(), ligne[8]) for ligne in lignes] == [
+        (date(ANNEE, 3, 3), 7.5), (date(ANNEE, 3, 4), 8.0)]
+
+
+def test_liste_avancements_relit_annee_archivee(client, archivee):
+    employe_id, _ = archivee
+    r = client.get(f'/api/avancements?date_min={ANNEE}-01-01&employe_id={employe_id}')
+    assert r.status_code == 200
+    assert any(a['tache'] == 'Dalle' for a in r.get_json())
+
+
+def test_ecritures_annee_archivee_refusees(crm, client, archivee):
+    employe_id, matricule = archivee
+    r = client.post('/api/avancements', json={'employe_id': employe_id, 'tache': 'Reprise',
+                                              'date': f'{ANNEE}-06-01'})
+    assert r.status_code == 409
+    r = client.post('/api/admin/pointages/recalcul', json={'debut': f'{ANNEE}-12-01',
+                                                          'fin': f'{ANNEE + 1}-01-31'})
+    assert r.status_code == 409
+    with crm.app.app_context():
+        code, reponse, badge = crm.enregistrer_badge({'matricule': matricule, 'type': 'matin'},
+                                                     datetime(ANNEE, 6, 1, 8, 0))
+        crm.db.session.rollback()
+        assert (code, badge) == (409, None)
+        assert crm.db.session.query(crm.Pointage).filter_by(employe_id=employe_id).count() == 0
+    r = client.post('/api/avancements', json={'employe_id': employe_id, 'tache': 'Courante'})
+    assert r.status_code == 200
+
+
+def test_archivage_concurrent_409(crm, client, archivee, monkeypatch):
+    # Cache périmé (archivage fait par un autre processus) : la clé primaire tranche
+    monkeypatch.setattr(crm.archives, 'annees', lambda: {})
+    monkeypatch.setattr(crm.archives, 'invalider', lambda: None)
+    r = client.post('/api/admin/archives', json={'annee': ANNEE})
+    assert r.status_code == 409
+    fichier = os.path.join(crm.app.config['ARCHIVE_DIR'], f'historique_{ANNEE}.db')
+    assert os.stat(fichier).st_mode & 0o777 == 0o444  # archive laissée en lecture seule
+    monkeypatch.undo()
+    assert client.post('/api/admin/archives', json={'annee': ANNEE}).status_code == 409
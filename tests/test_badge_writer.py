@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Écriture groupée des badges (BADGE_GROUP_COMMIT) : refus et tickets abandonnés"""
+
+from datetime import datetime
+
+import pytest
+
+
+def pointages(crm, employe_id):
+    with crm.app.app_context():
+        return crm.db.session.query(crm.Pointage).filter_by(employe_id=employe_id).count()
+
+
+@pytest.fixture
+def writer(crm):
+    return crm.BadgeWriter(crm.app, intervalle_ms=5, taille_max=50)
+
+
+def test_lot_avec_badge_refuse(crm, writer, nouvel_employe):
+    refuse_id, refuse = nouvel_employe()
+    accepte_id, accepte = nouvel_employe()
+    maintenant = datetime.now()
+    code, reponse, _ = writer.submit({'matricule': refuse, 'type': 'pause'}, maintenant)
+    assert (code, reponse['message']) == (400, 'Type de badge inconnu')
+    code, _, badge = writer.submit({'matricule': accepte, 'type': 'matin'}, maintenant)
+    assert code == 200 and badge is not None
+    code, reponse, _ = writer.submit({'matricule': accepte, 'type': 'matin'}, maintenant)
+    assert (code, reponse['message']) == (400, 'Arrivée du matin déjà enregistrée')
+    assert pointages(crm, refuse_id) == 0
+    assert pointages(crm, accepte_id) == 1
+
+
+def test_ticket_abandonne_non_ecrit(crm, writer, nouvel_employe, monkeypatch):
+    abandonne_id, abandonne = nouvel_employe()
+    suivant_id, suivant = nouvel_employe()
+    demarrer = writer.start
+    # Writer arrêté : le ticket reste en file jusqu'au délai d'attente
+    monkeypatch.setattr(writer, 'start', lambda: None)
+    code, _, _ = writer.submit({'matricule': abandonne, 'type': 'matin'}, datetime.now(), timeout=0.05)
+    assert code == 503
+
+    monkeypatch.setattr(writer, 'start', demarrer)
+    code, _, _ = writer.submit({'matricule': suivant, 'type': 'matin'}, datetime.now())
+    assert code == 200
+    assert pointages(crm, abandonne_id) == 0
+    assert pointages(crm, suivant_id) == 1
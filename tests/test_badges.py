@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Badges : un badge refusé ne crée pas de pointage"""
+
+from datetime import datetime
+
+import pytest
+
+
+def pointages(crm, employe_id):
+    with crm.app.app_context():
+        return crm.db.session.query(crm.Pointage).filter_by(employe_id=employe_id).count()
+
+
+def test_type_inconnu_sans_pointage(crm, client, nouvel_employe):
+    employe_id, matricule = nouvel_employe()
+    r = client.post('/api/badge/check', json={'matricule': matricule, 'type': 'pause'})
+    assert r.status_code == 400
+    assert r.get_json()['message'] == 'Type de badge inconnu'
+    assert pointages(crm, employe_id) == 0
+
+
+def test_double_matin_refuse(crm, client, nouvel_employe):
+    employe_id, matricule = nouvel_employe()
+    assert client.post('/api/badge/check', json={'matricule': matricule, 'type': 'matin'}).status_code == 200
+    r = client.post('/api/badge/check', json={'matricule': matricule, 'type': 'matin'})
+    assert r.status_code == 400
+    assert r.get_json()['message'] == 'Arrivée du matin déjà enregistrée'
+    assert pointages(crm, employe_id) == 1
+
+
+def test_batch_badge_refuse_sans_pointage(crm, client, nouvel_employe):
+    refuse_id, refuse = nouvel_employe()
+    accepte_id, accepte = nouvel_employe()
+    maintenant = datetime.now().isoformat()
+    r = client.post('/api/badge/batch', json={'device_id': 'test', 'punches': [
+        {'id': f'{refuse}-1', 'matricule': refuse, 'type': 'pause', 'timestamp': maintenant},
+        {'id': f'{accepte}-1', 'matricule': accepte, 'type': 'matin', 'timestamp': maintenant},
+    ]})
+    assert r.status_code == 200
+    assert [res['success'] for res in r.get_json()['results']] == [False, True]
+    assert pointages(crm, refuse_id) == 0
+    assert pointages(crm, accepte_id) == 1
+
+
+def test_batch_mixte_badges_valides_enregistres(crm, client, nouvel_employe, monkeypatch):
+    ids = {nom: nouvel_employe() for nom in ('a', 'panne', 'b')}
+    enregistrer = crm.enregistrer_badge
+
+    def enregistrer_ou_panne(data, maintenant):
+        resultat = enregistrer(data, maintenant)  # écrit le pointage puis échoue
+        if data['matricule'] == ids['panne'][1]:
+            raise RuntimeError('panne simulée')
+        return resultat
+
+    monkeypatch.setattr(crm, 'enregistrer_badge', enregistrer_ou_panne)
+    maintenant = datetime.now().isoformat()
+    punches = [
+        {'id': 'a-1', 'matricule': ids['a'][1], 'type': 'matin', 'timestamp': maintenant},
+        {'id': 'liste-1', 'matricule': ids['a'][1], 'type': ['matin'], 'timestamp': maintenant},
+        {'id': 'dict-1', 'matricule': {'m': 1}, 'type': 'matin', 'timestamp': maintenant},
+        {'id': 'panne-1', 'matricule': ids['panne'][1], 'type': 'matin', 'timestamp': maintenant},
+        {'id': 'b-1', 'matricule': ids['b'][1], 'type': 'matin', 'timestamp': maintenant},
+    ]
+    r = client.post('/api/badge/batch', json={'device_id': 'mixte', 'punches': punches})
+    assert r.status_code == 200
+    resultats = r.get_json()['results']
+    assert [res['success'] for res in resultats] == [True, False, False, False, True]
+    assert resultats[1]['message'] == resultats[2]['message'] == 'Badge invalide'
+    assert resultats[3].get('retry') is True
+    assert pointages(crm, ids['a'][0]) == 1
+    assert pointages(crm, ids['b'][0]) == 1
+    assert pointages(crm, ids['panne'][0]) == 0  # savepoint annulé
+    with crm.app.app_context():
+        assert crm.db.session.query(crm.BadgeHorsLigne).filter_by(matricule=ids['panne'][1]).count() == 0
+
+
+def test_batch_corps_non_objet(client):
+    assert client.post('/api/badge/batch', json=[1, 2]).status_code == 400
+
+
+def test_batch_meme_id_sur_deux_appareils(crm, client, nouvel_employe):
+    premier_id, premier = nouvel_employe()
+    second_id, second = nouvel_employe()
+    maintenant = datetime.now().isoformat()
+    envoi = lambda appareil, matricule: client.post('/api/badge/batch', json={'device_id': appareil, 'punches': [
+        {'id': 'local-1', 'matricule': matricule, 'type': 'matin', 'timestamp': maintenant},
+    ]}).get_json()['results'][0]
+    assert envoi('tablette-a', premier)['success'] is True
+    resultat = envoi('tablette-b', second)
+    assert resultat['success'] is True and not resultat.get('duplicate')
+    assert envoi('tablette-a', premier).get('duplicate') is True  # renvoi du même appareil
+    assert pointages(crm, premier_id) == 1
+    assert pointages(crm, second_id) == 1
+
+
+@pytest.mark.parametrize('groupe', [False, True])
+@pytest.mark.parametrize('corps', [['matin'], {'matricule': ['M1'], 'type': 'matin'}, {'matricule': 'M1', 'type': ['matin']}])
+def test_badge_check_corps_invalide(crm, client, monkeypatch, groupe, corps):
+    monkeypatch.setitem(crm.app.config, 'BADGE_GROUP_COMMIT', groupe)
+    r = client.post('/api/badge/check', json=corps)
+    assert r.status_code == 400
+    assert r.get_json()['message'] == 'Badge invalide'
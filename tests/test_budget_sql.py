@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Budget de requêtes SQL par route (actif en mode test)"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+
+def test_route_sous_son_budget(client):
+    assert client.get('/clients/1').status_code == 200
+
+
+def test_depassement_leve_budget_sql_depasse(crm, client, monkeypatch):
+    monkeypatch.setattr(crm.app.view_functions['client_detail'], 'budget_sql', lambda: 1)
+    with pytest.raises(crm.BudgetSqlDepasse) as erreur:
+        client.get('/clients/1')
+    assert '(budget 1)' in str(erreur.value)
+
+
+def test_budget_par_element_du_lot(client, nouvel_employe):
+    maintenant = datetime.now().isoformat()
+    matricules = [nouvel_employe()[1] for _ in range(10)]
+    r = client.post('/api/badge/batch', json={'device_id': 'budget', 'punches': [
+        {'id': f'{m}-matin', 'matricule': m, 'type': 'matin', 'timestamp': maintenant} for m in matricules
+    ]})
+    assert r.status_code == 200
+    assert r.get_json()['enregistres'] == 10
+
+
+def test_archivage_exempte(crm, client, sqlite_uniquement):
+    annee = date.today().year - crm.app.config['ARCHIVE_ANNEES_CHAUDES'] - 5
+    with crm.app.app_context():
+        crm.db.session.add_all(crm.Pointage(employe_id=1, date_pointage=date(annee, 1, 1) + timedelta(days=j))
+                               for j in range(5))
+        crm.db.session.commit()
+    r = client.post('/api/admin/archives', json={'annee': annee})
+    assert r.status_code == 200
+    assert r.get_json()['lignes']['pointage'] == 5
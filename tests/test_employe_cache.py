@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Cache matricule -> employé : invalidé par les modifications et la désactivation"""
+
+
+def en_cache(crm, matricule):
+    with crm.app.app_context():
+        return crm.employe_cache.get(matricule)
+
+
+def test_put_invalide_le_cache(crm, client, nouvel_employe):
+    employe_id, matricule = nouvel_employe()
+    assert en_cache(crm, matricule).nom == 'Test'
+    assert client.put(f'/api/employes/{employe_id}', json={'telephone': '0600000000'}).status_code == 200
+    assert matricule in crm.employe_cache.entrees  # champ absent du cache : entrée gardée
+    assert client.put(f'/api/employes/{employe_id}', json={'nom': 'Renommé'}).status_code == 200
+    assert matricule not in crm.employe_cache.entrees
+    r = client.post('/api/badge/check', json={'matricule': matricule, 'type': 'matin'})
+    assert r.status_code == 200
+    assert r.get_json()['employee']['name'] == 'Badge Renommé'
+
+
+def test_delete_retire_du_cache(crm, client, nouvel_employe):
+    employe_id, matricule = nouvel_employe()
+    assert en_cache(crm, matricule) is not None
+    assert client.delete(f'/api/employes/{employe_id}').status_code == 200
+    assert en_cache(crm, matricule) is None
+    r = client.post('/api/badge/check', json={'matricule': matricule, 'type': 'matin'})
+    assert r.status_code == 404
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Export XLSX des pointages : détail par jour et synthèse par employé"""
+
+import io
+from datetime import date, datetime, time
+
+from openpyxl import load_workbook
+
+ANNEE = date.today().year - 1
+
+
+def test_export_mensuel(crm, client, nouvel_employe):
+    employe_id, matricule = nouvel_employe()
+    with crm.app.app_context():
+        for jour, retard, heures, sup in ((6, True, 9.0, 1.0), (7, False, 7.5, 0)):
+            crm.db.session.add(crm.Pointage(
+                employe_id=employe_id, date_pointage=date(ANNEE, 5, jour),
+                arrivee_matin=datetime(ANNEE, 5, jour, 9 if retard else 8, 30), depart_midi=datetime(ANNEE, 5, jour, 12),
+                heures_travaillees=heures, heures_supplementaires=sup, retard_matin=retard))
+        # Hors du mois demandé
+        crm.db.session.add(crm.Pointage(employe_id=employe_id, date_pointage=date(ANNEE, 6, 1), heures_travaillees=8))
+        crm.db.session.commit()
+
+    r = client.get(f'/api/export/pointages?month={ANNEE}-05')
+    assert r.status_code == 200
+    assert r.mimetype == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    assert f'pointages_{ANNEE}-05.xlsx' in r.headers['Content-Disposition']
+    classeur = load_workbook(io.BytesIO(r.data), read_only=True)
+    assert classeur.sheetnames == ['Pointages', 'Synthèse']
+
+    lignes = list(classeur['Pointages'].iter_rows(values_only=True))
+    assert lignes[0][:4] == ('Matricule', 'Nom', 'Prénom', 'Date')
+    employe = [ligne for ligne in lignes[1:] if ligne[0] == matricule]
+    assert employe == [
+        (matricule, 'Test', 'Badge', datetime(ANNEE, 5, 6), time(9, 30), time(12, 0), None, None, 9, 1, 'Oui', 'Non'),
+        (matricule, 'Test', 'Badge', datetime(ANNEE, 5, 7), time(8, 30), time(12, 0), None, None, 7.5, 0, 'Non', 'Non'),
+    ]
+    synthese = [ligne for ligne in classeur['Synthèse'].iter_rows(values_only=True) if ligne[0] == matricule]
+    assert synthese == [(matricule, 'Test', 'Badge', 2, 16.5, 1, 1)]
+
+
+def test_export_mois_invalide(client):
+    assert client.get('/api/export/pointages?month=2024-13').status_code == 400
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Indicateurs cumulés : réconciliation sans delta perdu, correction visible des clients"""
+
+import threading
+
+
+def test_reconciliation_sans_delta_perdu(crm, monkeypatch):
+    calculer = crm.calculer_indicateurs
+    concurrent = []
+
+    def ajouter_employe():
+        with crm.app.app_context():
+            crm.db.session.add(crm.Employe(matricule='RECONC1', nom='Delta', prenom='Concurrent', actif=True))
+            crm.db.session.commit()
+            crm.db.session.remove()
+
+    principal = threading.current_thread()
+
+    def calculer_puis_ecriture_concurrente(mois):
+        valeurs = calculer(mois)
+        if threading.current_thread() is not principal or concurrent:
+            return valeurs  # réconciliation ou push KPI en arrière-plan : pas d'écriture
+        # Une écriture arrive entre le comptage et la réécriture de la ligne cumulée
+        thread = threading.Thread(target=ajouter_employe)
+        thread.start()
+        thread.join(0.5)
+        concurrent.append(thread)
+        return valeurs
+
+    monkeypatch.setattr(crm, 'calculer_indicateurs', calculer_puis_ecriture_concurrente)
+    with crm.app.app_context():
+        crm.reconcilier_indicateurs()
+        crm.db.session.remove()
+    concurrent[0].join()
+
+    with crm.app.app_context():
+        cumul = crm.db.session.get(crm.IndicateurCumule, 1)
+        assert cumul.total_employes == crm.db.session.query(crm.Employe).count()
+        assert cumul.employes_actifs == crm.db.session.query(crm.Employe).filter_by(actif=True).count()
+
+
+def test_correction_invalide_etag_dashboard(crm, client):
+    with crm.app.app_context():
+        crm.reconcilier_indicateurs()
+        table = crm.IndicateurCumule.__table__
+        # Dérive : la ligne cumulée ne correspond plus aux tables
+        crm.db.session.execute(table.update().where(table.c.id == 1).values(
+            employes_actifs=table.c.employes_actifs + 7))
+        crm.db.session.commit()
+        crm.db.session.remove()
+    crm.indicateurs_dashboard.cle = None  # relire la ligne dérivée
+    r = client.get('/api/stats/dashboard')
+    etag, faux = r.headers['ETag'], r.get_json()['employes_actifs']
+    versions = crm.versions_tables.etat(('employe', 'chantier'))[0]
+
+    with crm.app.app_context():
+        ecarts = crm.reconcilier_indicateurs()
+        actifs = crm.db.session.query(crm.Employe).filter_by(actif=True).count()
+        crm.db.session.remove()
+    assert ecarts == {'employes_actifs': -7}
+    apres = crm.versions_tables.etat(('employe', 'chantier'))[0]
+    assert apres[0] > versions[0] and apres[1] == versions[1]
+
+    r = client.get('/api/stats/dashboard', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.get_json()['employes_actifs'] == actifs == faux - 7
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Listes JSON paginées : bornes du paramètre limit, liste complète en flux"""
+
+import json
+
+
+def test_limit_negatif_borne_a_un(client):
+    r = client.get('/api/employes?limit=-1')
+    assert r.status_code == 200
+    assert len(r.get_json()) == 1
+    assert 'X-Next-Cursor' in r.headers
+
+
+def test_limit_trop_grand_borne_au_maximum(crm, client, monkeypatch):
+    monkeypatch.setitem(crm.app.config, 'API_PAGE_MAX', 2)
+    assert len(client.get('/api/employes?limit=100000').get_json()) == 2
+
+
+def test_limit_non_numerique_taille_par_defaut(crm, client, monkeypatch):
+    monkeypatch.setitem(crm.app.config, 'API_PAGE_DEFAULT', 3)
+    r = client.get('/api/employes?limit=abc')
+    assert r.status_code == 200
+    assert len(r.get_json()) == 3
+
+
+def test_flux_identique_aux_pages(crm, client, nouvel_employe):
+    for _ in range(3):
+        nouvel_employe()
+    r = client.get('/api/employes')
+    assert r.status_code == 200 and r.mimetype == 'application/json'
+    assert 'X-Next-Cursor' not in r.headers
+    complet = json.loads(r.get_data(as_text=True))
+
+    pages, url = [], '/api/employes?limit=2'
+    while url:
+        page = client.get(url)
+        pages.extend(page.get_json())
+        url = f"/api/employes?limit=2&after={page.headers['X-Next-Cursor']}" if 'X-Next-Cursor' in page.headers else None
+    par_id = lambda lignes: sorted(lignes, key=lambda ligne: ligne['id'])
+    assert par_id(complet) == par_id(pages)
+
+
+def test_flux_par_lots_egal_au_json(crm, nouvel_employe):
+    for _ in range(5):
+        nouvel_employe()
+    for url in ('/api/employes', '/api/avancements?statut=inexistant'):
+        liste = crm.LISTE_EMPLOYES if url.startswith('/api/employes') else crm.LISTE_AVANCEMENTS
+        with crm.app.test_request_context(url):
+            requete, noms, limit = liste.requete()
+            assert limit is None
+            attendu = [liste.serialiser(ligne, noms) for ligne in crm.db.session.execute(requete)]
+            flux = ''.join(liste.flux(requete, noms, taille_lot=2))
+            assert json.loads(flux) == json.loads(crm.app.json.dumps(attendu))
+            crm.db.session.remove()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Registre de métriques : incréments concurrents, lecture /metrics simultanée, accès admin"""
+
+import os
+import threading
+
+import pytest
+
+from metriques import Registre
+
+
+def test_increments_concurrents_pendant_lecture():
+    registre = Registre('test')
+    compteur = registre.compteur('evenements_total', 'Événements', ('type',))
+    # Beaucoup de threads courts : inscriptions pendant les lectures
+    nb_threads, nb_inc = 300, 100
+    depart = threading.Event()
+    fini = threading.Event()
+
+    def incrementer():
+        for _ in range(nb_inc):
+            compteur.inc(type='a')
+
+    def lire():
+        depart.wait()
+        while not fini.is_set():
+            registre.exposition()
+
+    lecteurs = [threading.Thread(target=lire) for _ in range(2)]
+    for t in lecteurs:
+        t.start()
+    depart.set()
+    threads = []
+    for _ in range(nb_threads):
+        t = threading.Thread(target=incrementer)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    fini.set()
+    for t in lecteurs:
+        t.join()
+
+    assert registre.totaux()[('test_evenements_total', ('a',))] == nb_threads * nb_inc
+    assert f'test_evenements_total{{type="a"}} {nb_threads * nb_inc}' in registre.exposition()
+
+
+def test_threads_termines_fusionnes_sans_lecture():
+    registre = Registre('test')
+    compteur = registre.compteur('requetes_total', 'Requêtes')
+    for _ in range(200):
+        t = threading.Thread(target=compteur.inc)
+        t.start()
+        t.join()
+    # Chaque inscription fusionne les threads terminés : la liste reste bornée
+    assert len(registre._fragments) <= 2
+    assert registre.totaux()[('test_requetes_total', ())] == 200
+
+
+@pytest.mark.parametrize('url', ['/api/_metrics/websocket', '/api/_metrics/sql'])
+def test_metriques_internes_reservees_aux_admins(crm, client, nouvel_employe, url):
+    employe_id, _ = nouvel_employe()
+    with crm.app.app_context():
+        # Identifiant hors de la plage des admins : load_user cherche d'abord un Admin
+        user_id = (crm.db.session.query(crm.db.func.max(crm.Admin.id)).scalar() or 0) + 1000 + employe_id
+        compte = crm.EmployeUser(id=user_id, employe_id=employe_id, email=f'{os.urandom(4).hex()}@test.local')
+        compte.set_password('secret')
+        crm.db.session.add(compte)
+        crm.db.session.commit()
+    employe = crm.app.test_client()
+    with employe.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    assert employe.get(url).status_code == 403
+    assert client.get(url).status_code == 200
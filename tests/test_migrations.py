@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Migrations : base antérieure au versionnement, avec pointages en double"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+import sqlalchemy
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOUVELLES_TABLES = {'badge_hors_ligne', 'position_employe', 'indicateur_cumule', 'compteur',
+                    'archive_annee', 'schema_version'}
+
+
+def migrer(chemin, dossier):
+    """Lance migrer() dans un processus séparé sur la base `chemin`"""
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{chemin}', ARCHIVE_DIR=os.path.join(dossier, 'archives'))
+    env.pop('TEST_DATABASE_URL', None)
+    code = 'import app\nwith app.app.app_context(): print(app.migrer())'
+    return subprocess.run([sys.executable, '-c', code], cwd=RACINE, env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+@pytest.fixture
+def base_ancienne(crm, sqlite_uniquement, tmp_path):
+    """Base créée avant schema_version : anciennes tables, sans index unique ni index de recherche"""
+    chemin = str(tmp_path / 'ancienne.db')
+    moteur = sqlalchemy.create_engine(f'sqlite:///{chemin}')
+    with moteur.begin() as connection:
+        for table in crm.db.metadata.sorted_tables:
+            if table.name not in NOUVELLES_TABLES:
+                table.create(connection)  # sans l'événement after_create de la metadata (FTS)
+        connection.exec_driver_sql('DROP INDEX ux_pointage_employe_date')
+        connection.exec_driver_sql("INSERT INTO employe (id, matricule, nom, prenom, actif) VALUES (1, 'EMP001', 'A', 'B', 1)")
+        connection.exec_driver_sql("INSERT INTO client (id, nom, actif) VALUES (1, 'Ancien client', 1)")
+        for heures in (4, 3.5):
+            connection.exec_driver_sql(
+                f"INSERT INTO pointage (employe_id, date_pointage, heures_travaillees) VALUES (1, '2024-03-04', {heures})")
+    moteur.dispose()
+    return chemin, str(tmp_path)
+
+
+def test_doublons_bloquent_puis_migration_complete(base_ancienne):
+    chemin, dossier = base_ancienne
+    resultat = migrer(chemin, dossier)
+    assert resultat.returncode != 0
+    assert 'plusieurs pointages' in resultat.stderr and 'employe_id=1' in resultat.stderr
+
+    base = sqlite3.connect(chemin)
+    # L'étape 1 est acquise, l'étape 2 annulée : aucune donnée perdue
+    assert base.execute('SELECT version FROM schema_version').fetchall() == [(1,)]
+    assert base.execute('SELECT count(*) FROM pointage').fetchone() == (2,)
+    # Fusion manuelle des doublons puis relance
+    base.execute("UPDATE pointage SET heures_travaillees = 7.5 WHERE id = 1")
+    base.execute("DELETE FROM pointage WHERE id = 2")
+    base.commit()
+
+    resultat = migrer(chemin, dossier)
+    assert resultat.returncode == 0, resultat.stderr
+    assert resultat.stdout.strip().splitlines()[-1] == '[2, 3, 4]'
+    assert base.execute('SELECT version FROM schema_version ORDER BY version').fetchall() == [(1,), (2,), (3,), (4,)]
+    index = {ligne[1] for ligne in base.execute("SELECT type, name FROM sqlite_master WHERE type = 'index'")}
+    assert 'ux_pointage_employe_date' in index
+    with pytest.raises(sqlite3.IntegrityError):
+        base.execute("INSERT INTO pointage (employe_id, date_pointage) VALUES (1, '2024-03-04')")
+    # Index de recherche rempli avec les données existantes
+    assert base.execute("SELECT titre FROM recherche_index WHERE recherche_index MATCH 'ancien*'").fetchall() == \
+        [('Ancien client',)]
+    base.close()
+
+    # Relance sur une base à jour : rien à faire
+    resultat = migrer(chemin, dossier)
+    assert resultat.returncode == 0 and resultat.stdout.strip().splitlines()[-1] == '[]'
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Numérotation par compteur : pas de trou après rollback, pas de doublon en concurrence"""
+
+import threading
+
+
+def test_rollback_libere_le_numero(contexte):
+    crm = contexte
+    premier = crm.prochain_numero('devis', annee=2091)
+    crm.db.session.rollback()  # création abandonnée
+    assert crm.prochain_numero('devis', annee=2091) == premier == 'DEV-2091-0001'
+    crm.db.session.add(crm.Devis(numero=premier, description='Commité'))
+    crm.db.session.commit()
+    assert crm.prochain_numero('devis', annee=2091) == 'DEV-2091-0002'
+    crm.db.session.rollback()
+    assert crm.prochain_numero('devis', annee=2091) == 'DEV-2091-0002'
+    crm.db.session.rollback()
+
+
+def test_compteur_repart_du_plus_grand_numero(contexte):
+    crm = contexte
+    crm.db.session.add(crm.Devis(numero='DEV-2092-0041', description='Import'))
+    crm.db.session.commit()
+    assert crm.prochain_numero('devis', annee=2092) == 'DEV-2092-0042'
+    crm.db.session.rollback()
+
+
+def test_reservations_concurrentes_sans_doublon(crm):
+    nb_threads = 8
+    depart = threading.Barrier(nb_threads)
+    numeros, erreurs = [], []
+
+    def reserver(annuler):
+        with crm.app.app_context():
+            try:
+                depart.wait()
+                numero = crm.prochain_numero('devis', annee=2093)
+                if annuler:
+                    crm.db.session.rollback()
+                    return
+                crm.db.session.add(crm.Devis(numero=numero, description='Concurrent'))
+                crm.db.session.commit()
+                numeros.append(numero)
+            except Exception as e:
+                erreurs.append(e)
+            finally:
+                crm.db.session.remove()
+
+    threads = [threading.Thread(target=reserver, args=(i % 4 == 0,)) for i in range(nb_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert erreurs == []
+    # 6 créations commitées, 2 annulées : numéros consécutifs, sans trou ni doublon
+    assert sorted(numeros) == [f'DEV-2093-{n:04d}' for n in range(1, 7)]
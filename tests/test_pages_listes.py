@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Pages HTML de liste : nombre de requêtes SQL indépendant du nombre de lignes"""
+
+from datetime import date
+
+import pytest
+
+PAGES = ['/employes', '/clients', '/chantiers', '/devis', '/factures', '/leads',
+         '/avancements', '/absences', '/badges']
+
+
+@pytest.fixture(scope='module')
+def donnees_nombreuses(crm):
+    """40 clients avec chacun un chantier, deux factures et un devis"""
+    with crm.app.app_context():
+        for i in range(40):
+            client = crm.Client(nom=f'Client budget {i}', actif=True)
+            chantier = crm.Chantier(nom=f'Chantier budget {i}', client=client, statut='en_cours')
+            crm.db.session.add_all([client, chantier])
+            crm.db.session.flush()
+            crm.db.session.add_all([
+                crm.Facture(numero=f'FAC-BUDGET-{i}-{n}', client_id=client.id, chantier_id=chantier.id,
+                            montant_ttc=100.0 * (n + 1), statut='envoyee', date_facture=date.today())
+                for n in range(2)
+            ] + [crm.Devis(numero=f'DEV-BUDGET-{i}', client_id=client.id, description='Travaux',
+                           montant_ttc=50.0, date_devis=date.today())])
+        crm.db.session.commit()
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_page_liste_sous_budget(client, donnees_nombreuses, page):
+    # Budget actif en mode test : un N+1 lève BudgetSqlDepasse
+    assert client.get(page).status_code == 200
+
+
+def test_clients_affiche_totaux(client, donnees_nombreuses):
+    html = client.get('/clients').get_data(as_text=True)
+    assert 'Client budget 7' in html
+    assert '300 €' in html
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Historique des positions : écriture par lot sans invalider les vues en cache"""
+
+from datetime import datetime
+
+
+def test_position_sans_invalidation_employe(contexte, monkeypatch):
+    crm = contexte
+    kpis = []
+    monkeypatch.setattr(crm.pousseur_kpi, 'planifier', lambda: kpis.append(1))
+    avant = crm.versions_tables.etat(['employe'])[0]
+    maintenant = datetime.now()
+
+    crm.position_writer._ecrire([(1, maintenant, 46.2044, 6.1432), (2, maintenant, 46.21, 6.15)])
+
+    assert crm.versions_tables.etat(['employe'])[0] == avant
+    assert kpis == []
+    employe = crm.db.session.get(crm.Employe, 1)
+    assert (employe.latitude, employe.longitude) == (46.2044, 6.1432)
+    assert employe.derniere_localisation == maintenant
+
+
+def test_file_bornee_abandonne_les_plus_anciennes(crm, monkeypatch):
+    writer = crm.PositionWriter(crm.app, taille_file=3)
+    monkeypatch.setattr(writer, 'start', lambda: None)  # thread d'écriture bloqué
+    cle = ('globibat_positions_perdues_total', ())
+    avant = crm.metriques.totaux().get(cle, 0)
+    for minute in range(5):
+        writer.ajouter(1, datetime(2026, 1, 5, 8, minute), 46.2, 6.1)
+    assert writer.queue.qsize() == 3
+    assert [writer.queue.get_nowait()[1].minute for _ in range(3)] == [2, 3, 4]
+    assert crm.metriques.totaux().get(cle, 0) - avant == 2
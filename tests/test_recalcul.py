@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Recalcul groupé des heures : valeurs corrigées, lignes à jour non réécrites"""
+
+from datetime import date, datetime
+
+ANNEE = date.today().year - 1
+
+
+def pointage(crm, employe_id, jour, matin, midi, reprise, soir, **stockees):
+    h = lambda heure: datetime(ANNEE, 2, jour, *heure) if heure else None
+    p = crm.Pointage(employe_id=employe_id, date_pointage=date(ANNEE, 2, jour), arrivee_matin=h(matin),
+                     depart_midi=h(midi), arrivee_apres_midi=h(reprise), depart_soir=h(soir), **stockees)
+    crm.db.session.add(p)
+    return p
+
+
+def test_recalcul_par_lots(contexte, nouvel_employe):
+    crm = contexte
+    employe_id, _ = nouvel_employe()
+    autre_id, _ = nouvel_employe()
+    faux = dict(heures_travaillees=1, heures_supplementaires=0, retard_matin=False, retard_apres_midi=False)
+    journee = pointage(crm, employe_id, 2, (8, 0), (12, 0), (13, 0), (18, 30), **faux)
+    retards = pointage(crm, employe_id, 3, (9, 15), (12, 0), (14, 30), (17, 0), **faux)
+    incomplet = pointage(crm, employe_id, 4, (8, 0), None, None, None, **faux)
+    juste = pointage(crm, employe_id, 5, (8, 0), (12, 0), (13, 0), (17, 0), heures_travaillees=8,
+                     heures_supplementaires=0, retard_matin=False, retard_apres_midi=False)
+    hors_filtre = pointage(crm, autre_id, 2, (8, 0), (12, 0), None, None, **faux)
+    crm.db.session.commit()
+
+    resultat = crm.recalculer_pointages(date(ANNEE, 2, 1), date(ANNEE, 2, 28), employe_id, taille_lot=2)
+    assert (resultat['pointages'], resultat['modifies']) == (4, 3)
+
+    crm.db.session.expire_all()
+    valeurs = lambda p: (p.heures_travaillees, p.heures_supplementaires, p.retard_matin, p.retard_apres_midi)
+    assert valeurs(journee) == (9.5, 1.5, False, False)
+    assert valeurs(retards) == (5.25, 0, True, True)
+    assert valeurs(incomplet) == (0, 0, False, False)
+    assert valeurs(juste) == (8, 0, False, False)
+    assert valeurs(hors_filtre) == (1, 0, False, False)  # autre employé non recalculé
+
+    # Deuxième passage : tout est à jour, rien n'est réécrit
+    resultat = crm.recalculer_pointages(date(ANNEE, 2, 1), date(ANNEE, 2, 28), employe_id, taille_lot=2)
+    assert resultat['modifies'] == 0
+
+
+def test_recalcul_periode_invalide(client):
+    r = client.post('/api/admin/pointages/recalcul', json={'debut': f'{ANNEE}-03-31', 'fin': f'{ANNEE}-03-01'})
+    assert r.status_code == 400
+    r = client.post('/api/admin/pointages/recalcul', json={'debut': f'{ANNEE}-03-01', 'fin': f'{ANNEE}-03-31'})
+    assert r.status_code == 200 and r.get_json()['success'] is True
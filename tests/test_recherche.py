@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Recherche globale FTS5 : index tenu à jour par les triggers (insert, update, delete)"""
+
+import pytest
+
+
+@pytest.fixture
+def chercher(client):
+    def chercher(q, type_='lead'):
+        r = client.get(f'/api/search?q={q}&type={type_}')
+        assert r.status_code == 200
+        return [(resultat['id'], resultat['titre']) for resultat in r.get_json()]
+    return chercher
+
+
+def entrees_index(crm, lead_id):
+    return crm.db.session.execute(crm.db.text(
+        'SELECT count(*) FROM recherche_index WHERE rowid = :rowid'), {'rowid': lead_id * 8 + 2}).scalar()
+
+
+def test_triggers_update_delete(contexte, sqlite_uniquement, chercher):
+    crm = contexte
+    lead = crm.Lead(nom='Zorblatt Toitures', entreprise='Ardoises Quenelec')
+    crm.db.session.add(lead)
+    crm.db.session.commit()
+    lead_id = lead.id
+    assert chercher('zorbl') == [(lead_id, 'Zorblatt Toitures')]
+    assert chercher('quenelec') == [(lead_id, 'Zorblatt Toitures')]
+
+    # UPDATE ORM : l'ancien titre disparaît, le nouveau est trouvé, une seule entrée
+    lead.nom = 'Vimbrelle Couverture'
+    crm.db.session.commit()
+    assert chercher('zorblatt') == []
+    assert chercher('vimbrelle') == [(lead_id, 'Vimbrelle Couverture')]
+    assert entrees_index(crm, lead_id) == 1
+
+    # UPDATE en SQL brut : couvert aussi par le trigger
+    crm.db.session.execute(crm.db.text("UPDATE lead SET entreprise = 'Tuiles Faranvol' WHERE id = :id"),
+                           {'id': lead_id})
+    crm.db.session.commit()
+    assert chercher('quenelec') == []
+    assert chercher('faranvol') == [(lead_id, 'Vimbrelle Couverture')]
+
+    crm.db.session.delete(lead)
+    crm.db.session.commit()
+    assert chercher('vimbrelle') == []
+    assert entrees_index(crm, lead_id) == 0
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Résumé des présences : badges en ordre chronologique, sans doublon après reconstruction"""
+
+from datetime import date, datetime, time
+
+
+def badge_commite(crm, matricule, type_badge='matin'):
+    code, _, badge = crm.enregistrer_badge({'matricule': matricule, 'type': type_badge}, datetime.now())
+    assert code == 200
+    crm.db.session.commit()
+    return badge
+
+
+def test_badge_relu_par_reconstruction_non_duplique(contexte, nouvel_employe):
+    crm = contexte
+    _, matricule = nouvel_employe()
+    badge = badge_commite(crm, matricule)
+    resume = crm.ResumePresence(taille_historique=500)
+    # Reconstruction entre le commit du badge et sa diffusion : le badge est déjà relu en base
+    resume.snapshot(date.today())
+    resume.enregistrer(badge)
+    _, recents = resume.snapshot(date.today())
+    assert [(b.pointage_id, b.type) for b in recents].count((badge.pointage_id, badge.type)) == 1
+
+
+def test_badge_hors_ligne_insere_a_sa_place(contexte, nouvel_employe):
+    crm = contexte
+    _, matricule = nouvel_employe()
+    badge = badge_commite(crm, matricule)
+    resume = crm.ResumePresence(taille_historique=500)
+    resume.snapshot(date.today())
+    # Badge d'un lot hors ligne, plus ancien que tous ceux du jour
+    ancien = badge._replace(type='depart_midi', timestamp=datetime.combine(date.today(), time.min),
+                            pointage_id=None)
+    resume.enregistrer(ancien)
+    _, recents = resume.snapshot(date.today())
+    horodatages = [b.timestamp for b in recents]
+    assert horodatages == sorted(horodatages, reverse=True)
+    assert recents[-1] is ancien
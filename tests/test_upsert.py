@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Upserts portables : pointage du jour unique (y compris en concurrence), moteur non pris en charge refusé"""
+
+import threading
+from datetime import date
+
+import pytest
+
+
+def test_pointage_du_jour_idempotent(contexte, nouvel_employe):
+    crm = contexte
+    employe_id, _ = nouvel_employe()
+    premier = crm.pointage_du_jour(employe_id, date.today())
+    second = crm.pointage_du_jour(employe_id, date.today())
+    crm.db.session.commit()
+    assert premier.id == second.id
+    assert crm.db.session.query(crm.Pointage).filter_by(employe_id=employe_id).count() == 1
+
+
+def test_pointage_du_jour_concurrent(crm, nouvel_employe):
+    employe_id, _ = nouvel_employe()
+    nb_threads = 8
+    depart = threading.Barrier(nb_threads)
+    ids, erreurs = [], []
+
+    def creer():
+        with crm.app.app_context():
+            try:
+                depart.wait()
+                ids.append(crm.pointage_du_jour(employe_id, date.today()).id)
+                crm.db.session.commit()
+            except Exception as e:
+                erreurs.append(e)
+            finally:
+                crm.db.session.remove()
+
+    threads = [threading.Thread(target=creer) for _ in range(nb_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert erreurs == []
+    assert len(ids) == nb_threads and len(set(ids)) == 1
+    with crm.app.app_context():
+        assert crm.db.session.query(crm.Pointage).filter_by(employe_id=employe_id).count() == 1
+
+
+def test_moteur_non_pris_en_charge(contexte, monkeypatch):
+    crm = contexte
+    monkeypatch.setattr(crm.db.engine.dialect, 'name', 'mssql')
+    with pytest.raises(RuntimeError, match='mssql non pris en charge'):
+        crm.insert_upsert()
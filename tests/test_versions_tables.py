@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Versions de tables (ETag / KPIs) : écritures comptées et écrivains exclus"""
+
+
+def version(crm, table):
+    return crm.versions_tables.etat([table])[0][0]
+
+
+def test_ecriture_incremente_version_au_commit(contexte):
+    crm = contexte
+    avant = version(crm, 'employe')
+    crm.db.session.execute(crm.db.update(crm.Employe).where(crm.Employe.id == 1).values(telephone='0600000000'))
+    assert version(crm, 'employe') == avant
+    crm.db.session.commit()
+    assert version(crm, 'employe') == avant + 1
+
+
+def test_ecriture_exclue_ne_change_pas_la_version(contexte):
+    crm = contexte
+    avant = version(crm, 'employe')
+    crm.db.session.execute(
+        crm.db.update(crm.Employe).where(crm.Employe.id == 1).values(telephone='0600000001')
+        .execution_options(version_tables=False)
+    )
+    crm.db.session.commit()
+    assert version(crm, 'employe') == avant
+
+
+def test_etag_inchange_apres_ecriture_exclue(crm, client):
+    etag = client.get('/api/employes?limit=5').headers['ETag']
+    with crm.app.app_context():
+        crm.db.session.execute(
+            crm.db.update(crm.Employe).values(latitude=46.2).execution_options(version_tables=False))
+        crm.db.session.commit()
+    assert client.get('/api/employes?limit=5', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_if_modified_since_ignore_apres_ecriture_meme_seconde(crm, client):
+    r = client.get('/api/clients?limit=1000')
+    derniere_modif = r.headers['Last-Modified']
+    nom = 'Client écrit dans la même seconde'
+    assert client.post('/api/clients', json={'nom': nom}).get_json()['success']
+    r = client.get('/api/clients?limit=1000', headers={'If-Modified-Since': derniere_modif})
+    assert r.status_code == 200
+    assert nom in [c['nom'] for c in r.get_json()]
+
+
+def test_etag_desactive_plusieurs_workers(crm, client, monkeypatch):
+    monkeypatch.setitem(crm.app.config, 'ETAG_ACTIF', False)
+    r = client.get('/api/employes?limit=5')
+    assert r.status_code == 200
+    assert 'ETag' not in r.headers
+    assert client.get('/api/employes?limit=5', headers={'If-None-Match': '*'}).status_code == 200